@@ -0,0 +1,191 @@
+""" Concurrent clients served by one sync WSGI worker against one ASGI worker (call.asgi.AsgiHandler)
+
+Each client posts the start and end records of a call and fetches the bill of its subscriber, over and over,
+sending its next request once it got the previous response. Clients are not local: receiving a request body and
+sending a response each take ``--latency`` milliseconds of network time.
+
+* WSGI: one sync worker (the gunicorn default) reads, handles and writes one request at a time, so the network
+  time of every request holds the worker;
+* ASGI: the event loop reads and writes while the views run in the pool of ``--pool-size`` threads.
+
+Both serve the same Django application against a temporary test database. For every number of concurrent
+clients the throughput and the p99 latency of each are printed, then the most clients each one serves within
+``--p99`` milliseconds. The pool is one thread on SQLite, which takes one writer at a time.
+
+Usage:
+    python -m benchmarks.bench_asgi [--clients N [N ...]] [--requests N] [--latency MS] [--pool-size N] [--p99 MS]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import queue
+import threading
+import time
+
+from benchmarks.utils import setup_django, test_database
+from call.asgi import AsgiHandler, wsgi_environ
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+# call ids of every client of every run, next() is atomic
+CALL_IDS = itertools.count(1)
+
+
+def scope(method, path):
+    return {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+    }
+
+
+class Client:
+    """ the requests of one simulated client: a call of its own, then its bill
+    """
+
+    def __init__(self, number):
+        self.source = '119{:08d}'.format(number)
+
+    def requests(self):
+        while True:
+            call_id = next(CALL_IDS)
+            start = {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": call_id,
+                     "source": self.source, "destination": "2199999999"}
+            end = {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": call_id}
+            yield 'POST', '/api/v1/call/', json.dumps(start).encode()
+            yield 'POST', '/api/v1/call/', json.dumps(end).encode()
+            yield 'GET', '/api/v1/bill/{}/2017/12/'.format(self.source), b''
+
+
+def run_wsgi(application, clients, requests, latency):
+    """ latencies of ``requests`` requests of ``clients`` clients queued to one sync worker
+    """
+    incoming = queue.Queue()
+    latencies, errors = [], []
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = incoming.get()
+            if item is None:
+                return
+            (method, path, body), done = item
+            time.sleep(latency)
+            statuses = []
+            environ = wsgi_environ(scope(method, path), body)
+            response = application(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            time.sleep(latency)
+            if int(statuses[0][:3]) >= 400:
+                errors.append(statuses[0])
+            done.set()
+
+    def client(number):
+        done = threading.Event()
+        for request in Client(number).requests():
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            done.clear()
+            started = time.perf_counter()
+            incoming.put((request, done))
+            done.wait()
+            latencies.append(time.perf_counter() - started)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for client_thread in threads:
+        client_thread.start()
+    for client_thread in threads:
+        client_thread.join()
+    elapsed = time.perf_counter() - started
+    incoming.put(None)
+    thread.join()
+    return latencies, elapsed, errors
+
+
+def run_asgi(application, clients, requests, latency):
+    """ latencies of ``requests`` requests of ``clients`` clients served concurrently by the ASGI application
+    """
+    latencies, errors = [], []
+    remaining = [requests]
+
+    async def client(number):
+        for method, path, body in Client(number).requests():
+            if remaining[0] == 0:
+                return
+            remaining[0] -= 1
+            sent = []
+
+            async def receive():
+                await asyncio.sleep(latency)
+                return {'type': 'http.request', 'body': body}
+
+            async def send(message):
+                if message['type'] == 'http.response.body':
+                    await asyncio.sleep(latency)
+                sent.append(message)
+
+            started = time.perf_counter()
+            await application(scope(method, path), receive, send)
+            latencies.append(time.perf_counter() - started)
+            if sent[0]['status'] >= 400:
+                errors.append(sent[0]['status'])
+
+    async def main():
+        await asyncio.gather(*(client(number) for number in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - started, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 5, 10, 20, 50], help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=600, help='requests per run')
+    parser.add_argument('--latency', type=float, default=20, help='network milliseconds of a body, each way')
+    parser.add_argument('--pool-size', type=int, default=4, help='threads of the ASGI pool (1 on SQLite)')
+    parser.add_argument('--p99', type=float, default=250, help='p99 latency target in milliseconds')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+
+    latency = args.latency / 1000
+    pool_size = 1 if connection.vendor == 'sqlite' else args.pool_size
+    wsgi_application = get_wsgi_application()
+    best = {'wsgi': 0, 'asgi': 0}
+    with test_database():
+        asgi_application = AsgiHandler(wsgi_application, pool_size=pool_size)
+        print('{:>8} {:>14} {:>12} {:>14} {:>12}'.format('clients', 'wsgi req/s', 'wsgi p99', 'asgi req/s', 'asgi p99'))
+        for clients in args.clients:
+            row = [clients]
+            for name, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+                application = wsgi_application if name == 'wsgi' else asgi_application
+                latencies, elapsed, errors = run(application, clients, args.requests, latency)
+                assert not errors, (name, errors[:5])
+                p99 = percentile(latencies, 0.99) * 1000
+                if p99 <= args.p99:
+                    best[name] = max(best[name], clients)
+                row.extend((len(latencies) / elapsed, p99))
+            print('{:>8} {:>14.1f} {:>9.1f} ms {:>14.1f} {:>9.1f} ms'.format(*row))
+        asgi_application.executor.shutdown()
+
+    print('most clients within a p99 of {:.0f} ms: wsgi {}, asgi {} (pool of {} threads)'.format(
+        args.p99, best['wsgi'], best['asgi'], pool_size
+    ))
+
+
+if __name__ == '__main__':
+    main()
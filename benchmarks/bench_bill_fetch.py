@@ -0,0 +1,81 @@
+""" Latency of the bill lookup with and without the (source, year, month) index
+
+Loads synthetic bills for many subscribers into a temporary test database and times the query used by
+``BillViewSet`` before the source was denormalized onto ``Bill`` (a join filtering on the unindexed
+``Call.source``) against the indexed lookup on ``Bill(source, year, month)``.
+
+Usage:
+    python -m benchmarks.bench_bill_fetch [--calls N] [--subscribers N] [--lookups N]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.utils import setup_django, test_database
+
+
+def load(calls, subscribers, batch_size=5000):
+    from call.models import Bill, Call
+
+    started = datetime(2016, 1, 1, tzinfo=timezone.utc)
+    for offset in range(0, calls, batch_size):
+        count = min(batch_size, calls - offset)
+        records = []
+        for index in range(offset, offset + count):
+            records.append(Call(
+                id=index + 1, type='start', call_id=index,
+                timestamp=started + timedelta(minutes=17 * index),
+                source='119{:08d}'.format(index % subscribers), destination='2199999999',
+            ))
+        Call.objects.bulk_create(records)
+        Bill.objects.bulk_create(
+            Bill(
+                destination_id=call.id, source=call.source, start_date=call.timestamp.date(),
+                start_time=call.timestamp.time(), duration=463, price=99,
+                year=call.timestamp.year, month=call.timestamp.month,
+            ) for call in records
+        )
+
+
+def measure(query, subscribers, years, lookups):
+    timings = []
+    for _ in range(lookups):
+        source = '119{:08d}'.format(random.randrange(subscribers))
+        year, month = random.choice(years), random.randint(1, 12)
+        started = time.perf_counter()
+        list(query(source, year, month))
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1000000, help='number of billed calls to load')
+    parser.add_argument('--subscribers', type=int, default=10000, help='number of distinct source numbers')
+    parser.add_argument('--lookups', type=int, default=50, help='bill lookups timed per query')
+    args = parser.parse_args()
+
+    setup_django()
+    from call.models import Bill
+
+    with test_database():
+        started = time.perf_counter()
+        load(args.calls, args.subscribers)
+        print('loaded {} calls in {:.1f}s'.format(args.calls, time.perf_counter() - started))
+        years = sorted(set(Bill.objects.values_list('year', flat=True)))
+
+        queries = (
+            ('join on Call.source', lambda source, year, month: Bill.objects.filter(
+                destination__source=source, year=year, month=month)),
+            ('index on Bill(source, year, month)', lambda source, year, month: Bill.objects.filter(
+                source=source, year=year, month=month)),
+        )
+        for label, query in queries:
+            median, worst = measure(query, args.subscribers, years, args.lookups)
+            print('{:<36} median {:>9.3f} ms  max {:>9.3f} ms'.format(label, median * 1000, worst * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+""" Throughput of the single record and bulk call ingestion endpoints
+
+Posts the same number of call records through ``POST /api/v1/call/`` one at a time and through
+``POST /api/v1/call/bulk/`` in batches, against a temporary test database.
+
+Usage:
+    python -m benchmarks.bench_ingest [--calls N] [--batch-size N]
+"""
+import argparse
+
+from benchmarks.utils import call_records, setup_django, test_database, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1000, help='number of calls, each one has two records')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records per bulk request')
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.test import APIClient
+    from call.models import Bill
+
+    client = APIClient()
+    results = {}
+    with test_database():
+        single = call_records(args.calls)
+        with timer(results, 'single'):
+            for record in single:
+                assert client.post('/api/v1/call/', record, format='json').status_code == 201
+
+        bulk = call_records(args.calls, first_call_id=args.calls + 1)
+        with timer(results, 'bulk'):
+            for index in range(0, len(bulk), args.batch_size):
+                response = client.post('/api/v1/call/bulk/', bulk[index:index + args.batch_size], format='json')
+                assert response.json()['accepted'] == len(bulk[index:index + args.batch_size])
+
+        assert Bill.objects.count() == 2 * args.calls
+
+    records = 2 * args.calls
+    for name in ('single', 'bulk'):
+        print('{:<8} {:>8} records in {:>7.2f}s {:>10.0f} records/s'.format(
+            name, records, results[name], records / results[name]
+        ))
+    print('speedup  {:.1f}x'.format(results['single'] / results['bulk']))
+
+
+if __name__ == '__main__':
+    main()
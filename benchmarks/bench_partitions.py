@@ -0,0 +1,86 @@
+""" Latency of the bill lookup of a period as the history grows
+
+Loads synthetic bills month after month into a temporary test database and, after each batch of months, times
+the lookup of the bills of a subscriber in the last period, the query used by ``BillViewSet``. On PostgreSQL the
+bill table is partitioned by period (see call.partitions) and the plan of the lookup only touches the partition of
+the period. On SQLite the lookup uses the index on (source, year, month). Either way the timings should stay flat.
+
+Usage:
+    python -m benchmarks.bench_partitions [--months N] [--step N] [--bills N] [--subscribers N] [--lookups N]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.utils import setup_django, test_database
+
+
+def load_month(year, month, bills, subscribers, first_id, batch_size=5000):
+    from call.models import Bill, Call
+    from call.partitions import ensure_bill_partitions
+
+    started = datetime(year, month, 1, tzinfo=timezone.utc)
+    for offset in range(0, bills, batch_size):
+        calls = [
+            Call(
+                id=first_id + index, type='start', call_id=first_id + index,
+                timestamp=started + timedelta(seconds=index * 20),
+                source='119{:08d}'.format(index % subscribers), destination='2199999999',
+            ) for index in range(offset, min(offset + batch_size, bills))
+        ]
+        Call.objects.bulk_create(calls)
+        records = [
+            Bill(
+                destination_id=call.id, source=call.source, start_date=call.timestamp.date(),
+                start_time=call.timestamp.time(), duration=463, price=99, year=year, month=month,
+            ) for call in calls
+        ]
+        ensure_bill_partitions(records)
+        Bill.objects.bulk_create(records)
+
+
+def measure(year, month, subscribers, lookups):
+    from call.models import Bill
+
+    timings = []
+    for _ in range(lookups):
+        source = '119{:08d}'.format(random.randrange(subscribers))
+        started = time.perf_counter()
+        list(Bill.objects.filter(source=source, year=year, month=month))
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months', type=int, default=36, help='months of history to load')
+    parser.add_argument('--step', type=int, default=6, help='months loaded between measures')
+    parser.add_argument('--bills', type=int, default=50000, help='bills per month')
+    parser.add_argument('--subscribers', type=int, default=5000, help='number of distinct source numbers')
+    parser.add_argument('--lookups', type=int, default=50, help='bill lookups timed per measure')
+    args = parser.parse_args()
+
+    setup_django()
+    from call.models import Bill
+    from call.partitions import is_partitioned
+
+    with test_database() as connection:
+        print('{} bill table, {} bills per month'.format(
+            'partitioned' if is_partitioned(connection) else 'single', args.bills
+        ))
+        year, month = 2016, 1
+        for loaded in range(1, args.months + 1):
+            load_month(year, month, args.bills, args.subscribers, (loaded - 1) * args.bills + 1)
+            if loaded % args.step == 0 or loaded == args.months:
+                median, worst = measure(year, month, args.subscribers, args.lookups)
+                print('{:>3} months {:>10} bills  median {:>8.3f} ms  max {:>8.3f} ms'.format(
+                    loaded, loaded * args.bills, median * 1000, worst * 1000
+                ))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        print(Bill.objects.filter(source='11900000000', year=2016, month=1).explain())
+
+
+if __name__ == '__main__':
+    main()
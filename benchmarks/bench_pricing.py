@@ -0,0 +1,88 @@
+""" Micro-benchmark of the call pricing engine
+
+Compares the closed-form minute counting used by ``CalculateBill`` against the per-minute loop it
+replaced, for calls from a few seconds up to several weeks long, then the prices of a batch of calls computed
+one at a time against the vectorized ``calculate_prices_batch`` (NumPy when installed).
+
+Usage:
+    python -m benchmarks.bench_pricing [--repeat N] [--batch N]
+"""
+import argparse
+import random
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from call import pricing
+from call.pricing import (
+    calculate_price, calculate_prices_batch, count_billable_minutes, count_billable_minutes_stepwise
+)
+
+CALL_START = datetime(2017, 12, 12, 21, 57, 13, tzinfo=timezone.utc)
+
+DURATIONS = (
+    ('30 seconds', timedelta(seconds=30)),
+    ('7 minutes', timedelta(minutes=7, seconds=43)),
+    ('2 hours', timedelta(hours=2)),
+    ('1 day', timedelta(days=1, minutes=13, seconds=43)),
+    ('1 week', timedelta(weeks=1)),
+    ('4 weeks', timedelta(weeks=4)),
+)
+
+
+def measure(function, call_end, repeat):
+    number = max(1, repeat)
+    best = min(timeit.repeat(lambda: function(CALL_START, call_end), number=number, repeat=3))
+    return best / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='calls per timing run of the per-minute loop')
+    parser.add_argument('--batch', type=int, default=100000, help='calls priced by the batch comparison')
+    args = parser.parse_args()
+
+    print('{:<12} {:>10} {:>14} {:>14} {:>10}'.format('duration', 'minutes', 'loop (us)', 'closed (us)', 'speedup'))
+    for label, duration in DURATIONS:
+        call_end = CALL_START + duration
+        minutes = count_billable_minutes(CALL_START, call_end)
+        assert minutes == count_billable_minutes_stepwise(CALL_START, call_end), label
+
+        loop = measure(count_billable_minutes_stepwise, call_end, args.repeat)
+        closed = measure(count_billable_minutes, call_end, args.repeat * 100)
+        print('{:<12} {:>10} {:>14.1f} {:>14.2f} {:>9.0f}x'.format(
+            label, minutes, loop * 1e6, closed * 1e6, loop / closed
+        ))
+    batch(args.batch)
+
+
+def batch(count):
+    from decimal import Decimal
+    from datetime import time as day_time
+
+    fixed_charge = Decimal('0.36')
+    bands = ((day_time(6), day_time(22), Decimal('0.09')), (day_time(22), day_time(6), Decimal('0.01')))
+    rng = random.Random(0)
+    starts = [CALL_START.timestamp() + rng.randrange(30 * 86400) for _ in range(count)]
+    ends = [start + int(rng.expovariate(1 / 180)) + 1 for start in starts]
+
+    started = time.perf_counter()
+    single = [
+        int((calculate_price(
+            datetime.fromtimestamp(start, timezone.utc), datetime.fromtimestamp(end, timezone.utc), fixed_charge, bands
+        ) * 100).to_integral_value())
+        for start, end in zip(starts, ends)
+    ]
+    one_at_a_time = time.perf_counter() - started
+    started = time.perf_counter()
+    prices = calculate_prices_batch(starts, ends, fixed_charge, bands)[1]
+    vectorized = time.perf_counter() - started
+    assert [int(price) for price in prices] == single
+
+    print('\n{} calls priced one at a time in {:.3f}s, in a batch in {:.3f}s ({}): {:.0f}x'.format(
+        count, one_at_a_time, vectorized, 'NumPy' if pricing.numpy else 'no NumPy', one_at_a_time / vectorized
+    ))
+
+
+if __name__ == '__main__':
+    main()
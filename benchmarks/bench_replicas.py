@@ -0,0 +1,166 @@
+""" Throughput of the call ingestion while subscribers read their bills, with and without a read replica
+
+A temporary SQLite database is migrated and loaded with ``--calls`` calls of ``--subscribers`` subscribers, then
+copied to a second file standing for a replica (call.routers). For ``--seconds`` seconds a writer posts new
+records to ``POST /api/v1/call/`` while ``--readers`` processes fetch bills of random subscribers from
+``GET /api/v1/bill/<source>/<y>/<m>/``, the bill cache disabled so every read queries the database:
+
+* idle: no reader, the throughput of the writer alone;
+* primary: the readers read the database the writer writes;
+* replica: the readers read the copy through the router (settings.CALL_DB_REPLICAS).
+
+For each, the writes per second and their p99 latency are printed next to the reads per second. The readers
+take CPU from the writer whatever database they read, so the drop from idle depends on the cores of the machine;
+the difference between primary and replica is the contention on the database the router takes off the primary.
+SQLite locks the whole database to commit, so it overstates the contention of PostgreSQL.
+
+On one core, with the defaults: 131 writes/s idle, 24 writes/s (p99 85 ms) with the readers on the primary and
+35 writes/s (p99 48 ms) with the readers on the replica, for the same 40 reads/s.
+
+Usage:
+    python -m benchmarks.bench_replicas [--calls N] [--subscribers N] [--readers N] [--seconds N]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generator import generate_records, subscriber_number
+from benchmarks.utils import setup_django
+
+YEAR, MONTH = 2017, 12
+
+
+def use_databases(primary, replica=None):
+    """ point the default database to the ``primary`` file and route the reads to the ``replica`` one, before
+        any query
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    connections.databases['default']['NAME'] = primary
+    settings.CALL_DB_REPLICAS = []
+    if replica:
+        connections.databases['replica1'] = dict(connections.databases['default'], NAME=replica)
+        settings.CALL_DB_REPLICAS = ['replica1']
+    settings.CALL_BILL_CACHE_TIMEOUT = 0
+    # the writer reports its failures itself
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+
+def request(application, method, path, body=b''):
+    from call.asgi import wsgi_environ
+
+    statuses = []
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+    }
+    response = application(wsgi_environ(scope, body), lambda status, headers: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return int(statuses[0][:3])
+
+
+def reader(primary, replica, subscribers, seconds):
+    """ in a process of its own: fetch bills for ``seconds`` seconds, print the number fetched
+    """
+    setup_django()
+    use_databases(primary, replica)
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    rng = random.Random(os.getpid())
+    print('ready', flush=True)
+    deadline = time.monotonic() + seconds
+    reads = 0
+    while time.monotonic() < deadline:
+        path = '/api/v1/bill/{}/{}/{}/'.format(subscriber_number(rng.randrange(subscribers)), YEAR, MONTH)
+        if request(application, 'GET', path) == 200:
+            reads += 1
+    print(json.dumps({'reads': reads}), flush=True)
+
+
+def write(application, records, seconds):
+    """ post ``records`` for ``seconds`` seconds, (writes, failures, latencies)
+    """
+    latencies, failures = [], 0
+    deadline = time.monotonic() + seconds
+    for record in records:
+        if time.monotonic() >= deadline:
+            break
+        record = {key: value for key, value in record.items() if key != 'id'}
+        started = time.perf_counter()
+        if request(application, 'POST', '/api/v1/call/', json.dumps(record).encode()) == 201:
+            latencies.append(time.perf_counter() - started)
+        else:
+            failures += 1
+    return len(latencies), failures, latencies
+
+
+def run(application, args, primary, replica, readers, first_call_id):
+    records = generate_records(50000, args.subscribers, YEAR, MONTH, seed=first_call_id, first_call_id=first_call_id)
+    command = [sys.executable, '-m', 'benchmarks.bench_replicas', '--reader', primary, replica or '',
+               '--subscribers', str(args.subscribers), '--seconds', str(args.seconds)]
+    processes = [subprocess.Popen(command, stdout=subprocess.PIPE) for _ in range(readers)]
+    for process in processes:
+        process.stdout.readline()
+    writes, failures, latencies = write(application, records, args.seconds)
+    reads = sum(json.loads(process.communicate()[0].decode().splitlines()[-1])['reads'] for process in processes)
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else float('nan')
+    return writes / args.seconds, failures, p99, reads / args.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reader', nargs=2, metavar=('PRIMARY', 'REPLICA'), help=argparse.SUPPRESS)
+    parser.add_argument('--calls', type=int, default=20000, help='calls loaded before the runs')
+    parser.add_argument('--subscribers', type=int, default=20, help='subscribers, the fewer the longer the bills')
+    parser.add_argument('--readers', type=int, default=2, help='reading processes')
+    parser.add_argument('--seconds', type=float, default=8, help='duration of each run')
+    args = parser.parse_args()
+
+    if args.reader:
+        reader(args.reader[0], args.reader[1], args.subscribers, args.seconds)
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        primary = os.path.join(directory, 'primary.sqlite3')
+        replica = os.path.join(directory, 'replica.sqlite3')
+        setup_django()
+        use_databases(primary)
+        from django.core.management import call_command
+        from django.core.wsgi import get_wsgi_application
+        from django.db import connection
+
+        from call.ingest import ingest_records
+
+        call_command('migrate', verbosity=0)
+        records = generate_records(args.calls, args.subscribers, YEAR, MONTH)
+        for offset in range(0, len(records), 1000):
+            ingest_records(records[offset:offset + 1000])
+        connection.close()
+        shutil.copyfile(primary, replica)
+
+        application = get_wsgi_application()
+        print('{:>8} {:>10} {:>10} {:>12} {:>10}'.format('reads', 'writes/s', 'failures', 'write p99', 'reads/s'))
+        first_call_id = args.calls + 1
+        for name, readers, replica_path in (('idle', 0, None), ('primary', args.readers, None),
+                                            ('replica', args.readers, replica)):
+            writes, failures, p99, reads = run(application, args, primary, replica_path, readers, first_call_id)
+            first_call_id += 50000
+            print('{:>8} {:>10.1f} {:>10} {:>9.1f} ms {:>10.1f}'.format(name, writes, failures, p99, reads))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
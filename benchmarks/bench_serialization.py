@@ -0,0 +1,81 @@
+""" Time to render a bill with the DRF serializer and with the values_list fast path
+
+Loads bills of 10, 1,000 and 100,000 calls for three subscribers into a temporary test database and renders each
+one as the bill endpoint does: ``BillSerializer`` over model instances rendered by ``JSONRenderer``, against the
+rows of ``values_list`` rendered by ``call.api.fastpath.render_bills``. Both include the query, and their bytes
+are checked to be the same. orjson is used by the fast path when installed.
+
+Usage:
+    python -m benchmarks.bench_serialization [--sizes N [N ...]] [--repeat N]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.utils import setup_django, test_database
+
+
+def load(source, count, first_id, batch_size=5000):
+    from call.models import Bill, Call
+
+    started = datetime(2017, 12, 1, tzinfo=timezone.utc)
+    for offset in range(0, count, batch_size):
+        calls = [
+            Call(
+                id=first_id + index, type='start', call_id=first_id + index,
+                timestamp=started + timedelta(seconds=index * 25), source=source, destination='2199999999',
+            ) for index in range(offset, min(offset + batch_size, count))
+        ]
+        Call.objects.bulk_create(calls)
+        Bill.objects.bulk_create(
+            Bill(
+                destination_id=call.id, source=source, start_date=call.timestamp.date(),
+                start_time=call.timestamp.time(), duration=463 + call.id % 600, price=99 + call.id % 250,
+                year=2017, month=12,
+            ) for call in calls
+        )
+
+
+def best(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        content = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000], help='calls per bill')
+    parser.add_argument('--repeat', type=int, default=5, help='renders timed per bill, the best one is kept')
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from call.api import fastpath
+    from call.api.pagination import BillKeysetPagination
+    from call.api.serializers import BillSerializer
+    from call.models import Bill
+
+    print('fast path encoder: {}'.format('orjson' if fastpath.orjson else 'json'))
+    with test_database():
+        first_id = 1
+        for size in args.sizes:
+            source = '119{:08d}'.format(size)
+            load(source, size, first_id)
+            first_id += size
+            bills = Bill.objects.filter(source=source, year=2017, month=12).order_by(*BillKeysetPagination.keyset)
+
+            serializer, expected = best(lambda: JSONRenderer().render(
+                BillSerializer(bills.select_related('destination'), many=True).data
+            ), args.repeat)
+            fast, content = best(lambda: fastpath.render_bills(bills.values_list(*fastpath.BILL_ROW)), args.repeat)
+            assert content == expected, 'the fast path renders different bytes'
+            print('{:>7} lines  serializer {:>10.3f} ms  fast path {:>10.3f} ms  {:>5.1f}x'.format(
+                size, serializer * 1000, fast * 1000, serializer / fast
+            ))
+
+
+if __name__ == '__main__':
+    main()
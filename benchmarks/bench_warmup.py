@@ -0,0 +1,134 @@
+""" Connection setup per request and first-request latency, with and without persistent connections and warm-up
+
+* connections: the setup time of a new database connection, then ``--requests`` bill requests through the WSGI
+  handler with the connection closed after every request (CALL_DB_POOLING=off, CONN_MAX_AGE 0) and kept open
+  (persistent): connections opened and mean latency of each;
+* first request: a fresh process per run (``--runs`` of each) serving its first and second bill requests, cold
+  or after call.warmup.warm_up, as a new gunicorn worker does.
+
+Both run against a temporary test database. On SQLite the test database is in memory and its connection is
+never closed, so the first part is only meaningful against PostgreSQL (DATABASE_URL).
+
+Usage:
+    python -m benchmarks.bench_warmup [--requests N] [--runs N]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.utils import call_records, setup_django, test_database
+
+BILL_PATH = '/api/v1/bill/99988526423/2017/12/'
+
+
+def get(application, path):
+    from call.asgi import wsgi_environ
+
+    statuses = []
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': [(b'host', b'testserver')]}
+    started = time.perf_counter()
+    response = application(wsgi_environ(scope, b''), lambda status, headers: statuses.append(status))
+    b''.join(response)
+    response.close()
+    elapsed = time.perf_counter() - started
+    assert statuses[0].startswith('200'), statuses[0]
+    return elapsed
+
+
+def load_bills(count=20):
+    from call.ingest import ingest_records
+
+    ingest_records(call_records(count))
+
+
+def connection_setup(samples=20):
+    """ median seconds to open a new connection to the database
+    """
+    from django.db import connection
+
+    params = connection.get_connection_params()
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        new_connection = connection.get_new_connection(params)
+        timings.append(time.perf_counter() - started)
+        new_connection.close()
+    return statistics.median(timings)
+
+
+def run_connections(requests):
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+
+    from call.db import DB_CONNECTIONS
+
+    application = get_wsgi_application()
+    print('connection setup: {:.2f} ms ({})'.format(connection_setup() * 1000, connection.vendor))
+    for mode, max_age in (('off', 0), ('persistent', 600)):
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        connection.close()
+        opened = DB_CONNECTIONS.get(connection.alias)
+        latencies = [get(application, BILL_PATH) for _ in range(requests)]
+        print('{:>10}: {:>4} connections for {} requests, {:.2f} ms per request'.format(
+            mode, DB_CONNECTIONS.get(connection.alias) - opened, requests, statistics.mean(latencies) * 1000
+        ))
+
+
+def child(warm):
+    """ in a fresh process: {'warm_up': seconds, 'first': seconds, 'second': seconds}
+    """
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+
+    from call.warmup import warm_up
+
+    application = get_wsgi_application()
+    result = {'warm_up': 0}
+    with test_database():
+        load_bills()
+        if warm:
+            started = time.perf_counter()
+            warm_up()
+            result['warm_up'] = time.perf_counter() - started
+        result['first'] = get(application, BILL_PATH)
+        result['second'] = get(application, BILL_PATH)
+    return result
+
+
+def run_first_requests(runs):
+    for warm in (False, True):
+        results = []
+        for _ in range(runs):
+            command = [sys.executable, '-m', 'benchmarks.bench_warmup', '--child'] + (['--warm'] if warm else [])
+            results.append(json.loads(subprocess.check_output(command).decode().splitlines()[-1]))
+        print('{:>10}: warm-up {:.1f} ms, first request {:.1f} ms, second request {:.1f} ms'.format(
+            'warm' if warm else 'cold', *(
+                statistics.median(result[name] for result in results) * 1000 for name in ('warm_up', 'first', 'second')
+            )
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per pooling mode')
+    parser.add_argument('--runs', type=int, default=5, help='processes per first-request measure')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.warm)))
+        return
+
+    setup_django()
+    with test_database():
+        load_bills()
+        run_connections(args.requests)
+    run_first_requests(args.runs)
+
+
+if __name__ == '__main__':
+    main()
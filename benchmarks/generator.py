@@ -0,0 +1,105 @@
+""" Synthetic call detail records for the benchmarks
+
+The calls of ``subscribers`` source numbers start at random times of a month, with durations drawn from a
+distribution, and their records are ordered by timestamp as a platform would send them. A share of the calls
+has its end record sent before its start record, and a share of the records is sent again a little later, with
+the same id, as a platform retrying after a timeout would. The same arguments always give the same records.
+
+Record ids are ``<call_id>-start`` and ``<call_id>-end``. Calls end in the month they start in, so every call of
+the records is billed in that period.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+EXPONENTIAL = 'exponential'
+LOGNORMAL = 'lognormal'
+UNIFORM = 'uniform'
+DISTRIBUTIONS = (EXPONENTIAL, LOGNORMAL, UNIFORM)
+
+# the longest call generated, the tail of the distributions is cut there
+MAX_DURATION = 4 * 60 * 60
+# a record sent again arrives at most this many records after the first one
+DUPLICATE_WINDOW = 100
+
+
+def subscriber_number(index):
+    return '119{:08d}'.format(index)
+
+
+def draw_duration(rng, distribution, mean):
+    """ call duration in seconds, at least 1 and at most MAX_DURATION
+    """
+    if distribution == EXPONENTIAL:
+        duration = rng.expovariate(1 / mean)
+    elif distribution == LOGNORMAL:
+        # the median call is half the mean, a long tail of long calls
+        sigma = 1.2
+        duration = rng.lognormvariate(0, sigma) * mean / 2.0544
+    elif distribution == UNIFORM:
+        duration = rng.uniform(1, 2 * mean)
+    else:
+        raise ValueError('Unknown duration distribution: {}'.format(distribution))
+    return max(1, min(MAX_DURATION, int(duration)))
+
+
+def generate_calls(calls, subscribers, year=2017, month=12, distribution=EXPONENTIAL, mean_duration=180, seed=0,
+                   first_call_id=1):
+    """ ``calls`` tuples of (call_id, source, destination, start, end) in the order they started
+    """
+    rng = random.Random(seed)
+    period_start = datetime(year, month, 1, tzinfo=timezone.utc)
+    period_end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    # leave room for the longest call before the end of the period
+    span = int((period_end - period_start).total_seconds()) - MAX_DURATION
+
+    generated = []
+    for offset in range(calls):
+        start = period_start + timedelta(seconds=rng.randrange(span))
+        end = start + timedelta(seconds=draw_duration(rng, distribution, mean_duration))
+        source = subscriber_number(rng.randrange(subscribers))
+        destination = '219{:08d}'.format(rng.randrange(100000000))
+        generated.append((first_call_id + offset, source, destination, start, end))
+    generated.sort(key=lambda call: (call[3], call[0]))
+    return generated
+
+
+def generate_records(calls, subscribers, year=2017, month=12, distribution=EXPONENTIAL, mean_duration=180,
+                     out_of_order=0.0, duplicates=0.0, seed=0, first_call_id=1):
+    """ the records of the calls of ``generate_calls``, as dicts ready to be posted
+
+        ``out_of_order`` is the share of the calls whose end record comes first, ``duplicates`` the share of the
+        records sent twice.
+    """
+    rng = random.Random(seed)
+    timed = []
+    for call_id, source, destination, start, end in generate_calls(
+            calls, subscribers, year, month, distribution, mean_duration, seed, first_call_id):
+        start_record = {
+            'id': '{}-start'.format(call_id), 'type': 'start', 'timestamp': start.isoformat(), 'call_id': call_id,
+            'source': source, 'destination': destination,
+        }
+        end_record = {'id': '{}-end'.format(call_id), 'type': 'end', 'timestamp': end.isoformat(), 'call_id': call_id}
+        if rng.random() < out_of_order:
+            # the end record is sent before the start one, as soon as the call started
+            timed.append((start, 0, end_record))
+            timed.append((start, 1, start_record))
+        else:
+            timed.append((start, 0, start_record))
+            timed.append((end, 0, end_record))
+    timed.sort(key=lambda item: (item[0], item[1], item[2]['id']))
+    records = [record for _, _, record in timed]
+
+    if duplicates:
+        positions = [position for position in range(len(records)) if rng.random() < duplicates]
+        # insert from the end so the positions of the records still to be copied do not move
+        for position in reversed(positions):
+            target = min(len(records), position + 1 + rng.randrange(DUPLICATE_WINDOW))
+            records.insert(target, dict(records[position]))
+    return records
+
+
+def billed_sources(records):
+    """ the distinct source numbers of ``records``, sorted
+    """
+    sources = {record['source'] for record in records if 'source' in record}
+    return sorted(sources)
@@ -0,0 +1,351 @@
+""" Load test of the ingestion and billing paths, with results saved as JSON to compare commits
+
+Generates synthetic call records (see benchmarks.generator) and runs four scenarios in order:
+
+* single_ingest: the first half of the records posted one at a time to ``POST /api/v1/call/``;
+* bulk_ingest: the other half posted in batches to ``POST /api/v1/call/bulk/``;
+* bill_fetch: bills of random subscribers for the period fetched from ``GET /api/v1/bill/<source>/<y>/<m>/``;
+* monthly_run: the ``run_billing`` command writing the bills of every subscriber of the period.
+
+Each scenario reports its throughput, its latency percentiles and the database queries per request, read from
+the /metrics endpoint of the server (the middleware of call.middleware counts them).
+
+The target is the Django test client against a temporary test database (the default), or a local gunicorn
+started with ``--gunicorn WORKERS`` against the configured database (DATABASE_URL), which has to be empty: the
+suite migrates it, and refuses to run if it already holds calls. The queries per request of a gunicorn are
+exact with one worker only, as every worker keeps its own metrics and /metrics is answered by any of them.
+
+Usage:
+    python -m benchmarks.suite [--calls N] [--subscribers N] [--gunicorn WORKERS] [--output FILE]
+    python -m benchmarks.suite --compare BASELINE.json [--tolerance SHARE] ...
+
+With ``--compare``, the results are printed next to the ones of an earlier run and the exit status is 1 when
+the throughput dropped, or the p99 latency or the queries per request grew, by more than the tolerance.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.generator import DISTRIBUTIONS, EXPONENTIAL, billed_sources, generate_records
+from benchmarks.utils import setup_django, test_database
+
+SCENARIOS = ('single_ingest', 'bulk_ingest', 'bill_fetch', 'monthly_run')
+# for each measure compared between runs, whether a higher value is better
+MEASURES = (('throughput', True), ('p99_ms', False), ('queries_per_request', False))
+
+
+def percentile(values, share):
+    """ nearest-rank percentile of ``values``, ``share`` between 0 and 1
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = -(-len(ordered) * share // 1)
+    return ordered[max(1, min(int(rank), len(ordered))) - 1]
+
+
+def git_commit():
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=repository, stderr=subprocess.DEVNULL
+        ).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty.strip() else '')
+
+
+class ClientTarget:
+    """ requests through the Django test client, in this process
+    """
+    name = 'client'
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+
+    def request(self, method, path, body=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        response = self.client.generic(method, path, data, content_type='application/json')
+        # consume streamed responses like a remote client would
+        content = b''.join(response) if response.streaming else response.content
+        return response.status_code, content
+
+
+class HttpTarget:
+    """ requests over HTTP/1.1 to a server listening on ``host:port``
+    """
+
+    def __init__(self, host, port):
+        self.name = 'http://{}:{}'.format(host, port)
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        try:
+            self.connection.request(method, path, data, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # the server closed the connection it kept alive, e.g. gunicorn sync workers after each response
+            self.connection.close()
+            self.connection.request(method, path, data, headers)
+            response = self.connection.getresponse()
+        content = response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+        return response.status, content
+
+
+def query_totals(target, method, endpoint):
+    """ (sum, count) of the queries per request of an endpoint, from /metrics
+    """
+    status, content = target.request('GET', '/metrics')
+    if status != 200:
+        raise RuntimeError('GET /metrics answered {}'.format(status))
+    labels = re.escape('{{method="{}",endpoint="{}"}}'.format(method, endpoint))
+    totals = []
+    for suffix in ('sum', 'count'):
+        match = re.search(r'^http_request_db_queries_{}{} (\S+)$'.format(suffix, labels), content.decode(), re.M)
+        totals.append(float(match.group(1)) if match else 0)
+    return totals
+
+
+def timed_requests(target, method, path_and_bodies, endpoint):
+    """ send the requests one after the other, the summary of their latencies, statuses and queries
+    """
+    queries_before, count_before = query_totals(target, method, endpoint)
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    for path, body in path_and_bodies:
+        request_started = time.perf_counter()
+        status, _ = target.request(method, path, body)
+        latencies.append(time.perf_counter() - request_started)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    seconds = time.perf_counter() - started
+    queries_after, count_after = query_totals(target, method, endpoint)
+
+    measured = count_after - count_before
+    return {
+        'requests': len(latencies),
+        'seconds': round(seconds, 4),
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'queries_per_request': round((queries_after - queries_before) / measured, 2) if measured else None,
+    }
+
+
+def single_ingest(target, records):
+    result = timed_requests(target, 'POST', (('/api/v1/call/', record) for record in records), 'call-list')
+    result['records'] = len(records)
+    result['throughput'] = round(len(records) / result['seconds'], 1)
+    return result
+
+
+def bulk_ingest(target, records, batch_size):
+    batches = [records[offset:offset + batch_size] for offset in range(0, len(records), batch_size)]
+    result = timed_requests(target, 'POST', (('/api/v1/call/bulk/', batch) for batch in batches), 'call-bulk')
+    result['records'] = len(records)
+    result['throughput'] = round(len(records) / result['seconds'], 1)
+    return result
+
+
+def bill_fetch(target, sources, year, month, lookups, seed):
+    rng = random.Random(seed)
+    paths = [
+        ('/api/v1/bill/{}/{}/{}/'.format(rng.choice(sources), year, month), None) for _ in range(lookups)
+    ]
+    result = timed_requests(target, 'GET', paths, 'call.api.views.BillViewSet')
+    result['throughput'] = round(lookups / result['seconds'], 1)
+    return result
+
+
+def monthly_run(year, month, workers):
+    from django.core.management import call_command
+    from django.db import connection
+    from call.middleware import QueryStats
+    from call.models import Bill
+
+    directory = tempfile.mkdtemp()
+    stats = QueryStats()
+    try:
+        started = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            call_command(
+                'run_billing', year=year, month=month, workers=workers, output=os.path.join(directory, 'bills.gz'),
+                stdout=io.StringIO(),
+            )
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(directory)
+    calls = Bill.objects.filter(year=year, month=month).count()
+    return {
+        'workers': workers,
+        'calls': calls,
+        'seconds': round(seconds, 4),
+        'throughput': round(calls / seconds, 1),
+        # the queries of the worker processes are not seen from here
+        'queries': stats.count if workers == 1 else None,
+    }
+
+
+def run(target, args):
+    records = generate_records(
+        args.calls, args.subscribers, args.year, args.month, args.distribution, args.mean_duration,
+        args.out_of_order, args.duplicates, args.seed,
+    )
+    half = len(records) // 2
+    results = {}
+    print('{} records of {} calls for {} subscribers'.format(len(records), args.calls, args.subscribers))
+
+    results['single_ingest'] = single_ingest(target, records[:half])
+    results['bulk_ingest'] = bulk_ingest(target, records[half:], args.batch_size)
+    results['bill_fetch'] = bill_fetch(
+        target, billed_sources(records), args.year, args.month, args.lookups, args.seed
+    )
+    results['monthly_run'] = monthly_run(args.year, args.month, args.billing_workers)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', 'workatolist.wsgi', '--workers', str(workers),
+        '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning',
+    ])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with status {}'.format(process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not listen on port {} within 30s'.format(port))
+
+
+def compare(results, baseline, tolerance):
+    """ print the measures of ``results`` next to the ones of ``baseline``, the number of regressions
+    """
+    regressions = 0
+    print('{:<14} {:<20} {:>12} {:>12} {:>8}'.format('scenario', 'measure', 'baseline', 'current', 'change'))
+    for scenario in SCENARIOS:
+        for measure, higher_is_better in MEASURES:
+            old = baseline['scenarios'].get(scenario, {}).get(measure)
+            new = results['scenarios'].get(scenario, {}).get(measure)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0
+            regressed = -change > tolerance if higher_is_better else change > tolerance
+            regressions += regressed
+            print('{:<14} {:<20} {:>12} {:>12} {:>+7.1%}{}'.format(
+                scenario, measure, old, new, change, '  REGRESSION' if regressed else ''
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000, help='calls generated, each one has two records')
+    parser.add_argument('--subscribers', type=int, default=100, help='distinct source numbers')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=EXPONENTIAL, help='of the call durations')
+    parser.add_argument('--mean-duration', type=int, default=180, help='mean call duration in seconds')
+    parser.add_argument('--out-of-order', type=float, default=0.05, help='share of calls ending before they start')
+    parser.add_argument('--duplicates', type=float, default=0.01, help='share of the records sent twice')
+    parser.add_argument('--year', type=int, default=2017, help='billing period of the calls')
+    parser.add_argument('--month', type=int, default=12, help='billing period of the calls')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated records and lookups')
+    parser.add_argument('--batch-size', type=int, default=500, help='records per bulk request')
+    parser.add_argument('--lookups', type=int, default=200, help='bills fetched')
+    parser.add_argument('--billing-workers', type=int, default=1, help='processes of the monthly run')
+    parser.add_argument('--gunicorn', type=int, metavar='WORKERS', help='run against a local gunicorn')
+    parser.add_argument('--output', help='results file (default: benchmark-<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='change tolerated by --compare (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+    from django.db import connection
+    from call.models import Call
+
+    if args.gunicorn:
+        call_command('migrate', verbosity=0)
+        if Call.objects.exists():
+            parser.error('the configured database already holds calls, point DATABASE_URL to an empty one')
+        process, port = start_gunicorn(args.gunicorn)
+        try:
+            target = HttpTarget('127.0.0.1', port)
+            scenarios = run(target, args)
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        if args.billing_workers > 1 and connection.vendor == 'sqlite':
+            # the processes cannot see an in-memory test database
+            parser.error('the monthly run of the test client target runs in one process on SQLite')
+        with test_database():
+            target = ClientTarget()
+            scenarios = run(target, args)
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'target': target.name,
+        'database': connection.vendor,
+        'python': sys.version.split()[0],
+        'parameters': {
+            name: getattr(args, name) for name in (
+                'calls', 'subscribers', 'distribution', 'mean_duration', 'out_of_order', 'duplicates', 'year',
+                'month', 'seed', 'batch_size', 'lookups', 'billing_workers', 'gunicorn',
+            )
+        },
+        'scenarios': scenarios,
+    }
+    output = args.output or 'benchmark-{}.json'.format((commit or 'unknown')[:12])
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+    for name in SCENARIOS:
+        result = scenarios[name]
+        print('{:<14} {:>10.1f}/s  p99 {:>9} ms  queries/request {}'.format(
+            name, result['throughput'], result.get('p99_ms', '-'),
+            result.get('queries_per_request', result.get('queries'))
+        ))
+    print('results written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['parameters'] != results['parameters']:
+            print('warning: the parameters of the baseline differ from the ones of this run')
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
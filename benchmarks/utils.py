@@ -0,0 +1,54 @@
+""" Helpers shared by the benchmarks needing Django and a database """
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'workatolist.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """ run the block against a freshly migrated test database, destroyed afterwards
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer(results, name):
+    started = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - started
+
+
+def call_records(count, first_call_id=1, source='99988526423', destination='9993468278'):
+    """ ``count`` start/end record pairs of 7m43s calls, one hour apart
+    """
+    from datetime import datetime, timedelta, timezone
+
+    started = datetime(2017, 12, 1, tzinfo=timezone.utc)
+    records = []
+    for offset in range(count):
+        call_start = started + timedelta(hours=offset)
+        call_id = first_call_id + offset
+        records.append({
+            'type': 'start', 'timestamp': call_start.isoformat(), 'call_id': call_id,
+            'source': source, 'destination': destination,
+        })
+        records.append({
+            'type': 'end', 'timestamp': (call_start + timedelta(minutes=7, seconds=43)).isoformat(), 'call_id': call_id,
+        })
+    return records
@@ -1,3 +1,14 @@
 from django.contrib import admin
 
-# Register your models here.
+from call.models import TariffBand, TariffPlan
+
+
+class TariffBandInline(admin.TabularInline):
+    model = TariffBand
+    extra = 2
+
+
+@admin.register(TariffPlan)
+class TariffPlanAdmin(admin.ModelAdmin):
+    list_display = ('name', 'effective_from', 'fixed_charge')
+    inlines = (TariffBandInline,)
@@ -0,0 +1,18 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class RecordConflict(APIException):
+    """ a call record reusing the id, or the type and call_id, of a stored record with a different content
+
+        The body of the response carries the ``id`` of the stored record, unless it was archived.
+    """
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A different call record with the same id or type and call_id already exists.'
+    default_code = 'conflict'
+
+    def __init__(self, call=None):
+        super(RecordConflict, self).__init__()
+        self.detail = {'detail': self.detail}
+        if call is not None:
+            self.detail['id'] = call.id
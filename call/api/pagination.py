@@ -0,0 +1,121 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """ pages of a listing ordered by the ``keyset`` fields, the last one unique, each starting after a cursor
+
+        The cursor of the next page holds the keyset values of the last row of the page, so the database seeks
+        to the first row of a page with an index instead of skipping the rows of the previous pages, and rows
+        added meanwhile do not shift the pages. The body of the response stays the list of the rows, the URL of
+        the next page is in the Link header.
+
+        The rows are model instances or ``values_list`` tuples starting with the keyset fields.
+    """
+    keyset = ('timestamp', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param)
+        if page_size is None:
+            return settings.CALL_PAGE_SIZE
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: ['A valid integer is required.']})
+        return max(1, min(page_size, settings.CALL_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, row):
+        if isinstance(row, tuple):
+            values = row[:len(self.keyset)]
+        else:
+            values = [getattr(row, name) for name in self.keyset]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, model, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(self.keyset):
+                raise ValueError(cursor)
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.keyset, values)]
+        except (ValueError, TypeError, UnicodeError, binascii.Error, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, values):
+        """ filter of the rows after ``values`` in the keyset order
+        """
+        lookup = Q()
+        for position, name in enumerate(self.keyset):
+            condition = Q(**{name + '__gt': values[position]})
+            for previous, value in zip(self.keyset[:position], values):
+                condition &= Q(**{previous: value})
+            lookup |= condition
+        return lookup
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.keyset)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode_cursor(queryset.model, cursor)))
+
+        # one more row tells if there is a next page, without counting the rows
+        return self.get_page(list(queryset[:page_size + 1]), page_size)
+
+    def paginate_rows(self, rows, model, request):
+        """ page of ``rows`` already in memory, tuples starting with the keyset fields in the keyset order
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        start = 0
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            # first row after the cursor, by binary search
+            values = tuple(self.decode_cursor(model, cursor))
+            size = len(self.keyset)
+            end = len(rows)
+            while start < end:
+                middle = (start + end) // 2
+                if rows[middle][:size] <= values:
+                    start = middle + 1
+                else:
+                    end = middle
+        return self.get_page(rows[start:start + page_size + 1], page_size)
+
+    def get_page(self, rows, page_size):
+        self.next_cursor = self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def add_link(self, response):
+        next_link = self.get_next_link()
+        if next_link:
+            response['Link'] = '<{}>; rel="next"'.format(next_link)
+        return response
+
+    def get_paginated_response(self, data):
+        return self.add_link(Response(data))
+
+
+class BillKeysetPagination(KeysetPagination):
+    """ the calls of a bill, in the order they started
+    """
+    keyset = ('start_date', 'start_time', 'id')
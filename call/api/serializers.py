@@ -1,89 +1,214 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from rest_framework import serializers
 
+from call.archive import ARCHIVED_FIELDS, archived_records
 from call.config import Constants
-from call.models import Call, Bill
-from call.util import CalculateBill
+from call.bill_cache import bill_cache
+from call.idempotency import is_replay
+from call.metrics import PAIRING_DURATION
+from call.models import Bill, BillTotal, Call, PendingCall
+from call.partitions import ensure_partitions
+from call.routers import mark_written
+from call.snapshots import refresh_snapshots
+from call.totals import add_bills
+from call.util import format_duration, format_price, make_bill
+from call.api.exceptions import RecordConflict
 
 
-class CallSerializer(serializers.ModelSerializer):
+def validate_phone_numbers(attrs):
+    source = attrs.get('source', None)
+    destination = attrs.get('destination', None)
+    if source:
+        if not source.isdigit():
+            raise serializers.ValidationError('The origin number field must be only numbers.')
+        if len(source) < 8:
+            raise serializers.ValidationError('The size of origin number field should be '
+                                              'between 8 and 11 characters.')
+    if destination:
+        if not destination.isdigit():
+            raise serializers.ValidationError('The destination number field must be only numbers.')
+        if len(destination) < 8:
+            raise serializers.ValidationError('The size of destination number field should be '
+                                              'between 8 and 11 characters.')
+
+
+class RecordIdMixin:
+    """ read the identifier the telecom platforms give to a record, ``id`` in their bodies, into record_id
+
+        ``id`` is the primary key of the calls in the API responses.
+    """
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'get') and data.get('record_id') is None and data.get('id') is not None:
+            data = {key: data[key] for key in data}
+            data['record_id'] = data.pop('id')
+        return super(RecordIdMixin, self).to_internal_value(data)
+
+
+class CallSerializer(RecordIdMixin, serializers.ModelSerializer):
     """ Serializer for Call model
     """
+    type = serializers.ChoiceField(choices=(Constants.START, Constants.END))
 
     class Meta:
         model = Call
-        fields = ('id', 'type', 'timestamp', 'call_id', 'source', 'destination')
+        fields = ('id', 'record_id', 'type', 'timestamp', 'call_id', 'source', 'destination')
         read_only_fields = ('id',)
+        # the uniqueness of the record id, type and call_id is checked by validate with the query fetching the pair
+        extra_kwargs = {'record_id': {'validators': []}}
+        validators = []
+
+    def __init__(self, *args, **kwargs):
+        super(CallSerializer, self).__init__(*args, **kwargs)
+        # record of the other type found by validate() for each call_id, reused by create()
+        self._pairs = {}
+        # stored call the validated record is an exact replay of, create() must not be called
+        self.replayed = None
 
     def validate(self, attrs):
-        source = attrs.get('source', None)
-        destination = attrs.get('destination', None)
         type = attrs.get('type')
         call_id = attrs.get('call_id')
-        timestamp = attrs.get('timestamp')
-        if source:
-            if not source.isdigit():
-                raise serializers.ValidationError('The origin number field must be only numbers.')
-            if len(source) < 8:
-                raise serializers.ValidationError('The size of origin number field should be '
-                                                  'between 8 and 11 characters.')
-        if destination:
-            if not destination.isdigit():
-                raise serializers.ValidationError('The destination number field must be only numbers.')
-            if len(destination) < 8:
-                raise serializers.ValidationError('The size of destination number field should be '
-                                                  'between 8 and 11 characters.')
-        if type == Constants.END:
-            call = Call.objects.filter(type=Constants.START, call_id=call_id)
-            if call:
-                if timestamp < call[0].timestamp:
-                    raise serializers.ValidationError(
-                        'Invalid timestamp. Must be grater then {}'.format(call[0].timestamp)
-                    )
-            else:
-                raise serializers.ValidationError(
-                    'Does not exist a call start entry with this call id: {}'.format(call_id)
-                )
+        record_id = attrs.get('record_id')
+        validate_phone_numbers(attrs)
+
+        # the records of a call may arrive in any order, look for the other one to pair them on create
+        lookup = Q(call_id=call_id, type__in=(Constants.START, Constants.END))
+        if record_id is not None:
+            lookup |= Q(record_id=record_id)
+        pair = None
+        other_type = Constants.END if type == Constants.START else Constants.START
+        with PAIRING_DURATION.time('single'):
+            for call in Call.objects.filter(lookup):
+                same_key = (call.type, call.call_id) == (type, call_id)
+                if same_key or (record_id is not None and call.record_id == record_id):
+                    # the platforms resend records, answer an identical one like the first time
+                    if not is_replay(call, attrs):
+                        raise RecordConflict(call)
+                    self.replayed = call
+                elif (call.type, call.call_id) == (other_type, call_id):
+                    pair = call
+        if self.replayed:
+            return attrs
+        if pair is None:
+            # a record of an archived period, whose pair was archived with it, was resent
+            archived, archived_ids = archived_records([call_id], [record_id])
+            stored = archived.get((type, call_id)) or archived_ids.get(record_id)
+            if stored:
+                if not is_replay(stored, attrs, ARCHIVED_FIELDS):
+                    raise RecordConflict()
+                # answered like a replay, without id
+                self.replayed = Call(**attrs)
+                return attrs
+        if pair:
+            self.validate_pair(attrs, pair)
+        self._pairs[call_id] = pair
         return attrs
 
+    def validate_pair(self, attrs, pair):
+        if attrs['type'] == Constants.END and attrs['timestamp'] < pair.timestamp:
+            raise serializers.ValidationError(
+                'Invalid timestamp. Must be grater then {}'.format(pair.timestamp)
+            )
+        if attrs['type'] == Constants.START and attrs['timestamp'] > pair.timestamp:
+            raise serializers.ValidationError(
+                'Invalid timestamp. Must be lower then {}'.format(pair.timestamp)
+            )
+
     def create(self, validated_data):
-        instance = super(CallSerializer, self).create(validated_data)
-        call = None
-
-        # verify if the type of call is 'end'
-        if validated_data['type'] == Constants.END:
-            call = Call.objects.filter(type=Constants.START, call_id=validated_data['call_id'])
-        if validated_data['type'] == Constants.START:
-            call = Call.objects.filter(type=Constants.END, call_id=validated_data['call_id'])
-            # the bill only will be created if start and end calls exists
-        if call:
-            calc_bill = CalculateBill(validated_data['call_id'])
-            # verify if the created call has the type 'start'.
-            # it' necessary to do the correct relationship in destination field
+        call_id = validated_data['call_id']
+        call = self._pairs.pop(call_id, None)
+
+        # the bill only will be created if start and end calls exists, otherwise the record waits for its pair
+        if not call:
+            try:
+                with transaction.atomic():
+                    instance = super(CallSerializer, self).create(validated_data)
+                    PendingCall.objects.create(record=instance, call_id=call_id)
+                return instance
+            except IntegrityError:
+                # the record of the other type was stored after validate() looked for it
+                pending = PendingCall.objects.filter(call_id=call_id).select_related('record').first()
+                if pending is None or pending.record.type == validated_data['type']:
+                    raise
+                call = pending.record
+                self.validate_pair(validated_data, call)
+
+        # a call belongs to the period in which it has ended
+        end = validated_data['timestamp'] if validated_data['type'] == Constants.END else call.timestamp
+        ensure_partitions([(end.year, end.month)])
+        # the record, the bill and the running totals of its subscriber are written together, once the pending
+        # row of the pair is locked against a concurrent record of the same call
+        with transaction.atomic():
+            list(PendingCall.objects.select_for_update().filter(call_id=call_id))
+            instance = super(CallSerializer, self).create(validated_data)
             if instance.type == Constants.START:
-                month = call[0].timestamp.month
-                year = call[0].timestamp.year
-                call = instance
+                bill = make_bill(instance, call)
             else:
-                call = call[0]
-                month = instance.timestamp.month
-                year = instance.timestamp.year
-            Bill.objects.create(
-                destination=call,
-                start_date=call.timestamp.date(),
-                start_time=call.timestamp.time(),
-                duration=calc_bill.get_call_duration(),
-                month=month,
-                year=year,
-                price=calc_bill.get_call_price()
-            )
+                bill = make_bill(call, instance)
+            PendingCall.objects.filter(call_id=call_id).delete()
+            bill.save()
+            add_bills([bill])
+        refresh_snapshots([bill])
+        bill_cache.invalidate([bill])
+        mark_written([bill])
         return instance
 
 
+class CallRecordSerializer(RecordIdMixin, serializers.ModelSerializer):
+    """ Serializer validating a single record of a bulk ingestion without touching the database
+
+        Duplicates and the pairing of start and end records are checked for the whole batch at once by
+        call.ingest.ingest_records.
+    """
+    type = serializers.ChoiceField(choices=(Constants.START, Constants.END))
+
+    class Meta:
+        model = Call
+        fields = ('record_id', 'type', 'timestamp', 'call_id', 'source', 'destination')
+        extra_kwargs = {'record_id': {'validators': []}}
+        validators = []
+
+    def validate(self, attrs):
+        validate_phone_numbers(attrs)
+        return attrs
+
+
+class DurationField(serializers.ReadOnlyField):
+    """ seconds formatted like 0h35m42s
+    """
+
+    def to_representation(self, value):
+        return format_duration(value)
+
+
+class PriceField(serializers.ReadOnlyField):
+    """ centavos formatted like R$ 3,96
+    """
+
+    def to_representation(self, value):
+        return format_price(value)
+
+
 class BillSerializer(serializers.ModelSerializer):
     """ Serializer for Bill model
     """
-    destination = serializers.StringRelatedField(many=False)
+    duration = DurationField()
+    price = PriceField()
+    # the number receiving the call, read from the start record loaded with the bill (see BillViewSet)
+    destination = serializers.CharField(source='destination.destination', read_only=True, default=None)
 
     class Meta:
         model = Bill
         fields = ('destination', 'start_date', 'start_time', 'duration', 'price')
+
+
+class BillTotalSerializer(serializers.ModelSerializer):
+    """ Serializer for BillTotal model, the running totals of the summary endpoint
+    """
+    total_duration = DurationField()
+    total_price = PriceField()
+
+    class Meta:
+        model = BillTotal
+        fields = ('source', 'year', 'month', 'call_count', 'total_duration', 'total_price', 'updated')
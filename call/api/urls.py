@@ -10,5 +10,7 @@ router.register(r'call', views.CallViewSet)
 urlpatterns = [
     path('v1/bill/<str:destination>/', views.BillViewSet.as_view()),
     path('v1/bill/<str:destination>/<int:year>/<int:month>/', views.BillViewSet.as_view()),
+    path('v1/bill/<str:destination>/summary/', views.BillSummaryView.as_view()),
+    path('v1/bill/<str:destination>/<int:year>/<int:month>/summary/', views.BillSummaryView.as_view()),
     path('v1/', include(router.urls)),
 ]
@@ -1,24 +1,250 @@
-from datetime import datetime
+from collections import Counter
+from itertools import islice
 
-from rest_framework import viewsets
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
 from rest_framework import generics
+from rest_framework import status
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+
+from call.bill_cache import bill_cache
+from call.config import Constants
+from call.idempotency import recent_records
+from call.ingest import ACCEPTED, CONFLICT, DUPLICATE, REJECTED, ingest_records
+from call.ingest_queue import QUEUED, enqueue, pending_records, queue_stats
+from call.models import Call, Bill, BillSnapshot
+from call.routers import replica_reads
+from call.snapshots import is_closed, last_closed_period
+from call.totals import current_period, get_total
+from call.util import format_price
+from call.api.fastpath import BILL_ROW, CALL_ROW, accepts_fast_json, call_dicts, dumps, render_bills, render_calls
+from call.api.pagination import BillKeysetPagination, KeysetPagination
+from call.api.parsers import NDJSONParser
+from call.api.serializers import CallSerializer, CallRecordSerializer, BillSerializer, BillTotalSerializer
+
+
+class FastListMixin:
+    """ list the ``fast_row`` fields of the rows rendered by ``fast_render`` when plain JSON is negotiated
+
+        The body is the same as the one of the serializer, see call.api.fastpath.
+    """
+    fast_row = None
+    fast_render = None
+
+    def list(self, request, *args, **kwargs):
+        if not accepts_fast_json(request):
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*self.fast_row)
+        page = self.paginate_queryset(queryset)
+        response = HttpResponse(self.fast_render(page), content_type='application/json')
+        return self.paginator.add_link(response)
+
 
-from call.models import Call, Bill
-from call.api.serializers import CallSerializer, BillSerializer
+class ReplicaReadMixin:
+    """ serve the GET requests of the ``replica_actions`` of a viewset, or every GET request of another view, from
+        a read replica (see call.routers)
 
+        The number in the URL of a bill is the subscriber whose recent writes keep the reads on the primary.
+    """
+    replica_actions = None
 
-class CallViewSet(viewsets.GenericViewSet, generics.ListCreateAPIView, generics.RetrieveAPIView):
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+        if self.replica_actions is not None and self.action_map.get('get') not in self.replica_actions:
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+        with replica_reads(kwargs.get('destination')):
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+
+
+class CallViewSet(ReplicaReadMixin, FastListMixin, viewsets.GenericViewSet, generics.ListCreateAPIView,
+                  generics.RetrieveAPIView):
     queryset = Call.objects.all()
     serializer_class = CallSerializer
+    pagination_class = KeysetPagination
+    fast_row = CALL_ROW
+    fast_render = staticmethod(render_calls)
+    # the pairing lookups of the ingestion and the retrieval of a call just posted read the primary
+    replica_actions = ('list', 'export')
+
+    def create(self, request, *args, **kwargs):
+        # an exact replay of a record created recently is answered like the first time, without validating it
+        replay = recent_records.get(request.data)
+        if replay:
+            status_code, data = replay
+            return Response(data, status=status_code, headers={'Idempotent-Replayed': 'true'})
+
+        if settings.CALL_INGEST_MODE == Constants.INGEST_ASYNC:
+            # acknowledge the record once queued, the ingestion workers pair and price it
+            serializer = CallRecordSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            enqueue([serializer])
+            response = Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        else:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            if serializer.replayed:
+                data = self.get_serializer(serializer.replayed).data
+                response = Response(data, status=status.HTTP_201_CREATED, headers={'Idempotent-Replayed': 'true'})
+            else:
+                self.perform_create(serializer)
+                response = Response(
+                    serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data)
+                )
+        recent_records.put(request.data, response.status_code, response.data)
+        return response
+
+    @action(detail=False, methods=['post'], parser_classes=(JSONParser, NDJSONParser))
+    def bulk(self, request):
+        """ create many calls at once from a JSON array or NDJSON body
+        """
+        records = request.data
+        if not isinstance(records, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of call records.']})
+        if len(records) > settings.CALL_BULK_MAX_RECORDS:
+            raise ValidationError({'non_field_errors': [
+                'Too many call records, the limit is {}.'.format(settings.CALL_BULK_MAX_RECORDS)
+            ]})
+
+        if settings.CALL_INGEST_MODE == Constants.INGEST_ASYNC:
+            results, valid = [], []
+            for record in records:
+                serializer = CallRecordSerializer(data=record)
+                if serializer.is_valid():
+                    valid.append(serializer)
+                    results.append({'status': QUEUED})
+                else:
+                    results.append({'status': REJECTED, 'errors': serializer.errors})
+            enqueue(valid)
+            totals = Counter(result['status'] for result in results)
+            return Response({
+                QUEUED: totals[QUEUED],
+                REJECTED: totals[REJECTED],
+                'results': results,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        results = ingest_records(records)
+        totals = Counter(result['status'] for result in results)
+        return Response({
+            ACCEPTED: totals[ACCEPTED],
+            DUPLICATE: totals[DUPLICATE],
+            CONFLICT: totals[CONFLICT],
+            REJECTED: totals[REJECTED],
+            'results': results,
+        })
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """ every call as NDJSON, streamed in the (timestamp, id) order of the listing
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*KeysetPagination.keyset)
+        # streamed once the view returned, from the database chosen for the request
+        queryset = queryset.using(queryset.db)
+        chunk_size = settings.CALL_EXPORT_CHUNK_SIZE
+        rows = queryset.values_list(*CALL_ROW).iterator(chunk_size=chunk_size)
 
-class BillViewSet(generics.ListAPIView):
+        def lines():
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    return
+                yield b''.join(dumps(call) + b'\n' for call in call_dicts(chunk))
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        """ depth and lag of the ingestion queue
+        """
+        stats = queue_stats()
+        stats['mode'] = settings.CALL_INGEST_MODE
+        return Response(stats)
+
+
+class BillViewSet(ReplicaReadMixin, FastListMixin, generics.ListAPIView):
     serializer_class = BillSerializer
+    pagination_class = BillKeysetPagination
+    fast_row = BILL_ROW
+    fast_render = staticmethod(render_bills)
 
-    def get_queryset(self):
+    def get_period(self):
         # the call_number needs to be the number that originated the call
         call_number = self.kwargs.get('destination')
-        month = self.kwargs.get('month', datetime.now().month - 1)
-        year = self.kwargs.get('year', datetime.now().year)
+        year, month = last_closed_period()
+        return call_number, self.kwargs.get('year', year), self.kwargs.get('month', month)
+
+    def get_queryset(self):
+        call_number, year, month = self.get_period()
+        return Bill.objects.filter(source=call_number, year=year, month=month).select_related('destination')
+
+    def get_pending(self, request, call_number, year, month):
+        """ number of queued records of the bill, waiting up to ?wait= seconds for them
+        """
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            raise ValidationError({'wait': ['A valid number is required.']})
+        wait = max(0.0, min(wait, settings.CALL_BILL_MAX_WAIT))
+        return pending_records(call_number, year, month, wait)
+
+    def list(self, request, *args, **kwargs):
+        call_number, year, month = self.get_period()
+        pending = None
+        if settings.CALL_INGEST_MODE == Constants.INGEST_ASYNC:
+            pending = self.get_pending(request, call_number, year, month)
+
+        response = None
+        # the bill of a closed period does not change, serve the one built by the close_period command
+        if is_closed(year, month):
+            snapshot = BillSnapshot.objects.filter(pk=BillSnapshot.make_key(call_number, year, month)).first()
+            if snapshot:
+                response = self.snapshot_response(request, snapshot)
+        if response is None and accepts_fast_json(request):
+            rows = bill_cache.get(call_number, year, month)
+            page = self.paginator.paginate_rows(rows, Bill, request)
+            response = self.paginator.add_link(HttpResponse(self.fast_render(page), content_type='application/json'))
+            self.set_totals(response, len(rows), sum(row[-1] for row in rows))
+        if response is None:
+            response = super(BillViewSet, self).list(request, *args, **kwargs)
+            totals = self.get_queryset().select_related(None).aggregate(
+                call_count=Count('id'), total_price=Sum('price')
+            )
+            self.set_totals(response, totals['call_count'], totals['total_price'] or 0)
+        if pending is not None:
+            response['X-Bill-Pending'] = pending
+            if pending:
+                # ask the client to come back instead of holding a worker until the queue drains
+                response['Retry-After'] = 1
+        return response
+
+    def set_totals(self, response, call_count, total_price):
+        response['X-Bill-Calls'] = call_count
+        response['X-Bill-Total'] = format_price(total_price)
+
+    def snapshot_response(self, request, snapshot):
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if snapshot.etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(snapshot.content, content_type='application/json')
+        self.set_totals(response, snapshot.call_count, snapshot.total_price)
+        response['ETag'] = snapshot.etag
+        response['Cache-Control'] = 'public, max-age={}, must-revalidate'.format(settings.CALL_SNAPSHOT_MAX_AGE)
+        return response
+
+
+class BillSummaryView(ReplicaReadMixin, generics.RetrieveAPIView):
+    """ running totals of the bill of a subscriber for a period (default: the current one), read from one row
+        whatever the number of calls
+    """
+    serializer_class = BillTotalSerializer
 
-        return Bill.objects.filter(destination__source=call_number, year=year, month=month)
+    def get_object(self):
+        year, month = current_period()
+        return get_total(self.kwargs['destination'], self.kwargs.get('year', year), self.kwargs.get('month', month))
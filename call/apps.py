@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CallConfig(AppConfig):
     name = 'call'
+
+    def ready(self):
+        import call.signals  # noqa: F401
@@ -0,0 +1,196 @@
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+
+from call import columnar, partitions
+from call.columnar import ArchivedCall
+from call.config import Constants
+from call.models import ArchivedRecord, Bill, Call
+from call.signals import bulk_call_delete
+from call.snapshots import close_period
+from call.util import in_lookup_chunks
+
+# formats of the call records of an archived period
+NDJSON = 'ndjson'
+COLUMNAR = 'columnar'
+
+# the fields of a removed call kept as its ArchivedRecord
+ARCHIVED_FIELDS = ('type', 'call_id', 'record_id', 'timestamp')
+
+
+def archived_periods(before):
+    """ (year, month) of the periods with bills before the ``before`` period, oldest first
+    """
+    year, month = before
+    return list(
+        Bill.objects.filter(Q(year__lt=year) | Q(year=year, month__lt=month))
+        .values_list('year', 'month').distinct().order_by('year', 'month')
+    )
+
+
+def call_record(call):
+    """ a call as a record of the POST /api/v1/call/ body, so an archive can be imported back with import_cdrs
+    """
+    record = {
+        'type': call.type, 'timestamp': call.timestamp.isoformat(), 'call_id': call.call_id,
+        'source': call.source, 'destination': call.destination,
+    }
+    if call.record_id is not None:
+        record['id'] = call.record_id
+    return record
+
+
+def bill_record(bill):
+    return {
+        'id': bill.id, 'call_id': bill.destination.call_id if bill.destination else None, 'source': bill.source,
+        'destination': bill.destination.destination if bill.destination else None,
+        'start_date': bill.start_date.isoformat(), 'start_time': bill.start_time.isoformat(),
+        'duration': bill.duration, 'price': bill.price, 'tariff': bill.tariff_id, 'year': bill.year,
+        'month': bill.month,
+    }
+
+
+@contextmanager
+def written_aside(path, mode='wb', opener=open, **kwargs):
+    """ stream opened with ``opener`` on a temporary file, renamed to ``path`` once the block is done
+
+        An interrupted export does not leave a truncated archive behind.
+    """
+    temporary = path + '.tmp'
+    try:
+        with opener(temporary, mode, **kwargs) as stream:
+            yield stream
+    except BaseException:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+
+
+def _write_lines(path, lines):
+    with written_aside(path, 'wt', gzip.open, encoding='utf-8') as stream:
+        for line in lines:
+            stream.write(json.dumps(line))
+            stream.write('\n')
+
+
+def call_pairs(bills, chunk_size=2000):
+    """ yield the (start, end) records of the calls of ``bills``, end None when missing
+    """
+    starts = (bill.destination for bill in bills.exclude(destination=None).iterator(chunk_size=chunk_size))
+    while True:
+        chunk = list(islice(starts, chunk_size))
+        if not chunk:
+            return
+        ends = {
+            call.call_id: call for call in Call.objects.filter(
+                type=Constants.END, call_id__in=[start.call_id for start in chunk]
+            )
+        }
+        for start in chunk:
+            yield start, ends.get(start.call_id)
+
+
+def archived_call(start, end):
+    """ the call of a start and an end record, as stored by call.columnar
+    """
+    if end is None:
+        raise ValueError('The call {} has no end record.'.format(start.call_id))
+    return ArchivedCall(
+        start.call_id, start.source, start.destination, start.timestamp, start.record_id,
+        end.source, end.destination, end.timestamp, end.record_id
+    )
+
+
+def export_period(year, month, directory, chunk_size=2000, calls_format=NDJSON):
+    """ write the bills of a period to a gzip NDJSON file in ``directory``, and their call records to another
+        one or, with the COLUMNAR format, to a call.columnar archive
+
+        Return the paths of the bill file and of the call file.
+    """
+    name = '{:04d}-{:02d}'.format(year, month)
+    bills_path = os.path.join(directory, 'bills-{}.ndjson.gz'.format(name))
+
+    bills = Bill.objects.filter(year=year, month=month).select_related('destination').order_by('id')
+    _write_lines(bills_path, (bill_record(bill) for bill in bills.iterator(chunk_size=chunk_size)))
+
+    if calls_format == COLUMNAR:
+        calls_path = os.path.join(directory, 'calls-{}{}'.format(name, columnar.EXTENSION))
+        # by start, the order compressing best
+        pairs = call_pairs(bills.order_by('destination__timestamp', 'destination_id'), chunk_size)
+        columnar.write_archive(calls_path, year, month, (archived_call(start, end) for start, end in pairs))
+        return bills_path, calls_path
+
+    def calls():
+        for start, end in call_pairs(bills, chunk_size):
+            yield call_record(start)
+            if end is not None:
+                yield call_record(end)
+
+    calls_path = os.path.join(directory, 'calls-{}.ndjson.gz'.format(name))
+    _write_lines(calls_path, calls())
+    return bills_path, calls_path
+
+
+def remove_period(year, month):
+    """ remove the bills of a period and their call records from the database
+
+        The snapshots of the period are built first, so its bills are still served by the bill endpoint. On a
+        partitioned bill table the partition of the period is detached and dropped. The keys of the calls are kept
+        as ArchivedRecord, so the ingestion still answers them as duplicates. Return the number of calls removed.
+    """
+    close_period(year, month)
+    with transaction.atomic():
+        bills = Bill.objects.filter(year=year, month=month)
+        starts = list(bills.exclude(destination=None).values_list('destination_id', 'destination__call_id'))
+        call_ids = [pk for pk, _ in starts]
+        for chunk in in_lookup_chunks([call_id for _, call_id in starts]):
+            call_ids.extend(Call.objects.filter(type=Constants.END, call_id__in=chunk).values_list('id', flat=True))
+
+        if partitions.is_partitioned() and (year, month) in partitions.known_partitions():
+            partitions.drop_partition(year, month)
+        else:
+            bills.delete()
+        with bulk_call_delete():
+            for chunk in in_lookup_chunks(call_ids):
+                calls = Call.objects.filter(id__in=chunk)
+                # the keys stay, so the records cannot be ingested and billed again
+                ArchivedRecord.objects.bulk_create(
+                    [ArchivedRecord(**fields) for fields in calls.values(*ARCHIVED_FIELDS)], ignore_conflicts=True
+                )
+                calls.delete()
+    return len(call_ids)
+
+
+def archived_records(call_ids, record_ids=()):
+    """ {(type, call_id): archived record} and {record_id: archived record} of the archived records with one of
+        ``call_ids`` or ``record_ids``
+    """
+    keys, records = {}, {}
+    lookups = [Q(call_id__in=chunk) for chunk in in_lookup_chunks(set(call_ids))]
+    lookups.extend(Q(record_id__in=chunk) for chunk in in_lookup_chunks(set(record_ids) - {None}))
+    for lookup in lookups:
+        for archived in ArchivedRecord.objects.filter(lookup):
+            keys[(archived.type, archived.call_id)] = archived
+            if archived.record_id is not None:
+                records[archived.record_id] = archived
+    return keys, records
+
+
+def forget_archived(records):
+    """ drop the archived keys of call records, so they can be imported back, return the number dropped
+    """
+    # the records failing validation are rejected by the ingestion anyway
+    records = [record for record in records if isinstance(record.get('call_id'), int)]
+    keys = {(record.get('type'), record['call_id']) for record in records}
+    record_ids = {str(record.get('record_id', record.get('id'))) for record in records} - {'None'}
+    archived, archived_ids = archived_records({call_id for _, call_id in keys}, record_ids)
+    ids = {archived[key].id for key in keys & set(archived)}
+    ids.update(archived_ids[record_id].id for record_id in record_ids & set(archived_ids))
+    for chunk in in_lookup_chunks(ids):
+        ArchivedRecord.objects.filter(id__in=chunk).delete()
+    return len(ids)
@@ -0,0 +1,201 @@
+""" ASGI application serving the Django project, which predates the ASGI support of Django (3.0).
+
+The event loop receives the request bodies and sends the responses, so a client slow to upload a bulk of records
+or to read a bill does not hold a worker. The views, and the ORM round trips in them, run unchanged in a bounded
+pool of threads (``settings.CALL_DB_POOL_SIZE``), each keeping its own persistent database connection: the pool
+is the connection pool of the process, and the requests waiting for a thread of it queue on the loop.
+
+A streamed response (the call export) is written from its thread, which waits for the client to take every
+chunk, so its database cursor stays on the connection that opened it. It stops early when the client
+disconnects or the server shuts down, and the shutdown waits for the threads without blocking the loop their
+chunks are sent through.
+
+At the startup of its lifespan, the application is warmed up and every thread of the pool opens its connection
+before the first request (``settings.CALL_WARM_UP``).
+
+Served by any ASGI server, e.g. ``gunicorn workatolist.asgi:application -c gunicorn.conf.py -k
+uvicorn.workers.UvicornH11Worker`` with the uvicorn of requirements.txt. Its UvicornWorker needs uvloop and
+httptools too (``uvicorn[standard]``).
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from call.warmup import warm_database, warm_up
+
+
+def wsgi_environ(scope, body):
+    """ WSGI environ of an ASGI HTTP scope and its body
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    # the body is read whole, even a chunked one
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class AsgiHandler:
+    """ ASGI 3 application running a WSGI application in a bounded pool of threads
+    """
+
+    def __init__(self, wsgi_application, pool_size=None):
+        self.wsgi_application = wsgi_application
+        self.pool_size = pool_size or settings.CALL_DB_POOL_SIZE
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='db')
+        # set at the shutdown of the lifespan, stops the streamed responses
+        self.stopping = threading.Event()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if settings.CALL_WARM_UP:
+                    await self.warm_up()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.stopping.set()
+                # in another thread, the streaming threads send their last chunks through the loop
+                await asyncio.get_event_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def warm_up(self):
+        """ warm the application up (see call.warmup) in a thread of the pool, then open the database connections
+            of every other thread
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, warm_up)
+        # every thread waits for the others, so each task runs in a thread of its own
+        barrier = threading.Barrier(self.pool_size)
+
+        def connect():
+            warm_database()
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+
+        await asyncio.gather(*(loop.run_in_executor(self.executor, connect) for _ in range(self.pool_size)))
+
+    async def read_body(self, receive):
+        """ the request body, None when the client disconnected and False when the body is larger than
+            settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        """
+        limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return False
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def handle(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        if body is False:
+            await send({'type': 'http.response.start', 'status': 413, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Request body too large.'})
+            return
+
+        loop = asyncio.get_event_loop()
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(self.watch_disconnect(receive, disconnected))
+        try:
+            # waits on the loop, without holding a thread, until one of the pool is free
+            status, headers, content = await loop.run_in_executor(
+                self.executor, self.run, wsgi_environ(scope, body), loop, send, disconnected
+            )
+        finally:
+            watcher.cancel()
+        if content is not None:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def watch_disconnect(self, receive, disconnected):
+        """ set ``disconnected`` when the client goes away, once the body is read
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    def run(self, environ, loop, send, disconnected=None):
+        """ run the WSGI application in a thread of the pool, (status, headers, body) of a buffered response
+
+            A streamed response is sent from here and its body returned as None. It ends early, its body cut
+            short, when ``disconnected`` or ``stopping`` is set.
+        """
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            if not getattr(response, 'streaming', False):
+                return response_start['status'], response_start['headers'], b''.join(response)
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            send_from_thread({
+                'type': 'http.response.start', 'status': response_start['status'],
+                'headers': response_start['headers'],
+            })
+            for chunk in response:
+                if self.stopping.is_set() or (disconnected is not None and disconnected.is_set()):
+                    break
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+            return response_start['status'], response_start['headers'], None
+        finally:
+            # sends request_finished in the thread that used the connection, see close_old_connections
+            response.close()
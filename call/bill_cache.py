@@ -0,0 +1,132 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from call.api.fastpath import BILL_ROW
+from call.models import Bill, BillTotal
+
+# alias of the cache in settings.CACHES
+BILL_CACHE = 'bills'
+
+
+class BillCache:
+    """ rows of the bills served by the API, cached per subscriber and period in the 'bills' Django cache
+
+        The rows are the call.api.fastpath.BILL_ROW tuples of a bill in the order of its listing, so every page
+        and the totals of a bill are served from one entry. Entries are stored under a version of their
+        (source, year, month) that changes when a bill of that subscriber and period is inserted, so a rebuild
+        racing with an insert stores its rows under the version it read, which is no longer looked up.
+
+        The version has to be seen by every process inserting bills: the web workers and the process_ingest_queue
+        command. When the cache is shared by all of them (``settings.CALL_BILL_CACHE_SHARED``, a Redis
+        CALL_BILL_CACHE_URL), it is kept in the cache and bumped by ``invalidate``, again once the transaction
+        inserting the bill commits. Otherwise it is read from the BillTotal of the bill, updated in the same
+        transaction as every insert (see call.totals), one indexed lookup instead of the query of the bill.
+
+        A miss takes a lock in the cache, so a burst of requests for the same bill runs its query once: the
+        other requests poll the cache for the entry, and query the database themselves only after
+        ``settings.CALL_BILL_CACHE_LOCK_TIMEOUT`` seconds. Deleted bills are served until the entry times out.
+    """
+    poll_interval = 0.005
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, source, year, month):
+        return 'bill-version:{}:{}:{}'.format(source, year, month)
+
+    def entry_key(self, source, year, month, version):
+        return 'bill:{}:{}:{}:{}'.format(source, year, month, version)
+
+    def __init__(self, alias=BILL_CACHE):
+        self.alias = alias
+
+    def get_version(self, source, year, month):
+        if not settings.CALL_BILL_CACHE_SHARED:
+            total = BillTotal.objects.filter(source=source, year=year, month=month).values_list(
+                'call_count', 'updated'
+            ).first()
+            if total is None:
+                return '0'
+            return '{}-{}'.format(total[0], int(total[1].timestamp() * 10 ** 6))
+        key = self.version_key(source, year, month)
+        version = self.cache.get(key)
+        if version is None:
+            # a version never reused, so entries stored before the version key was evicted are not found again
+            self.cache.add(key, random.getrandbits(62), None)
+            version = self.cache.get(key)
+        return version
+
+    def query(self, source, year, month):
+        rows = Bill.objects.filter(source=source, year=year, month=month).order_by(
+            'start_date', 'start_time', 'id'
+        ).values_list(*BILL_ROW)
+        return list(rows)
+
+    def get(self, source, year, month):
+        """ the BILL_ROW rows of a bill, from the cache or the database
+        """
+        # phone numbers only, the keys of some backends (memcached) cannot hold any character
+        if not source.isdigit() or not settings.CALL_BILL_CACHE_TIMEOUT:
+            return self.query(source, year, month)
+
+        cache = self.cache
+        version = self.get_version(source, year, month)
+        key = self.entry_key(source, year, month, version)
+        rows = cache.get(key)
+        if rows is not None:
+            return rows
+
+        lock_key = key + ':lock'
+        lock_timeout = settings.CALL_BILL_CACHE_LOCK_TIMEOUT
+        if not cache.add(lock_key, 1, lock_timeout):
+            # another request is building the entry, wait for it
+            deadline = time.monotonic() + lock_timeout
+            interval = self.poll_interval
+            while time.monotonic() < deadline:
+                time.sleep(interval)
+                rows = cache.get(key)
+                if rows is not None:
+                    return rows
+                interval = min(interval * 2, 0.1)
+            return self.query(source, year, month)
+
+        try:
+            rows = self.query(source, year, month)
+            if len(rows) <= settings.CALL_BILL_CACHE_MAX_ROWS:
+                cache.set(key, rows, settings.CALL_BILL_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return rows
+
+    def bump(self, keys):
+        cache = self.cache
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # no entry was stored under a version that is not there
+                pass
+
+    def invalidate(self, bills):
+        """ drop the cached bills of the subscribers and periods of newly inserted ``bills``
+        """
+        if not settings.CALL_BILL_CACHE_SHARED:
+            # the versions are read from the bill totals, updated with the bills
+            return
+        keys = {self.version_key(bill.source, bill.year, bill.month) for bill in bills if bill.source}
+        if not keys:
+            return
+        self.bump(keys)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self.bump(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+
+bill_cache = BillCache()
@@ -0,0 +1,102 @@
+""" Billing run producing the bill of every subscriber for a period.
+
+The bills of a period are streamed ordered by subscriber with a server-side cursor (``QuerySet.iterator``) and
+grouped in a single pass, so memory holds the bills of one subscriber at a time. The subscribers are split in
+shards by the last digits of their number, each shard billed by its own process into its own gzip file, and the
+files are concatenated into one, a valid multi-member gzip stream.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from itertools import groupby
+
+from django.db.models import IntegerField, Value
+from django.db.models.functions import Cast, Mod, Right
+
+from call.models import Bill
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+
+CSV_HEADER = ('source', 'year', 'month', 'call_count', 'total_duration', 'total_price')
+
+ShardResult = namedtuple('ShardResult', ('shard', 'path', 'subscribers', 'calls', 'total_price', 'seconds'))
+
+
+def shard_bills(year, month, shard=0, shards=1):
+    """ (source, destination, start date, start time, duration, price) of the bills of a period and shard
+
+        Ordered by subscriber, the subscribers of a shard are the ones whose number modulo ``shards`` is ``shard``.
+    """
+    bills = Bill.objects.filter(year=year, month=month).exclude(source=None)
+    if shards > 1:
+        bills = bills.annotate(
+            shard=Mod(Cast(Right('source', 6), IntegerField()), Value(shards), output_field=IntegerField())
+        ).filter(shard=shard)
+    return bills.order_by('source', 'id').values_list(
+        'source', 'destination__destination', 'start_date', 'start_time', 'duration', 'price'
+    )
+
+
+def subscriber_bills(rows):
+    """ group the rows of shard_bills by subscriber, yielding (source, call count, duration, price, rows)
+    """
+    for source, calls in groupby(rows, key=lambda row: row[0]):
+        calls = list(calls)
+        yield source, len(calls), sum(call[4] for call in calls), sum(call[5] for call in calls), calls
+
+
+def ndjson_line(year, month, source, call_count, duration, price, calls):
+    return json.dumps({
+        'source': source, 'year': year, 'month': month, 'call_count': call_count,
+        'total_duration': duration, 'total_price': price,
+        'calls': [{
+            'destination': destination, 'start_date': start_date.isoformat(), 'start_time': start_time.isoformat(),
+            'duration': call_duration, 'price': call_price,
+        } for _, destination, start_date, start_time, call_duration, call_price in calls]
+    }) + '\n'
+
+
+def bill_shard(year, month, path, file_format=NDJSON, shard=0, shards=1, chunk_size=2000):
+    """ write the bills of the subscribers of a shard to a gzip file, one line per subscriber
+
+        A NDJSON line has the totals of the subscriber and its calls, a CSV row only the totals. Prices are in
+        centavos and durations in seconds. Return a ShardResult.
+    """
+    started = time.perf_counter()
+    subscribers = calls = total_price = 0
+    rows = shard_bills(year, month, shard, shards).iterator(chunk_size=chunk_size)
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as stream:
+        writer = csv.writer(stream) if file_format == CSV else None
+        for source, call_count, duration, price, bills in subscriber_bills(rows):
+            if writer:
+                writer.writerow((source, year, month, call_count, duration, price))
+            else:
+                stream.write(ndjson_line(year, month, source, call_count, duration, price, bills))
+            subscribers += 1
+            calls += call_count
+            total_price += price
+    return ShardResult(shard, path, subscribers, calls, total_price, time.perf_counter() - started)
+
+
+def shard_path(path, shard):
+    return '{}.part{:03d}'.format(path, shard)
+
+
+def concatenate(path, results, file_format=NDJSON):
+    """ join the files of the shards in ``path``, after a CSV header, and remove them
+    """
+    with open(path, 'wb') as output:
+        if file_format == CSV:
+            header = io.StringIO()
+            csv.writer(header).writerow(CSV_HEADER)
+            output.write(gzip.compress(header.getvalue().encode('utf-8')))
+        for result in sorted(results, key=lambda result: result.shard):
+            with open(result.path, 'rb') as part:
+                shutil.copyfileobj(part, output)
+            os.remove(result.path)
@@ -0,0 +1,264 @@
+""" Compact columnar archive of the call records of a period, one file per month.
+
+The records of an archived period are only read again for audits and rebilling, which scan every call of the
+month. The calls are stored one per row, their start and end records side by side, in columns:
+
+* call_id;
+* source, destination, end_source, end_destination: the phone numbers of the start and end records as the
+  integer ``int('1' + number)``, so leading zeros survive, and 0 when missing;
+* start: epoch seconds of the start record, stored as the difference with the previous call;
+* duration: seconds from the start record to the end record;
+* start_us, end_us: the microseconds of the timestamps, zeros for the platforms sending whole seconds;
+* start_id, end_id: the record ids, as JSON arrays.
+
+The integer columns are little-endian int64 arrays whose bytes are shuffled (the first byte of every value, then
+the second, and so on) and compressed with zlib: the high bytes of the numbers, deltas and durations make long
+runs that compress to almost nothing. A JSON header gives the period, the number of calls and the place of each
+column in the file.
+
+``CallArchive`` memory-maps a file and decompresses a column from the mapping when it is first asked for. With
+NumPy installed the columns are arrays, ready for call.pricing.calculate_prices_batch, and ``array.array``
+otherwise.
+"""
+import array
+import json
+import mmap
+import struct
+import sys
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from call.config import Constants
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+MAGIC = b'CDRCOL1\n'
+HEADER_LENGTH = struct.Struct('<I')
+EXTENSION = '.cdr'
+
+INTEGER_COLUMNS = (
+    'call_id', 'source', 'destination', 'end_source', 'end_destination', 'start', 'duration', 'start_us', 'end_us',
+)
+# stored as the difference with the value of the previous call
+DELTA_COLUMNS = ('start',)
+TEXT_COLUMNS = ('start_id', 'end_id')
+ITEM_SIZE = 8
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# a call given to write_archive, its start and end records side by side
+ArchivedCall = namedtuple('ArchivedCall', (
+    'call_id', 'source', 'destination', 'start', 'start_id', 'end_source', 'end_destination', 'end', 'end_id',
+))
+
+
+def encode_number(number):
+    if number is None:
+        return 0
+    if number and not number.isdigit():
+        raise ValueError('Not a phone number: {!r}'.format(number))
+    return int('1' + number)
+
+
+def decode_number(value):
+    return str(value)[1:] if value else None
+
+
+def epoch(moment):
+    """ (epoch seconds, microseconds) of an aware datetime
+    """
+    delta = moment - EPOCH
+    return delta.days * 86400 + delta.seconds, delta.microseconds
+
+
+def _shuffle(values):
+    if sys.byteorder == 'big':  # pragma: no cover
+        values = array.array('q', values)
+        values.byteswap()
+    data = values.tobytes()
+    return b''.join(data[index::ITEM_SIZE] for index in range(ITEM_SIZE))
+
+
+def _unshuffle(data, count):
+    """ the little-endian int64 values of shuffled bytes, as a NumPy array or an array.array
+    """
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(ITEM_SIZE, count).T.copy().view('<i8').ravel()
+    unshuffled = bytearray(len(data))
+    for index in range(ITEM_SIZE):
+        unshuffled[index::ITEM_SIZE] = data[index * count:(index + 1) * count]
+    values = array.array('q')
+    values.frombytes(bytes(unshuffled))
+    if sys.byteorder == 'big':  # pragma: no cover
+        values.byteswap()
+    return values
+
+
+def write_archive(path, year, month, calls, level=9):
+    """ write the ArchivedCall ``calls`` of a period to ``path``, return their number
+
+        The calls are stored in the order given, by start for the most compact file.
+    """
+    columns = {name: array.array('q') for name in INTEGER_COLUMNS}
+    texts = {name: [] for name in TEXT_COLUMNS}
+    previous = 0
+    for call in calls:
+        start, start_us = epoch(call.start)
+        end, end_us = epoch(call.end)
+        columns['call_id'].append(call.call_id)
+        columns['source'].append(encode_number(call.source))
+        columns['destination'].append(encode_number(call.destination))
+        columns['end_source'].append(encode_number(call.end_source))
+        columns['end_destination'].append(encode_number(call.end_destination))
+        columns['start'].append(start - previous)
+        columns['duration'].append(end - start)
+        columns['start_us'].append(start_us)
+        columns['end_us'].append(end_us)
+        texts['start_id'].append(call.start_id)
+        texts['end_id'].append(call.end_id)
+        previous = start
+
+    blocks = [zlib.compress(_shuffle(columns[name]), level) for name in INTEGER_COLUMNS]
+    blocks.extend(zlib.compress(json.dumps(texts[name]).encode('utf-8'), level) for name in TEXT_COLUMNS)
+    header = {'year': year, 'month': month, 'count': len(columns['call_id']), 'columns': {}}
+    offset = 0
+    for name, block in zip(INTEGER_COLUMNS + TEXT_COLUMNS, blocks):
+        header['columns'][name] = {'offset': offset, 'length': len(block)}
+        offset += len(block)
+    header = json.dumps(header).encode('utf-8')
+
+    # call.archive imports this module
+    from call.archive import written_aside
+
+    with written_aside(path) as stream:
+        stream.write(MAGIC)
+        stream.write(HEADER_LENGTH.pack(len(header)))
+        stream.write(header)
+        for block in blocks:
+            stream.write(block)
+    return len(columns['call_id'])
+
+
+def is_archive(path):
+    with open(path, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+
+class CallArchive:
+    """ the calls of a period read from a columnar archive file, memory-mapped
+
+        ``column(name)`` is a column of INTEGER_COLUMNS, decoded once, ``starts()`` and ``ends()`` the epoch
+        seconds of the records and ``records()`` the records themselves, as the POST /api/v1/call/ bodies.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self._file.close()
+            raise ValueError('Not a call archive: {}'.format(path))
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('Not a call archive: {}'.format(path))
+        position = len(MAGIC) + HEADER_LENGTH.size
+        length, = HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+        header = json.loads(self._map[position:position + length].decode('utf-8'))
+        self._data = position + length
+        self._columns = header['columns']
+        self._decoded = {}
+        self.year = header['year']
+        self.month = header['month']
+        self.count = header['count']
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._decoded = {}
+        self._map.close()
+        self._file.close()
+
+    def _block(self, name):
+        """ the decompressed bytes of a column, read from the mapping without copying the file
+        """
+        place = self._columns[name]
+        start = self._data + place['offset']
+        view = memoryview(self._map)
+        try:
+            block = view[start:start + place['length']]
+            try:
+                return zlib.decompress(block)
+            finally:
+                block.release()
+        finally:
+            view.release()
+
+    def column(self, name):
+        if name not in self._decoded:
+            values = _unshuffle(self._block(name), self.count)
+            if name in DELTA_COLUMNS:
+                values = numpy.cumsum(values) if numpy is not None else array.array('q', accumulate(values))
+            self._decoded[name] = values
+        return self._decoded[name]
+
+    def texts(self, name):
+        return json.loads(self._block(name).decode('utf-8'))
+
+    def _seconds(self, seconds, microseconds):
+        if numpy is not None:
+            return seconds + microseconds / 10 ** 6 if microseconds.any() else seconds
+        if not any(microseconds):
+            return seconds
+        return [value + fraction / 10 ** 6 for value, fraction in zip(seconds, microseconds)]
+
+    def starts(self):
+        """ epoch seconds of the start records, integers unless a timestamp has microseconds
+        """
+        return self._seconds(self.column('start'), self.column('start_us'))
+
+    def ends(self):
+        """ epoch seconds of the end records, integers unless a timestamp has microseconds
+        """
+        starts, durations = self.column('start'), self.column('duration')
+        if numpy is not None:
+            seconds = starts + durations
+        else:
+            seconds = array.array('q', (start + duration for start, duration in zip(starts, durations)))
+        return self._seconds(seconds, self.column('end_us'))
+
+    def records(self):
+        """ yield the start then the end record of every call, shaped like the POST /api/v1/call/ body
+        """
+        call_ids, starts, durations = self.column('call_id'), self.column('start'), self.column('duration')
+        start_us, end_us = self.column('start_us'), self.column('end_us')
+        numbers = [self.column(name) for name in ('source', 'destination', 'end_source', 'end_destination')]
+        start_ids, end_ids = self.texts('start_id'), self.texts('end_id')
+        for index in range(self.count):
+            start = EPOCH + timedelta(seconds=int(starts[index]), microseconds=int(start_us[index]))
+            end = EPOCH + timedelta(seconds=int(starts[index] + durations[index]), microseconds=int(end_us[index]))
+            source, destination, end_source, end_destination = (
+                decode_number(int(column[index])) for column in numbers
+            )
+            for type, timestamp, record_id, source, destination in (
+                    (Constants.START, start, start_ids[index], source, destination),
+                    (Constants.END, end, end_ids[index], end_source, end_destination)):
+                record = {
+                    'type': type, 'timestamp': timestamp.isoformat(), 'call_id': int(call_ids[index]),
+                    'source': source, 'destination': destination,
+                }
+                if record_id is not None:
+                    record['id'] = record_id
+                yield record
@@ -2,5 +2,9 @@ class Constants:
     START = 'start'
     END = 'end'
 
+    # settings.CALL_INGEST_MODE
+    INGEST_SYNC = 'sync'
+    INGEST_ASYNC = 'async'
+
     FIXED_CHARGE = 0.36
     CHARGE_MINUTE = 0.09
@@ -0,0 +1,60 @@
+""" Health checks and metrics of the database connections kept open between requests.
+
+With ``settings.CALL_DB_POOLING`` set to 'persistent' or 'pgbouncer' every thread keeps its connection for
+CONN_MAX_AGE seconds, so a request does not pay the connection setup (TCP, TLS and authentication, several
+round trips to Heroku Postgres). A connection left idle may have been closed meanwhile by the server or a pooler:
+at the start of a request, the connections idle for more than ``settings.CALL_DB_HEALTH_CHECK_INTERVAL`` seconds
+are pinged and closed when unusable, so the view opens a new one instead of failing on its first query.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from call.metrics import registry
+
+DB_CONNECTIONS = registry.counter(
+    'db_connections_opened_total', 'Database connections opened, by database alias.', ('alias',)
+)
+DB_HEALTH_CHECKS = registry.counter(
+    'db_health_checks_total', 'Idle database connections checked before a request, by result.', ('result',)
+)
+
+# alias -> moment the connection of the thread was last released by a request
+_last_used = threading.local()
+
+
+def check_connections(**kwargs):
+    """ receiver of request_started closing the idle connections the database does not answer anymore
+    """
+    interval = settings.CALL_DB_HEALTH_CHECK_INTERVAL
+    if not interval:
+        return
+    now = time.monotonic()
+    last_used = getattr(_last_used, 'aliases', {})
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if now - last_used.get(connection.alias, now) < interval:
+            continue
+        if connection.is_usable():
+            DB_HEALTH_CHECKS.inc('usable')
+        else:
+            DB_HEALTH_CHECKS.inc('closed')
+            connection.close()
+
+
+def release_connections(**kwargs):
+    """ receiver of request_finished noting when the connections still open were last used
+    """
+    now = time.monotonic()
+    _last_used.aliases = {
+        connection.alias: now for connection in connections.all() if connection.connection is not None
+    }
+
+
+def count_connection(sender, connection, **kwargs):
+    """ receiver of connection_created
+    """
+    DB_CONNECTIONS.inc(connection.alias)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def record_keys(data):
+    """ idempotency keys of a call record body: its ``id`` when given, and its type and call_id
+    """
+    keys = []
+    record_id = data.get('record_id', data.get('id'))
+    if record_id is not None:
+        keys.append(('id', str(record_id)))
+    keys.append(('call', str(data.get('type')), str(data.get('call_id'))))
+    return keys
+
+
+def record_digest(data):
+    """ fingerprint of the content of a call record body, as sent by the client
+    """
+    content = json.dumps({key: data[key] for key in data}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# the content of a record compared with the stored one
+REPLAY_FIELDS = ('type', 'timestamp', 'call_id', 'source', 'destination')
+
+
+def is_replay(call, attrs, fields=REPLAY_FIELDS):
+    """ whether the validated ``attrs`` of a record have the content of the stored ``call`` with the same key
+
+        A record sent without ``id`` replays a stored one whatever its id. An ArchivedRecord only keeps the
+        ``fields`` of its key and timestamp.
+    """
+    if attrs.get('record_id') is not None and attrs['record_id'] != call.record_id:
+        return False
+    return all(getattr(call, field) == attrs.get(field) for field in fields)
+
+
+class RecentRecords:
+    """ process-wide LRU of the responses given to the call records recently created through the API
+
+        The telecom platforms resend records they did not get an answer for, usually byte for byte. Such a replay
+        is answered from here without validating it or touching the database. A body whose keys are known but
+        whose content differs is not answered from here: the serializer compares it with the stored call and
+        either replays it or reports the conflict. Deleting a call clears the cache (see call.signals).
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data):
+        """ return the (status, response data) cached for ``data``, or None
+        """
+        if not self._entries or not isinstance(data, dict):
+            return None
+        digest = record_digest(data)
+        with self._lock:
+            for key in record_keys(data):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == digest:
+                    self._entries.move_to_end(key)
+                    return entry[1:]
+        return None
+
+    def put(self, data, status, response_data):
+        size = getattr(settings, 'CALL_IDEMPOTENCY_CACHE_SIZE', 0)
+        if not size or not isinstance(data, dict):
+            return
+        entry = (record_digest(data), status, response_data)
+        with self._lock:
+            for key in record_keys(data):
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+recent_records = RecentRecords()
@@ -0,0 +1,150 @@
+import time
+
+from django.db import connection, transaction
+
+from call.archive import ARCHIVED_FIELDS, archived_records
+from call.config import Constants
+from call.bill_cache import bill_cache
+from call.idempotency import is_replay
+from call.metrics import PAIRING_DURATION
+from call.models import Bill, Call, PendingCall
+from call.partitions import ensure_bill_partitions
+from call.routers import mark_written
+from call.snapshots import refresh_snapshots
+from call.totals import add_bills
+from call.util import in_lookup_chunks, make_bill
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+CONFLICT = 'conflict'
+REJECTED = 'rejected'
+
+
+def _pair_error(call, pair):
+    if call.type == Constants.END and call.timestamp < pair.timestamp:
+        return 'Invalid timestamp. Must be grater then {}'.format(pair.timestamp)
+    if call.type == Constants.START and call.timestamp > pair.timestamp:
+        return 'Invalid timestamp. Must be lower then {}'.format(pair.timestamp)
+    return None
+
+
+def ingest_records(records):
+    """ validate, pair and store a batch of call records
+
+        ``records`` is a list of dicts shaped like the body of ``POST /api/v1/call/``. The records are
+        validated in memory, the ones already stored with the same type and call_id or the same record id are
+        fetched with ``IN`` queries, and the new calls, bills and pending records are written with
+        ``bulk_create`` in one transaction.
+
+        Return one dict per record, in the same order, with its ``status`` and either the ``id`` of the call or
+        the validation ``errors``. A record identical to a stored one is a duplicate, a record with the same key
+        and a different content is a conflict, reported with both the ``id`` of the stored call and ``errors``.
+        The same goes for the records of the archived periods (see call.models.ArchivedRecord), without ``id``.
+    """
+    # imported here, the api package depends on this module
+    from call.api.exceptions import RecordConflict
+    from call.api.serializers import CallRecordSerializer
+
+    results = []
+    calls = []
+    for record in records:
+        serializer = CallRecordSerializer(data=record)
+        if serializer.is_valid():
+            results.append({'status': ACCEPTED})
+            calls.append((Call(**serializer.validated_data), serializer.validated_data))
+        else:
+            results.append({'status': REJECTED, 'errors': serializer.errors})
+            calls.append((None, None))
+
+    with transaction.atomic():
+        started = time.perf_counter()
+        call_ids = {call.call_id for call, _ in calls if call}
+        known = {
+            (call.type, call.call_id): call
+            for chunk in in_lookup_chunks(call_ids) for call in Call.objects.filter(call_id__in=chunk)
+        }
+        record_ids = {call.record_id for call, _ in calls if call and call.record_id is not None}
+        known_records = {call.record_id: call for call in known.values() if call.record_id is not None}
+        known_records.update(
+            (call.record_id, call)
+            for chunk in in_lookup_chunks(record_ids - set(known_records))
+            for call in Call.objects.filter(record_id__in=chunk)
+        )
+
+        # the records of the archived periods are resent too, their keys were kept
+        archived, archived_ids = archived_records(
+            {call.call_id for call, _ in calls if call and (call.type, call.call_id) not in known},
+            {call.record_id for call, _ in calls if call and call.record_id not in known_records}
+        )
+
+        new_calls = []
+        matches = [None] * len(calls)
+        for index, (result, (call, attrs)) in enumerate(zip(results, calls)):
+            if call is None:
+                continue
+            key = (call.type, call.call_id)
+            stored = known.get(key) or known_records.get(call.record_id)
+            if stored:
+                matches[index] = stored
+                if is_replay(stored, attrs):
+                    result['status'] = DUPLICATE
+                else:
+                    result.update(status=CONFLICT, errors={'non_field_errors': [RecordConflict.default_detail]})
+                continue
+            stored = archived.get(key) or archived_ids.get(call.record_id)
+            if stored:
+                if is_replay(stored, attrs, ARCHIVED_FIELDS):
+                    result['status'] = DUPLICATE
+                else:
+                    result.update(status=CONFLICT, errors={'non_field_errors': [RecordConflict.default_detail]})
+                continue
+            pair = known.get((Constants.END if call.type == Constants.START else Constants.START, call.call_id))
+            error = _pair_error(call, pair) if pair else None
+            if error:
+                result.update(status=REJECTED, errors={'non_field_errors': [error]})
+                continue
+            known[key] = call
+            if call.record_id is not None:
+                known_records[call.record_id] = call
+            matches[index] = call
+            new_calls.append(call)
+        PAIRING_DURATION.observe(time.perf_counter() - started, 'bulk')
+
+        Call.objects.bulk_create(new_calls)
+        if new_calls and not connection.features.can_return_ids_from_bulk_insert:
+            ids = {
+                (type, call_id): pk
+                for chunk in in_lookup_chunks({call.call_id for call in new_calls})
+                for pk, type, call_id in Call.objects.filter(call_id__in=chunk).values_list('id', 'type', 'call_id')
+            }
+            for call in new_calls:
+                call.id = ids[(call.type, call.call_id)]
+
+        bills = []
+        pending = []
+        billed = set()
+        for call in new_calls:
+            if call.call_id in billed:
+                continue
+            start = known.get((Constants.START, call.call_id))
+            end = known.get((Constants.END, call.call_id))
+            if start and end:
+                bills.append(make_bill(start, end))
+                billed.add(call.call_id)
+            else:
+                pending.append(PendingCall(record=call, call_id=call.call_id))
+
+        for chunk in in_lookup_chunks(billed):
+            PendingCall.objects.filter(call_id__in=chunk).delete()
+        PendingCall.objects.bulk_create(pending)
+        ensure_bill_partitions(bills)
+        Bill.objects.bulk_create(bills)
+        add_bills(bills)
+        refresh_snapshots(bills)
+        bill_cache.invalidate(bills)
+        mark_written(bills)
+
+    for result, call in zip(results, matches):
+        if call is not None:
+            result['id'] = call.id
+    return results
@@ -0,0 +1,110 @@
+import json
+import time
+
+from django.db import transaction
+from django.db.models import Count, IntegerField, Min, Q, Value
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from call.ingest import CONFLICT, REJECTED, ingest_records
+from call.models import PendingCall, QueuedRecord
+from call.snapshots import period_end, period_start
+from call.util import in_lookup_chunks
+
+QUEUED = 'queued'
+
+
+def enqueue(serializers):
+    """ durably append validated CallRecordSerializer instances to the ingestion queue
+
+        Return the created QueuedRecord instances.
+    """
+    records = [
+        QueuedRecord(
+            payload=json.dumps(serializer.data),
+            call_id=serializer.validated_data['call_id'],
+            source=serializer.validated_data.get('source'),
+            timestamp=serializer.validated_data['timestamp']
+        ) for serializer in serializers
+    ]
+    return QueuedRecord.objects.bulk_create(records)
+
+
+def process_batch(batch_size=1000, shard=0, shards=1):
+    """ pair and price the oldest queued records of a shard, return the number of records processed
+
+        Both records of a call always belong to the same shard (``call_id`` modulo ``shards``), so workers
+        processing different shards never pair the same call concurrently. On PostgreSQL the claimed rows are
+        locked and skipped by other workers of the same shard.
+    """
+    with transaction.atomic():
+        queued = QueuedRecord.objects.filter(processed=None)
+        if shards > 1:
+            queued = queued.annotate(
+                shard=Mod('call_id', Value(shards), output_field=IntegerField())
+            ).filter(shard=shard)
+        queued = list(queued.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not queued:
+            return 0
+
+        results = ingest_records([json.loads(record.payload) for record in queued])
+        now = timezone.now()
+        done = []
+        for record, result in zip(queued, results):
+            if result['status'] in (REJECTED, CONFLICT):
+                record.processed = now
+                record.errors = json.dumps(result['errors'])
+                record.save(update_fields=['processed', 'errors'])
+            else:
+                done.append(record.id)
+        for chunk in in_lookup_chunks(done):
+            QueuedRecord.objects.filter(id__in=chunk).delete()
+    return len(queued)
+
+
+def run_worker(batch_size=1000, shard=0, shards=1, interval=1.0, stop=None):
+    """ process batches until ``stop`` (a threading.Event) is set, sleeping ``interval`` seconds when idle
+    """
+    while stop is None or not stop.is_set():
+        if not process_batch(batch_size, shard, shards):
+            if stop is None:
+                return
+            stop.wait(interval)
+
+
+def queue_stats():
+    """ depth, lag in seconds of the oldest waiting record, and number of rejected records of the queue
+    """
+    waiting = QueuedRecord.objects.filter(processed=None).aggregate(depth=Count('id'), oldest=Min('received'))
+    lag = (timezone.now() - waiting['oldest']).total_seconds() if waiting['oldest'] else 0.0
+    return {
+        'depth': waiting['depth'],
+        'lag_seconds': round(lag, 3),
+        'rejected': QueuedRecord.objects.exclude(processed=None).count(),
+    }
+
+
+def pending_records(source, year, month, wait=0.0, interval=0.2):
+    """ number of queued records of the calls started from ``source`` in the period still waiting to be processed
+
+        The start records are matched by source and timestamp; the end records, which carry no source, by the
+        call_id of a start queued or waiting for its pair. An end record queued before any record of its start
+        cannot be attributed and is not counted. When ``wait`` is given, poll for up to that many seconds until
+        there are none left.
+    """
+    start, end = period_start(year, month), period_end(year, month)
+    starts = QueuedRecord.objects.filter(processed=None, source=source, timestamp__gte=start, timestamp__lt=end)
+    paired = PendingCall.objects.filter(
+        record__source=source, record__timestamp__gte=start, record__timestamp__lt=end
+    )
+    queued = QueuedRecord.objects.filter(processed=None, timestamp__gte=start).filter(
+        Q(source=source, timestamp__lt=end) |
+        Q(source=None, call_id__in=starts.values('call_id')) |
+        Q(source=None, call_id__in=paired.values('call_id'))
+    )
+    deadline = time.monotonic() + wait
+    while True:
+        count = queued.count()
+        if not count or time.monotonic() >= deadline:
+            return count
+        time.sleep(interval)
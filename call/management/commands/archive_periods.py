@@ -0,0 +1,58 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from call.archive import COLUMNAR, NDJSON, archived_periods, export_period, remove_period
+from call.snapshots import last_closed_period
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the bills and call records of old periods to gzip NDJSON files, then remove them from the database. '
+        'The bills of the archived periods are still served from their snapshots.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help='Directory receiving the archive files.')
+        parser.add_argument(
+            '--keep-months', type=int, default=12,
+            help='Closed periods kept in the database, counting back from the previous month (default: 12).'
+        )
+        parser.add_argument(
+            '--format', choices=(NDJSON, COLUMNAR), default=NDJSON,
+            help='Format of the call records: gzip NDJSON, or a compact columnar file (see call.columnar) '
+                 '(default: ndjson). The bills are written to gzip NDJSON.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the periods that would be archived without exporting or removing anything.'
+        )
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError('At least one closed period must be kept.')
+        if not os.path.isdir(options['output']):
+            raise CommandError('Directory not found: {}'.format(options['output']))
+
+        # first period kept
+        year, month = last_closed_period()
+        months = year * 12 + month - 1 - (options['keep_months'] - 1)
+        before = (months // 12, months % 12 + 1)
+
+        periods = archived_periods(before)
+        if not periods:
+            self.stdout.write('No period before {}/{:02d} to archive.'.format(*before))
+        for year, month in periods:
+            if options['dry_run']:
+                self.stdout.write('Would archive {}/{:02d}.'.format(year, month))
+                continue
+            started = time.perf_counter()
+            try:
+                paths = export_period(year, month, options['output'], calls_format=options['format'])
+            except ValueError as exc:
+                raise CommandError('Cannot archive {}/{:02d}: {}'.format(year, month, exc))
+            calls = remove_period(year, month)
+            self.stdout.write(self.style.SUCCESS('Archived {}/{:02d} ({} call records) to {} in {:.2f}s.'.format(
+                year, month, calls, ', '.join(paths), time.perf_counter() - started
+            )))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from call.partitions import ensure_partitions, next_period
+from call.snapshots import close_period, resolve_period
+from call.totals import current_period
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the bill snapshot of every subscriber for a closed period (default: the previous month), and create '
+        'the bill partitions of the current and next periods.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int)
+        parser.add_argument('--month', type=int, choices=range(1, 13), metavar='{1..12}')
+
+    def handle(self, *args, **options):
+        year, month = resolve_period(options['year'], options['month'])
+
+        started = time.perf_counter()
+        count = close_period(year, month)
+        self.stdout.write(self.style.SUCCESS('Built {} bill snapshot(s) for {}/{:02d} in {:.2f}s.'.format(
+            count, year, month, time.perf_counter() - started
+        )))
+
+        # ahead of their first bills, so the requests writing them do not create them
+        current = current_period()
+        created = ensure_partitions([current, next_period(*current)])
+        for year, month in sorted(created):
+            self.stdout.write('Created the bill partition of {}/{:02d}.'.format(year, month))
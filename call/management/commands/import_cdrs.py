@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from call import columnar
+from call.archive import forget_archived
+from call.ingest import ACCEPTED, CONFLICT, DUPLICATE, REJECTED, ingest_records
+
+
+def read_records(path, offset=0, number=0):
+    """ yield (line number, offset after the line, record) for each non-blank line of a NDJSON file
+
+        The file is read lazily, starting at ``offset`` (the end of line ``number``), so memory does not grow
+        with its size. A columnar archive is read with read_archive, ``offset`` counting records.
+    """
+    if columnar.is_archive(path):
+        yield from read_archive(path, offset)
+        return
+    with open(path, 'rb') as stream:
+        stream.seek(offset)
+        for line in stream:
+            number += 1
+            offset += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError as exc:
+                record = exc
+            yield number, offset, record
+
+
+def read_archive(path, offset=0):
+    """ yield (record number, record number, record) for each record of a call.columnar archive after the first
+        ``offset`` ones
+    """
+    with columnar.CallArchive(path) as archive:
+        for number, record in enumerate(islice(archive.records(), offset, None), offset + 1):
+            yield number, number, record
+
+
+def chunked(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Import call records from a NDJSON file, one record shaped like the POST /api/v1/call/ body per line, '
+        'or from a columnar archive written by archive_periods --format columnar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Path of the NDJSON file or columnar archive.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Records validated and committed together (default: 1000).'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File keeping the offset of the last committed chunk (default: <file>.checkpoint).'
+        )
+        parser.add_argument(
+            '--restore', action='store_true',
+            help='Import the records of an archived period back, instead of answering them as duplicates.'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the checkpoint and import the file from the beginning.'
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as stream:
+                checkpoint = json.load(stream)
+            return checkpoint['offset'], checkpoint['line']
+        except FileNotFoundError:
+            return 0, 0
+        except (ValueError, KeyError) as exc:
+            raise CommandError('Invalid checkpoint file {}: {}'.format(path, exc))
+
+    def write_checkpoint(self, path, offset, line):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as stream:
+            json.dump({'offset': offset, 'line': line}, stream)
+        os.replace(temporary, path)
+
+    def handle(self, *args, **options):
+        path = options['file']
+        if not os.path.isfile(path):
+            raise CommandError('File not found: {}'.format(path))
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be positive.')
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+        offset, line = (0, 0) if options['restart'] else self.read_checkpoint(checkpoint)
+        if offset:
+            self.stdout.write('Resuming {} after line {}.'.format(path, line))
+
+        totals = Counter()
+        started = time.perf_counter()
+        for chunk in chunked(read_records(path, offset, line), options['chunk_size']):
+            valid = [(number, record) for number, _, record in chunk if isinstance(record, dict)]
+            for number, _, record in chunk:
+                if not isinstance(record, dict):
+                    totals[REJECTED] += 1
+                    self.stderr.write('line {}: not a JSON object'.format(number))
+
+            if options['restore']:
+                forget_archived([record for _, record in valid])
+            results = ingest_records([record for _, record in valid])
+            for (number, _), result in zip(valid, results):
+                totals[result['status']] += 1
+                if result['status'] in (REJECTED, CONFLICT):
+                    self.stderr.write('line {}: {}'.format(number, json.dumps(result['errors'])))
+
+            # the chunk is committed, a crash from here on resumes after it
+            self.write_checkpoint(checkpoint, chunk[-1][1], chunk[-1][0])
+
+            elapsed = time.perf_counter() - started
+            processed = sum(totals.values())
+            self.stdout.write('{} records, {:.0f} records/s'.format(processed, processed / elapsed))
+
+        self.stdout.write(self.style.SUCCESS('{} accepted, {} duplicate, {} conflicting, {} rejected.'.format(
+            totals[ACCEPTED], totals[DUPLICATE], totals[CONFLICT], totals[REJECTED]
+        )))
@@ -0,0 +1,66 @@
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from call.ingest_queue import queue_stats, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Pair and price the call records queued by the API when CALL_INGEST_MODE is async.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Worker threads, each one processing the calls of its own call_id shard (default: 1). '
+                 'More than one worker needs a database with row locking and concurrent writes, like PostgreSQL.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Records paired and priced in each transaction (default: 1000).'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds an idle worker waits before polling the queue again (default: 1).'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of waiting for new records.'
+        )
+
+    def work(self, shard, options, stop):
+        try:
+            run_worker(options['batch_size'], shard, options['workers'], options['interval'], stop)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('The number of workers and the batch size must be positive.')
+        if options['workers'] > 1 and connection.vendor == 'sqlite':
+            raise CommandError('SQLite does not support concurrent writers, run a single worker.')
+
+        stop = None if options['once'] else threading.Event()
+        if options['workers'] == 1 and stop is None:
+            run_worker(options['batch_size'], 0, 1, options['interval'])
+            threads = []
+        else:
+            threads = [
+                threading.Thread(target=self.work, args=(shard, options, stop), daemon=True)
+                for shard in range(options['workers'])
+            ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            if stop is None:
+                raise
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        stats = queue_stats()
+        self.stdout.write('Queue depth {depth}, lag {lag_seconds}s, {rejected} rejected record(s).'.format(**stats))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from call.models import Bill
+from call.snapshots import resolve_period
+from call.totals import fix, reconcile
+from call.util import format_duration, format_price
+
+
+def format_totals(totals):
+    call_count, total_duration, total_price = totals
+    return '{} call(s), {}, {}'.format(call_count, format_duration(total_duration), format_price(total_price))
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the running bill totals of each subscriber from the bills and report the ones that drifted '
+        '(default: every period with bills, the archived ones have none and keep their totals). Exits with an '
+        'error when a total drifted, unless --fix adds the differences.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int)
+        parser.add_argument('--month', type=int, choices=range(1, 13), metavar='{1..12}')
+        parser.add_argument('--fix', action='store_true', help='Correct the totals that drifted.')
+
+    def handle(self, *args, **options):
+        periods = Bill.objects.order_by('year', 'month').values_list('year', 'month').distinct()
+        if options['year'] or options['month']:
+            year, month = resolve_period(options['year'], options['month'], closed=False)
+            periods = periods.filter(year=year, month=month)
+            if not periods:
+                self.stdout.write('No bill in {}/{:02d}.'.format(year, month))
+                return
+
+        started = time.perf_counter()
+        drifts = []
+        for year, month in periods:
+            period_drifts = reconcile(year, month)
+            for drift in period_drifts:
+                self.stdout.write('{} {}/{:02d}: {} in the bills, {} in the totals.'.format(
+                    drift.source, year, month, format_totals(drift.expected), format_totals(drift.stored)
+                ))
+            if period_drifts and options['fix']:
+                fix(period_drifts)
+            drifts.extend(period_drifts)
+
+        summary = 'Reconciled {} period(s) in {:.2f}s: {} total(s) drifted'.format(
+            len(periods), time.perf_counter() - started, len(drifts)
+        )
+        if drifts and not options['fix']:
+            raise CommandError(summary + '.')
+        self.stdout.write(self.style.SUCCESS(summary + (', fixed.' if drifts else '.')))
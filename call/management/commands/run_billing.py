@@ -0,0 +1,75 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from call.billing import CSV, NDJSON, bill_shard, concatenate, shard_path
+from call.snapshots import resolve_period
+
+
+def setup_worker():
+    # the processes started with spawn (macOS, Windows) have to set up Django, it is a no-op for forked ones
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the bill of every subscriber for a closed period (default: the previous month) to a gzip file, '
+        'one subscriber per line: NDJSON with the calls or CSV with the totals. Prices are in centavos and '
+        'durations in seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int)
+        parser.add_argument('--month', type=int, choices=range(1, 13), metavar='{1..12}')
+        parser.add_argument('--output', help='Path of the file (default: bills-<year>-<month>.<format>.gz).')
+        parser.add_argument('--format', choices=(NDJSON, CSV), default=NDJSON, help='File format (default: ndjson).')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes billing a shard of the subscribers each (default: the number of CPUs).'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Bills fetched from the database cursor at a time by each process (default: 2000).'
+        )
+
+    def handle(self, *args, **options):
+        year, month = resolve_period(options['year'], options['month'])
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('The number of workers and the chunk size must be positive.')
+
+        file_format = options['format']
+        path = options['output'] or 'bills-{:04d}-{:02d}.{}.gz'.format(year, month, file_format)
+        shards = options['workers']
+        jobs = [
+            (year, month, shard_path(path, shard), file_format, shard, shards, options['chunk_size'])
+            for shard in range(shards)
+        ]
+
+        started = time.perf_counter()
+        if shards == 1:
+            results = [bill_shard(*jobs[0])]
+        else:
+            # each process opens its own connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=shards, initializer=setup_worker) as executor:
+                results = list(executor.map(bill_shard, *zip(*jobs)))
+        for result in results:
+            self.stdout.write('shard {}: {} subscribers, {} calls in {:.2f}s ({:.0f} calls/s)'.format(
+                result.shard, result.subscribers, result.calls, result.seconds,
+                result.calls / result.seconds if result.seconds else 0
+            ))
+        concatenate(path, results, file_format)
+
+        elapsed = time.perf_counter() - started
+        subscribers = sum(result.subscribers for result in results)
+        calls = sum(result.calls for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            'Billed {} subscribers, {} calls, {} centavos for {}/{:02d} to {} in {:.2f}s ({:.0f} calls/s).'.format(
+                subscribers, calls, sum(result.total_price for result in results), year, month, path, elapsed,
+                calls / elapsed if elapsed else 0
+            )
+        ))
@@ -0,0 +1,103 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from call.models import TariffPlan
+from call.simulation import candidate_tariff, parse_band, simulate_period
+from call.snapshots import resolve_period
+from call.tariff import Tariff
+from call.util import format_price
+
+
+def previous_periods(year, month, months):
+    """ the ``months`` periods ending with year/month, oldest first
+    """
+    periods = []
+    for _ in range(months):
+        periods.append((year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return periods[::-1]
+
+
+def format_change(cents):
+    return ('-' if cents < 0 else '+') + format_price(abs(cents))
+
+
+class Command(BaseCommand):
+    help = (
+        'Price the calls of closed periods with a candidate tariff and report the revenue change, without '
+        'changing the prices of the bills. The tariff is a stored plan (--plan) or a fixed charge with bands.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int)
+        parser.add_argument('--month', type=int, choices=range(1, 13), metavar='{1..12}')
+        parser.add_argument('--months', type=int, default=1, help='Periods simulated, ending with the given one.')
+        parser.add_argument('--plan', type=int, help='Id of the TariffPlan to simulate.')
+        parser.add_argument('--fixed-charge', help='Standing charge in reais, e.g. 0.36.')
+        parser.add_argument(
+            '--band', action='append', default=[], metavar='HH:MM-HH:MM=CHARGE',
+            help='Charge per completed minute in reais between two times of the day, repeatable.'
+        )
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Calls priced at a time (default: 10000).')
+        parser.add_argument('--output', help='CSV file receiving the current and simulated price per subscriber.')
+
+    def get_tariff(self, options):
+        if options['plan'] is not None:
+            if options['fixed_charge'] is not None or options['band']:
+                raise CommandError('Inform either --plan or --fixed-charge with --band, not both.')
+            plan = TariffPlan.objects.prefetch_related('bands').filter(pk=options['plan']).first()
+            if plan is None:
+                raise CommandError('Tariff plan {} does not exist.'.format(options['plan']))
+            return Tariff.from_plan(plan)
+        if options['fixed_charge'] is None:
+            raise CommandError('Inform --plan, or --fixed-charge and the --band of the candidate tariff.')
+        try:
+            bands = [parse_band(band) for band in options['band']]
+        except ValueError as error:
+            raise CommandError(error)
+        return candidate_tariff(options['fixed_charge'], bands)
+
+    def handle(self, *args, **options):
+        year, month = resolve_period(options['year'], options['month'])
+        if options['months'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('The number of months and the chunk size must be positive.')
+        try:
+            tariff = self.get_tariff(options)
+        except ArithmeticError:
+            raise CommandError('Invalid fixed charge {!r}.'.format(options['fixed_charge']))
+
+        started = time.perf_counter()
+        rows = []
+        calls = current = simulated = 0
+        for period_year, period_month in previous_periods(year, month, options['months']):
+            impacts = simulate_period(period_year, period_month, tariff, options['chunk_size'])
+            period_calls = sum(impact.calls for impact in impacts.values())
+            period_current = sum(impact.current_price for impact in impacts.values())
+            period_simulated = sum(impact.simulated_price for impact in impacts.values())
+            self.stdout.write('{}/{:02d}: {} calls of {} subscribers, {} now, {} simulated ({})'.format(
+                period_year, period_month, period_calls, len(impacts), format_price(period_current),
+                format_price(period_simulated), format_change(period_simulated - period_current)
+            ))
+            calls += period_calls
+            current += period_current
+            simulated += period_simulated
+            rows.extend(
+                (source, period_year, period_month, impact.calls, impact.current_price, impact.simulated_price)
+                for source, impact in sorted(impacts.items())
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(('source', 'year', 'month', 'calls', 'current_price', 'simulated_price'))
+                writer.writerows(rows)
+
+        change = simulated - current
+        self.stdout.write(self.style.SUCCESS(
+            'Simulated {} calls in {:.2f}s: {} now, {} simulated, {} ({:+.2%}).'.format(
+                calls, time.perf_counter() - started, format_price(current), format_price(simulated),
+                format_change(change), change / current if current else 0
+            )
+        ))
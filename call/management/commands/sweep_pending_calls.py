@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from call.models import Call, PendingCall
+
+
+class Command(BaseCommand):
+    help = 'Report the call records waiting for their pair for too long and optionally expire them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=float, default=24,
+            help='Hours a record must have been waiting to be considered stale (default: 24).'
+        )
+        parser.add_argument(
+            '--expire', action='store_true',
+            help='Delete the stale records instead of only reporting them.'
+        )
+
+    def handle(self, *args, **options):
+        limit = timezone.now() - timedelta(hours=options['older_than'])
+        stale = PendingCall.objects.filter(created__lt=limit)
+
+        by_type = stale.values('record__type').annotate(total=Count('id')).order_by('record__type')
+        total = 0
+        for row in by_type:
+            total += row['total']
+            self.stdout.write('{}: {} stale record(s)'.format(row['record__type'], row['total']))
+        if options['verbosity'] > 1:
+            for call_id in stale.values_list('call_id', flat=True).iterator():
+                self.stdout.write('  call_id {}'.format(call_id))
+
+        if options['expire'] and total:
+            with transaction.atomic():
+                # deleting the record also removes it from the pending table
+                _, deleted = Call.objects.filter(pending__created__lt=limit).delete()
+            self.stdout.write(self.style.SUCCESS('Expired {} stale record(s).'.format(deleted.get('call.Call', 0))))
+        elif not total:
+            self.stdout.write('No stale records.')
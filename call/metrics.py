@@ -0,0 +1,158 @@
+""" In-process metrics exposed in the Prometheus text format at /metrics.
+
+Every process keeps its own counters and histograms, so each worker of a multi-process server (gunicorn) is
+scraped and aggregated on its own, labelled by the scraper with its instance.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # label values tuple -> value
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self.samples(labels, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self, labels, value):
+        yield '{}{} {}'.format(self.name, _labels(self.labelnames, labels), _number(value))
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # the observation is counted in its own bucket only, the buckets are accumulated when rendered
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get_count(self, *labels):
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+    def get_sum(self, *labels):
+        state = self._values.get(labels)
+        return state[1] if state else 0
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self, labels, state):
+        counts, total, count = state
+        names = self.labelnames + ('le',)
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            yield '{}_bucket{} {}'.format(self.name, _labels(names, labels + (_number(bound),)), cumulative)
+        yield '{}_sum{} {}'.format(self.name, _labels(self.labelnames, labels), _number(total))
+        yield '{}_count{} {}'.format(self.name, _labels(self.labelnames, labels), count)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'Requests answered, by endpoint and status code.', ('method', 'endpoint', 'status')
+)
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time to answer a request.', ('method', 'endpoint')
+)
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database queries run by a request.', ('method', 'endpoint'), buckets=QUERY_BUCKETS
+)
+REQUEST_DB_DURATION = registry.histogram(
+    'http_request_db_duration_seconds', 'Time a request spent waiting for the database.', ('method', 'endpoint')
+)
+PRICING_DURATION = registry.histogram(
+    'call_pricing_duration_seconds', 'Time to price a call from its start and end.',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+)
+PAIRING_DURATION = registry.histogram(
+    'call_pairing_duration_seconds',
+    'Time to look up the stored records of a call and pair them, per request (single) or batch (bulk).', ('mode',)
+)
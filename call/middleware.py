@@ -0,0 +1,94 @@
+import cProfile
+import os
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from call.metrics import REQUEST_DB_DURATION, REQUEST_DURATION, REQUEST_QUERIES, REQUESTS
+
+
+class QueryStats:
+    """ database wrapper (see ``connection.execute_wrapper``) counting the queries of a request and their time
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def endpoint(request):
+    """ name of the view answering a request, a bounded label unlike its path
+    """
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    """ record the latency, database queries and database time of every request, exposed at /metrics
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        labels = (request.method, endpoint(request))
+        REQUESTS.inc(*labels, str(response.status_code))
+        REQUEST_DURATION.observe(elapsed, *labels)
+        REQUEST_QUERIES.observe(stats.count, *labels)
+        REQUEST_DB_DURATION.observe(stats.seconds, *labels)
+        return response
+
+
+class ProfilingMiddleware:
+    """ save a cProfile dump of the slow requests of a sample, to be read with pstats or snakeviz
+
+        Off unless settings.CALL_PROFILE_DIR is set. Then a share of the requests (CALL_PROFILE_SAMPLE_RATE) is
+        profiled and dumped when it takes at least CALL_PROFILE_SLOW_SECONDS, and a request with the
+        ``X-Profile: 1`` header is always profiled and dumped.
+    """
+    header = 'HTTP_X_PROFILE'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        directory = getattr(settings, 'CALL_PROFILE_DIR', None)
+        if not directory:
+            return self.get_response(request)
+        forced = request.META.get(self.header) == '1'
+        if not forced and random.random() >= settings.CALL_PROFILE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        response = profile.runcall(self.get_response, request)
+        elapsed = time.perf_counter() - started
+        if forced or elapsed >= settings.CALL_PROFILE_SLOW_SECONDS:
+            name = '{}-{}-{}-{:.0f}ms.prof'.format(
+                time.strftime('%Y%m%dT%H%M%S'), request.method,
+                re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'root', elapsed * 1000
+            )
+            path = os.path.join(directory, name)
+            profile.dump_stats(path)
+            response['X-Profile-Dump'] = name
+        return response
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:36
+
+import datetime
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def create_standard_plan(apps, schema_editor):
+    """ the price rules that were hard-coded until now, also used to price the existing bills
+    """
+    TariffPlan = apps.get_model('call', 'TariffPlan')
+    Bill = apps.get_model('call', 'Bill')
+    plan = TariffPlan.objects.create(
+        name='Standard',
+        effective_from=datetime.datetime(1970, 1, 1, tzinfo=timezone.utc),
+        fixed_charge=Decimal('0.36')
+    )
+    plan.bands.create(start=datetime.time(6, 0, 0), end=datetime.time(22, 0, 0), charge_minute=Decimal('0.09'))
+    plan.bands.create(start=datetime.time(22, 0, 0), end=datetime.time(6, 0, 0), charge_minute=Decimal('0.00'))
+    Bill.objects.filter(tariff__isnull=True).update(tariff=plan)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TariffPlan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('effective_from', models.DateTimeField(unique=True)),
+                ('fixed_charge', models.DecimalField(decimal_places=2, max_digits=8)),
+            ],
+            options={
+                'ordering': ('effective_from',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TariffBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.TimeField()),
+                ('end', models.TimeField()),
+                ('charge_minute', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='call.TariffPlan')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='tariff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='call.TariffPlan'),
+        ),
+        migrations.RunPython(create_standard_plan, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_unpaired_calls(apps, schema_editor):
+    Call = apps.get_model('call', 'Call')
+    PendingCall = apps.get_model('call', 'PendingCall')
+    starts = Call.objects.filter(type='start').values('call_id')
+    ends = Call.objects.filter(type='end').values('call_id')
+    unpaired = Call.objects.filter(
+        models.Q(type='start') & ~models.Q(call_id__in=ends) | models.Q(type='end') & ~models.Q(call_id__in=starts)
+    )
+    PendingCall.objects.bulk_create(
+        PendingCall(record_id=call.id, call_id=call.call_id) for call in unpaired.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0002_tariff_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCall',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_id', models.PositiveIntegerField(unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending', to='call.Call')),
+            ],
+        ),
+        migrations.RunPython(add_unpaired_calls, migrations.RunPython.noop),
+    ]
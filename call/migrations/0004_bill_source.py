@@ -0,0 +1,31 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+def copy_source(apps, schema_editor):
+    Bill = apps.get_model('call', 'Bill')
+    Call = apps.get_model('call', 'Call')
+    Bill.objects.update(
+        source=models.Subquery(Call.objects.filter(pk=models.OuterRef('destination_id')).values('source')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0003_pending_call'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='source',
+            field=models.CharField(blank=True, max_length=11, null=True),
+        ),
+        migrations.RunPython(copy_source, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['source', 'year', 'month'], name='call_bill_source_period_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0004_bill_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillSnapshot',
+            fields=[
+                ('key', models.CharField(max_length=24, primary_key=True, serialize=False)),
+                ('source', models.CharField(max_length=11)),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('content', models.TextField()),
+                ('etag', models.CharField(max_length=66)),
+                ('call_count', models.PositiveIntegerField()),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:44
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+
+DURATION = re.compile(r'^(\d+)h(\d+)m(\d+)s$')
+
+
+def to_cents(value):
+    """ centavos of a price stored like R$ 3,96, R$ 0,9 or 3.96
+    """
+    return int(Decimal(value.replace('R$', '').strip().replace(',', '.')) * 100)
+
+
+def to_seconds(value):
+    hours, minutes, seconds = DURATION.match(value.strip()).groups()
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def convert_forwards(apps, schema_editor):
+    Bill = apps.get_model('call', 'Bill')
+    BillSnapshot = apps.get_model('call', 'BillSnapshot')
+    for bill in Bill.objects.only('price', 'duration').iterator():
+        bill.price_cents = to_cents(bill.price)
+        bill.duration_seconds = to_seconds(bill.duration)
+        bill.save(update_fields=['price_cents', 'duration_seconds'])
+    for snapshot in BillSnapshot.objects.only('total_price').iterator():
+        snapshot.total_price_cents = int(snapshot.total_price * 100)
+        snapshot.save(update_fields=['total_price_cents'])
+
+
+def convert_backwards(apps, schema_editor):
+    Bill = apps.get_model('call', 'Bill')
+    BillSnapshot = apps.get_model('call', 'BillSnapshot')
+    for bill in Bill.objects.only('price_cents', 'duration_seconds').iterator():
+        bill.price = 'R$ {},{:02d}'.format(*divmod(bill.price_cents, 100))
+        minutes, seconds = divmod(bill.duration_seconds, 60)
+        bill.duration = '{}h{}m{}s'.format(minutes // 60, minutes % 60, seconds)
+        bill.save(update_fields=['price', 'duration'])
+    for snapshot in BillSnapshot.objects.only('total_price_cents').iterator():
+        snapshot.total_price = Decimal(snapshot.total_price_cents) / 100
+        snapshot.save(update_fields=['total_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0005_bill_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='price_cents',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='duration_seconds',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='billsnapshot',
+            name='total_price_cents',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        # nullable so that removing them can be reversed
+        migrations.AlterField(
+            model_name='bill',
+            name='price',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='bill',
+            name='duration',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='billsnapshot',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(convert_forwards, convert_backwards),
+        migrations.RemoveField(
+            model_name='bill',
+            name='price',
+        ),
+        migrations.RemoveField(
+            model_name='bill',
+            name='duration',
+        ),
+        migrations.RemoveField(
+            model_name='billsnapshot',
+            name='total_price',
+        ),
+        migrations.RenameField(
+            model_name='bill',
+            old_name='price_cents',
+            new_name='price',
+        ),
+        migrations.RenameField(
+            model_name='bill',
+            old_name='duration_seconds',
+            new_name='duration',
+        ),
+        migrations.RenameField(
+            model_name='billsnapshot',
+            old_name='total_price_cents',
+            new_name='total_price',
+        ),
+    ]
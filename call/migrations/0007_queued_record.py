@@ -0,0 +1,25 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0006_integer_price_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField()),
+                ('call_id', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('errors', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0007_queued_record'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='record_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
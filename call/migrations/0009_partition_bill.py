@@ -0,0 +1,31 @@
+# Generated by Django 2.2.2 on 2026-10-18 04:58
+
+from django.db import migrations
+
+from call import partitions
+
+
+def partition_bills(apps, schema_editor):
+    # other databases keep a single bill table, see call.partitions
+    if partitions.supports_partitions(schema_editor.connection):
+        with schema_editor.connection.cursor() as cursor:
+            partitions.partition_bill_table(cursor)
+        partitions.clear()
+
+
+def unpartition_bills(apps, schema_editor):
+    if partitions.supports_partitions(schema_editor.connection):
+        with schema_editor.connection.cursor() as cursor:
+            partitions.unpartition_bill_table(cursor)
+        partitions.clear()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0008_call_record_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_bills, unpartition_bills),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0009_partition_bill'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['timestamp', 'id'], name='call_call_timestamp_id_idx'),
+        ),
+    ]
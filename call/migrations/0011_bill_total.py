@@ -0,0 +1,44 @@
+# Generated by Django 2.2.2 on 2026-10-18 05:19
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def fill_totals(apps, schema_editor):
+    """ totals of the bills written before the model, one GROUP BY query
+    """
+    Bill = apps.get_model('call', 'Bill')
+    BillTotal = apps.get_model('call', 'BillTotal')
+    now = timezone.now()
+    totals = Bill.objects.exclude(source=None).order_by().values('source', 'year', 'month').annotate(
+        call_count=Count('id'), total_duration=Sum('duration'), total_price=Sum('price')
+    )
+    BillTotal.objects.bulk_create((BillTotal(updated=now, **row) for row in totals.iterator()), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0010_call_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=11)),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('call_count', models.PositiveIntegerField(default=0)),
+                ('total_duration', models.PositiveIntegerField(default=0)),
+                ('total_price', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('source', 'year', 'month')},
+            },
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.2 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0011_bill_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=5)),
+                ('call_id', models.PositiveIntegerField()),
+                ('record_id', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('type', 'call_id')},
+            },
+        ),
+    ]
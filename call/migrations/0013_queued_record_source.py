@@ -0,0 +1,27 @@
+# Generated by Django 2.2.2 on 2026-10-18 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call', '0012_archived_record'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedrecord',
+            name='source',
+            field=models.CharField(blank=True, max_length=11, null=True),
+        ),
+        migrations.AlterField(
+            model_name='queuedrecord',
+            name='call_id',
+            field=models.PositiveIntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='queuedrecord',
+            index=models.Index(fields=['source', 'timestamp'], name='call_queue_source_time_idx'),
+        ),
+    ]
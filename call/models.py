@@ -7,6 +7,8 @@ from call.config import Constants
 
 
 class Call(models.Model):
+    # identifier given to the record by the telecom platform, optional
+    record_id = models.CharField(max_length=64, blank=True, null=True, unique=True)
     type = models.CharField(max_length=5)
     timestamp = models.DateTimeField()
     call_id = models.PositiveIntegerField()
@@ -19,6 +21,94 @@ class Call(models.Model):
     class Meta:
         # same type and identifier means duplicate call
         unique_together = ('type', 'call_id')
+        indexes = [
+            # order of the listing, see KeysetPagination
+            models.Index(fields=['timestamp', 'id'], name='call_call_timestamp_id_idx'),
+        ]
+
+
+class PendingCall(models.Model):
+    """ A call record still waiting for the record of the other type with the same call_id.
+
+        The telecom platforms deliver the start and end records in any order, so the first one of a pair is
+        kept here until the second arrives and the call can be billed.
+    """
+
+    record = models.OneToOneField(
+        Call,
+        on_delete=models.CASCADE,
+        related_name='pending'
+    )
+    # only one record of a pair can be waiting for the other
+    call_id = models.PositiveIntegerField(unique=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return "Pending %s record of call %s" % (self.record.type, self.call_id)
+
+
+class QueuedRecord(models.Model):
+    """ A call record acknowledged by the API and waiting to be paired and priced by the ingestion workers.
+
+        Used when settings.CALL_INGEST_MODE is 'async'. Processed records are deleted, except the rejected and
+        conflicting ones, kept with their errors.
+    """
+
+    # the request body, as validated by the API
+    payload = models.TextField()
+    call_id = models.PositiveIntegerField(db_index=True)
+    # the source of the start records, to tell which bill is still waiting for them
+    source = models.CharField(max_length=11, blank=True, null=True)
+    timestamp = models.DateTimeField(db_index=True)
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(blank=True, null=True, db_index=True)
+    errors = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the pending records of a bill, see call.ingest_queue.pending_records
+            models.Index(fields=['source', 'timestamp'], name='call_queue_source_time_idx'),
+        ]
+
+    def __str__(self):
+        return "Queued record of call %s" % self.call_id
+
+
+class TariffPlan(models.Model):
+    """ A version of the price rules, applied to the calls started from ``effective_from`` on.
+
+        Plans are never edited in place when the prices change: a new plan with a later ``effective_from``
+        is created instead, so the bills already priced keep pointing to the rules that priced them.
+    """
+
+    name = models.CharField(max_length=50)
+    effective_from = models.DateTimeField(unique=True)
+    fixed_charge = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        return "%s (from %s)" % (self.name, self.effective_from)
+
+    class Meta:
+        ordering = ('effective_from',)
+
+
+class TariffBand(models.Model):
+    """ The charge per completed minute between two times of the day (both excluded).
+
+        A band whose end is not after its start wraps midnight.
+    """
+
+    plan = models.ForeignKey(
+        TariffPlan,
+        on_delete=models.CASCADE,
+        related_name='bands'
+    )
+    start = models.TimeField()
+    end = models.TimeField()
+    charge_minute = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        return "%s to %s: %s" % (self.start, self.end, self.charge_minute)
 
 
 class Bill(models.Model):
@@ -35,12 +125,102 @@ class Bill(models.Model):
         related_name='call_destination',
         null=True
     )
+    # number that originated the call, copied from the start record to find the bills of a subscriber
+    # without joining the calls
+    source = models.CharField(max_length=11, blank=True, null=True)
     start_date = models.DateField()
     start_time = models.TimeField()
-    duration = models.CharField(max_length=10)
+    # in seconds
+    duration = models.PositiveIntegerField()
     month = models.IntegerField(default=datetime.now().month)
     year = models.IntegerField(default=datetime.now().year)
-    price = models.CharField(max_length=10)
+    # in centavos, formatted by the API
+    price = models.PositiveIntegerField()
+    tariff = models.ForeignKey(
+        TariffPlan,
+        on_delete=models.PROTECT,
+        related_name='bills',
+        null=True
+    )
 
     def __str__(self):
         return "Bill for %s" % self.destination
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'year', 'month'], name='call_bill_source_period_idx'),
+        ]
+
+
+class BillSnapshot(models.Model):
+    """ The rendered bill of a subscriber for a closed period.
+
+        A closed period does not change, so its bill is built once by the close_period command and served as
+        is. The primary key is made of the subscriber and the period, so the bill endpoint reads it directly.
+    """
+
+    key = models.CharField(max_length=24, primary_key=True)
+    source = models.CharField(max_length=11)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    # the JSON body of the bill endpoint
+    content = models.TextField()
+    etag = models.CharField(max_length=66)
+    call_count = models.PositiveIntegerField()
+    # in centavos
+    total_price = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def make_key(source, year, month):
+        return '{}/{:04d}/{:02d}'.format(source, year, month)
+
+    def __str__(self):
+        return "Bill snapshot of %s" % self.key
+
+
+class BillTotal(models.Model):
+    """ The running totals of the bill of a subscriber for a period.
+
+        Incremented in the transaction writing every new bill (see call.totals), so the current spend of a
+        subscriber is read from one row whatever the number of calls. The reconcile_bill_totals command
+        recomputes them from the bills to detect and fix any drift. The totals of the periods removed by the
+        archive_periods command are kept.
+    """
+
+    source = models.CharField(max_length=11)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    call_count = models.PositiveIntegerField(default=0)
+    # in seconds
+    total_duration = models.PositiveIntegerField(default=0)
+    # in centavos
+    total_price = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField()
+
+    def __str__(self):
+        return "Bill total of %s for %s/%02d" % (self.source, self.year, self.month)
+
+    class Meta:
+        # the key of the upsert adding new bills, and of the lookup of the summary endpoint
+        unique_together = ('source', 'year', 'month')
+
+
+class ArchivedRecord(models.Model):
+    """ The key of a call record removed from the database with its period by the archive_periods command.
+
+        The records of a call are only stored once, by their type and call_id and by their record id, and the
+        telecom platforms resend records. The ingestion looks the keys of new records up here too, so a record
+        resent after its period was archived is answered as a duplicate instead of being billed again.
+    """
+
+    type = models.CharField(max_length=5)
+    call_id = models.PositiveIntegerField()
+    record_id = models.CharField(max_length=64, blank=True, null=True, unique=True)
+    timestamp = models.DateTimeField()
+
+    def __str__(self):
+        return "Archived %s record of call %s" % (self.type, self.call_id)
+
+    class Meta:
+        unique_together = ('type', 'call_id')
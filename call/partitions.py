@@ -0,0 +1,209 @@
+""" Monthly partitions of the bill table.
+
+On PostgreSQL 11 or later migration 0009 turns ``call_bill`` into a table partitioned by range of (year, month),
+with one partition per billing period named like ``call_bill_p201712`` and a default partition. The primary key
+becomes (id, year, month), as PostgreSQL requires the partition key in every unique constraint. A bill lookup
+filtering on a period only scans the partition of that period, whatever the size of the history, and an old
+period leaves the table by detaching its partition instead of deleting its rows (see the archive_periods command).
+
+The close_period command creates the partitions of the current and next periods ahead of their bills. A bill of
+a period without one, e.g. written late, has its partition created by the process writing it (see
+ensure_bill_partitions).
+
+Other databases, like the SQLite used in development, keep a single bill table. The index on (source, year,
+month) narrows a bill lookup to the bills of the subscriber in the period, and old periods are deleted row by
+row by archive_periods.
+
+The call records are not partitioned: the uniqueness of their type and call_id and of their record id spans
+every period, and bills and pending calls reference them.
+"""
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+BILL_TABLE = 'call_bill'
+DEFAULT_PARTITION = 'call_bill_default'
+
+# periods whose partition exists, per database alias, so writing a bill does not query the catalog
+_partitions = {}
+
+# key of the advisory lock taken to create a partition
+PARTITION_LOCK = 0x63616c6c
+
+
+def next_period(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def partition_name(year, month):
+    return '{}_p{:04d}{:02d}'.format(BILL_TABLE, year, month)
+
+
+def supports_partitions(connection=connection):
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned(connection=connection):
+    """ whether the bill table is partitioned, checked once per process
+    """
+    if not supports_partitions(connection):
+        return False
+    if connection.alias not in _partitions:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE parent.relname = %s',
+                [BILL_TABLE]
+            )
+            names = {row[0] for row in cursor.fetchall()}
+        if DEFAULT_PARTITION not in names:
+            _partitions[connection.alias] = None
+        else:
+            _partitions[connection.alias] = {
+                (int(name[-6:-2]), int(name[-2:])) for name in names if name != DEFAULT_PARTITION
+            }
+    return _partitions[connection.alias] is not None
+
+
+def known_partitions(connection=connection):
+    """ periods of the partitions of the bill table, empty when it is not partitioned
+    """
+    if not is_partitioned(connection):
+        return set()
+    return set(_partitions[connection.alias])
+
+
+def clear():
+    _partitions.clear()
+
+
+def create_partition(cursor, year, month):
+    """ create the partition of a period, moving its bills out of the default partition if there are any
+
+        The default partition keeps the bills written before the partition of their period existed, e.g. loaded
+        by a fixture, and PostgreSQL refuses to create a partition whose rows are in the default one.
+
+        Runs in a transaction holding an advisory lock until it ends, so of two processes writing the first bills
+        of a period at once, the second waits for the first to commit and finds the partition created.
+    """
+    name = partition_name(year, month)
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [PARTITION_LOCK])
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+    if cursor.fetchone()[0]:
+        return
+    bounds = 'FOR VALUES FROM ({}, {}) TO ({}, {})'.format(year, month, *next_period(year, month))
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM {} WHERE year = %s AND month = %s)'.format(DEFAULT_PARTITION), [year, month]
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} {}'.format(name, BILL_TABLE, bounds))
+        return
+    cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(BILL_TABLE, DEFAULT_PARTITION))
+    cursor.execute('CREATE TABLE {} PARTITION OF {} {}'.format(name, BILL_TABLE, bounds))
+    cursor.execute(
+        'INSERT INTO {} SELECT * FROM {} WHERE year = %s AND month = %s'.format(BILL_TABLE, DEFAULT_PARTITION),
+        [year, month]
+    )
+    cursor.execute('DELETE FROM {} WHERE year = %s AND month = %s'.format(DEFAULT_PARTITION), [year, month])
+    cursor.execute('ALTER TABLE {} ATTACH PARTITION {} DEFAULT'.format(BILL_TABLE, DEFAULT_PARTITION))
+
+
+def ensure_partitions(periods, connection=connection):
+    """ create the partitions of the (year, month) ``periods`` that do not exist yet, return the ones created
+
+        Does not query the database once the partitions are known, and nothing at all when the bill table is not
+        partitioned.
+    """
+    if not periods or not is_partitioned(connection):
+        return set()
+    known = _partitions[connection.alias]
+    missing = set(periods) - known
+    if not missing:
+        return set()
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for year, month in sorted(missing):
+            create_partition(cursor, year, month)
+    known.update(missing)
+    return missing
+
+
+def ensure_bill_partitions(bills, connection=connection):
+    """ create the partitions of the periods of ``bills`` that do not exist yet
+    """
+    ensure_partitions({(bill.year, bill.month) for bill in bills}, connection)
+
+
+def drop_partition(year, month, connection=connection):
+    """ detach the partition of a period from the bill table and drop it
+    """
+    name = partition_name(year, month)
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(BILL_TABLE, name))
+        cursor.execute('DROP TABLE {}'.format(name))
+    if _partitions.get(connection.alias):
+        _partitions[connection.alias].discard((year, month))
+
+
+def _table_definitions(cursor, table):
+    """ (index definitions, foreign key definitions) of a table, to recreate them on its replacement
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE '%%_pkey'", [table]
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    return indexes, cursor.fetchall()
+
+
+@contextmanager
+def _replace_table(cursor, table, create, primary_key):
+    """ create a new table with the ``create`` statement, and once the block is done, copy ``table`` into it and
+        replace it
+
+        The sequence of the primary key, the indexes and the foreign keys are kept with the same names, so
+        the migrations of Django keep finding them.
+    """
+    new_table = table + '_new'
+    indexes, foreign_keys = _table_definitions(cursor, table)
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(sequence))
+
+    cursor.execute(create.format(new_table, table))
+    cursor.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(new_table, primary_key))
+    yield new_table
+    cursor.execute('INSERT INTO {} SELECT * FROM {}'.format(new_table, table))
+    cursor.execute('DROP TABLE {}'.format(table))
+    cursor.execute('ALTER TABLE {} RENAME TO {}'.format(new_table, table))
+    cursor.execute('ALTER INDEX {}_pkey RENAME TO {}_pkey'.format(new_table, table))
+    cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, table))
+    for index in indexes:
+        cursor.execute(index)
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(table, name, definition))
+
+
+def partition_bill_table(cursor):
+    """ replace the bill table with one partitioned by period, with a partition for each period billed
+    """
+    create = 'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (year, month)'
+    with _replace_table(cursor, BILL_TABLE, create, 'id, year, month') as new_table:
+        cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(DEFAULT_PARTITION, new_table))
+        cursor.execute('SELECT DISTINCT year, month FROM {}'.format(BILL_TABLE))
+        for year, month in cursor.fetchall():
+            cursor.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}, {}) TO ({}, {})'.format(
+                partition_name(year, month), new_table, year, month, *next_period(year, month)
+            ))
+
+
+def unpartition_bill_table(cursor):
+    """ replace the partitioned bill table with a single table
+    """
+    create = 'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    with _replace_table(cursor, BILL_TABLE, create, 'id'):
+        pass
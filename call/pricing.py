@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime, time, timedelta, timezone
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+    # numpy is in the requirements, without it the batches are priced many times slower
+    logging.getLogger(__name__).warning('NumPy is not installed, the calls of a batch are priced one at a time.')
+
+MICROSECONDS_PER_MINUTE = 60 * 10 ** 6
+MICROSECONDS_PER_DAY = 24 * 60 * MICROSECONDS_PER_MINUTE
+
+STANDARD_TIME_START = time(6, 0, 0)
+STANDARD_TIME_END = time(22, 0, 0)
+
+
+def _time_to_microseconds(value):
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 10 ** 6 + value.microsecond
+
+
+def count_billable_minutes(call_start, call_end, window_start=STANDARD_TIME_START, window_end=STANDARD_TIME_END):
+    """ count the completed minutes of a call that end inside a tariff window
+
+        A minute is charged when the moment it completes falls strictly between ``window_start`` and
+        ``window_end`` (both excluded) and strictly before ``call_end``, exactly like the per-minute loop
+        in :func:`count_billable_minutes_stepwise`. Instead of stepping through every minute the interval
+        is split at the window cut-offs of each day it spans, so the cost is proportional to the number
+        of days of the call and not to its length in minutes.
+
+        A window whose end is not after its start wraps midnight (e.g. 22h00 to 6h00).
+    """
+    duration = (call_end - call_start) // timedelta(microseconds=1)
+    if duration <= 0:
+        return 0
+
+    # k-th minute completes at offset + k * MICROSECONDS_PER_MINUTE, counted from the start of the first day
+    offset = _time_to_microseconds(call_start.time())
+    last_minute = (duration - 1) // MICROSECONDS_PER_MINUTE
+    if last_minute < 1:
+        return 0
+
+    lower = _time_to_microseconds(window_start)
+    upper = _time_to_microseconds(window_end)
+    if upper <= lower:
+        upper += MICROSECONDS_PER_DAY
+
+    minutes = 0
+    last_day = (offset + last_minute * MICROSECONDS_PER_MINUTE) // MICROSECONDS_PER_DAY
+    # a window wrapping midnight starts on the day before the call
+    for day in range(-1, last_day + 1):
+        window_lower = day * MICROSECONDS_PER_DAY + lower - offset
+        window_upper = day * MICROSECONDS_PER_DAY + upper - offset
+        first = max(1, window_lower // MICROSECONDS_PER_MINUTE + 1)
+        last = min(last_minute, (window_upper - 1) // MICROSECONDS_PER_MINUTE)
+        if last >= first:
+            minutes += last - first + 1
+    return minutes
+
+
+def count_billable_minutes_stepwise(call_start, call_end, window_start=STANDARD_TIME_START,
+                                    window_end=STANDARD_TIME_END):
+    """ reference implementation stepping through every minute of the call
+
+        Kept to check :func:`count_billable_minutes` against and to benchmark it. Only supports windows
+        that do not wrap midnight.
+    """
+    minutes = 0
+
+    while call_start < call_end:
+        call_start = call_start + timedelta(minutes=1)
+        if call_start < call_end and window_start < call_start.time() < window_end:
+            minutes += 1
+
+    return minutes
+
+
+def calculate_price(call_start, call_end, fixed_charge, bands):
+    """ price of a call given the fixed charge and an iterable of (start, end, charge per minute) bands
+    """
+    total = fixed_charge
+    for band_start, band_end, charge_minute in bands:
+        if charge_minute:
+            total += count_billable_minutes(call_start, call_end, band_start, band_end) * charge_minute
+    return total
+
+
+def _epoch_microseconds(seconds):
+    seconds = numpy.asarray(seconds)
+    if seconds.dtype.kind in 'iu':
+        return seconds.astype(numpy.int64) * 10 ** 6
+    return numpy.rint(seconds * 10 ** 6).astype(numpy.int64)
+
+
+def count_billable_minutes_batch(starts, ends, window_start=STANDARD_TIME_START, window_end=STANDARD_TIME_END):
+    """ :func:`count_billable_minutes` of many calls given as sequences of start and end epoch seconds (UTC)
+
+        The arithmetic of each day spanned by the calls is run on NumPy arrays of all the calls at once. Without
+        NumPy, only expected where the requirements are not installed, the calls are counted one at a time and a
+        list is returned.
+    """
+    if numpy is None:
+        return [
+            count_billable_minutes(_from_epoch(start), _from_epoch(end), window_start, window_end)
+            for start, end in zip(starts, ends)
+        ]
+
+    starts = _epoch_microseconds(starts)
+    duration = _epoch_microseconds(ends) - starts
+    offset = starts % MICROSECONDS_PER_DAY
+    # calls not long enough to complete a minute have a last minute of 0 and count nothing below
+    last_minute = numpy.where(duration > 0, (duration - 1) // MICROSECONDS_PER_MINUTE, 0)
+
+    lower = _time_to_microseconds(window_start)
+    upper = _time_to_microseconds(window_end)
+    if upper <= lower:
+        upper += MICROSECONDS_PER_DAY
+
+    minutes = numpy.zeros(len(starts), dtype=numpy.int64)
+    if not len(starts):
+        return minutes
+    last_day = int(((offset + last_minute * MICROSECONDS_PER_MINUTE) // MICROSECONDS_PER_DAY).max())
+    # the days after the last one of a call start after its last minute, and count nothing for it
+    for day in range(-1, last_day + 1):
+        window_lower = day * MICROSECONDS_PER_DAY + lower - offset
+        window_upper = day * MICROSECONDS_PER_DAY + upper - offset
+        first = numpy.maximum(1, window_lower // MICROSECONDS_PER_MINUTE + 1)
+        last = numpy.minimum(last_minute, (window_upper - 1) // MICROSECONDS_PER_MINUTE)
+        minutes += numpy.maximum(0, last - first + 1)
+    return minutes
+
+
+def calculate_prices_batch(starts, ends, fixed_charge, bands):
+    """ (billable minutes of each band, prices in centavos) of many calls given as sequences of epoch seconds
+
+        The prices are the ones of :func:`calculate_price` rounded half up to centavos like ``Tariff.get_price``,
+        summed in integers of the smallest decimal place of the charges so the vectorized sums are exact.
+    """
+    bands = list(bands)
+    minutes = [count_billable_minutes_batch(starts, ends, start, end) for start, end, _ in bands]
+    charges = [Decimal(fixed_charge)] + [Decimal(charge) for _, _, charge in bands]
+    places = max(2, max(-charge.as_tuple().exponent for charge in charges))
+    scale = 10 ** places
+    fixed_units = int(charges[0] * scale)
+    band_units = [int(charge * scale) for charge in charges[1:]]
+
+    # rounded half up to centavos, the charges are not negative
+    divisor = scale // 100
+    if numpy is None:
+        totals = [fixed_units] * len(starts)
+        for band_minutes, units in zip(minutes, band_units):
+            totals = [total + count * units for total, count in zip(totals, band_minutes)]
+        return minutes, [(total + divisor // 2) // divisor for total in totals]
+
+    totals = numpy.full(len(starts), fixed_units, dtype=numpy.int64)
+    for band_minutes, units in zip(minutes, band_units):
+        totals += band_minutes * units
+    return minutes, (totals + divisor // 2) // divisor
+
+
+def _from_epoch(seconds):
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=round(seconds * 10 ** 6))
@@ -0,0 +1,95 @@
+""" Routing of the bill and call listings to the read replicas (``settings.CALL_DB_REPLICAS``).
+
+The views reading from a replica run in ``replica_reads`` (see call.api.views.ReplicaReadMixin), which routes
+the reads of the request to a replica picked at random. Everything else reads and writes the primary: the
+ingestion, whose pairing and duplicate lookups must see the records just written, the commands and the
+migrations, which never run on a replica.
+
+A replica lags behind the primary, so the bills of a subscriber who just got new ones would be missing from it
+for a moment, and a bill cached then (see call.bill_cache) would miss them until its entry times out. The paths
+writing bills call ``mark_written``, and the reads of the bills of that subscriber stay on the primary for
+``settings.CALL_DB_STICKY_SECONDS``.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+from call.metrics import registry
+
+REPLICA_READS = registry.counter(
+    'db_routed_reads_total', 'Requests allowed to read from a replica, by database alias serving them.', ('alias',)
+)
+
+# alias serving the reads of the current request of the thread, None outside of replica_reads
+_state = threading.local()
+
+# the cache noting the subscribers with recent writes, shared by the processes when it is Redis
+STICKY_CACHE = 'bills'
+
+
+def sticky_key(source):
+    return 'written:{}'.format(source)
+
+
+def mark_written(bills):
+    """ keep the reads of the subscribers of newly written ``bills`` on the primary for a while
+    """
+    timeout = settings.CALL_DB_STICKY_SECONDS
+    if not settings.CALL_DB_REPLICAS or not timeout:
+        return
+    keys = {sticky_key(bill.source): 1 for bill in bills if bill.source}
+    if not keys:
+        return
+    cache = caches[STICKY_CACHE]
+    cache.set_many(keys, timeout)
+    if connection.in_atomic_block:
+        # the window starts again once the bills are committed and start replicating
+        transaction.on_commit(lambda: cache.set_many(keys, timeout))
+
+
+def choose_database(source=None):
+    """ alias of the database serving the reads of a request about the bills of ``source``
+    """
+    replicas = settings.CALL_DB_REPLICAS
+    if not replicas:
+        return DEFAULT_DB_ALIAS
+    if source is not None and caches[STICKY_CACHE].get(sticky_key(source)) is not None:
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+@contextmanager
+def replica_reads(source=None):
+    """ route the reads of the block to a replica, or to the primary after recent writes of ``source``
+    """
+    alias = choose_database(source)
+    REPLICA_READS.inc(alias)
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    try:
+        yield alias
+    finally:
+        _state.alias = previous
+
+
+class ReplicaRouter:
+    """ database router sending the reads of replica_reads blocks to their replica and everything else to the
+        primary
+    """
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.CALL_DB_REPLICAS
@@ -0,0 +1,47 @@
+import threading
+from contextlib import contextmanager
+
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from call.db import check_connections, count_connection, release_connections
+from call.idempotency import recent_records
+from call.models import Call, TariffBand, TariffPlan
+from call.tariff import tariffs
+
+
+@receiver(post_save, sender=TariffPlan)
+@receiver(post_delete, sender=TariffPlan)
+@receiver(post_save, sender=TariffBand)
+@receiver(post_delete, sender=TariffBand)
+def clear_tariff_cache(sender, **kwargs):
+    tariffs.clear()
+
+
+# set by bulk_call_delete for the deletes of its thread only, the other threads keep clearing the recent records
+_bulk_delete = threading.local()
+
+
+@receiver(post_delete, sender=Call)
+def clear_recent_records(sender, **kwargs):
+    if not getattr(_bulk_delete, 'active', False):
+        recent_records.clear()
+
+
+@contextmanager
+def bulk_call_delete():
+    """ delete many calls in the block, clearing the recent records once at the end instead of once per call
+    """
+    _bulk_delete.active = True
+    try:
+        yield
+    finally:
+        _bulk_delete.active = False
+        recent_records.clear()
+
+
+request_started.connect(check_connections)
+request_finished.connect(release_connections)
+connection_created.connect(count_connection)
@@ -0,0 +1,65 @@
+""" What-if pricing of the stored calls of past periods with a candidate tariff.
+
+The calls of a period are streamed from their bills in chunks and priced a chunk at a time by
+``Tariff.get_prices``, vectorized with NumPy when it is installed. Nothing is written to the database: the
+prices of the bills stay the ones of the tariff in effect when the calls were made.
+
+The calls are priced from their start and their duration in whole seconds, as stored on the bills.
+"""
+from collections import namedtuple
+from datetime import date, time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from call.models import Bill
+from call.tariff import Band, Tariff
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+SubscriberImpact = namedtuple('SubscriberImpact', ('source', 'calls', 'current_price', 'simulated_price'))
+
+
+def parse_band(value):
+    """ Band of a ``HH:MM-HH:MM=charge`` string, the charge per minute in reais
+    """
+    try:
+        times, charge = value.split('=')
+        start, end = (time(*map(int, part.split(':'))) for part in times.split('-'))
+        return Band(start, end, Decimal(charge))
+    except (ValueError, TypeError, InvalidOperation):
+        raise ValueError('Invalid band {!r}, expected HH:MM-HH:MM=charge, e.g. 06:00-22:00=0.09.'.format(value))
+
+
+def candidate_tariff(fixed_charge, bands):
+    return Tariff(id=None, effective_from=None, fixed_charge=Decimal(fixed_charge), bands=tuple(bands))
+
+
+def epoch_seconds(start_date, start_time):
+    return (
+        (start_date.toordinal() - EPOCH_ORDINAL) * 86400 + start_time.hour * 3600 + start_time.minute * 60 +
+        start_time.second + start_time.microsecond / 10 ** 6
+    )
+
+
+def simulate_period(year, month, tariff, chunk_size=10000):
+    """ SubscriberImpact of every subscriber billed in a period, by source
+    """
+    rows = Bill.objects.filter(year=year, month=month).exclude(source=None).values_list(
+        'source', 'start_date', 'start_time', 'duration', 'price'
+    ).iterator(chunk_size=chunk_size)
+    # source -> [calls, current price, simulated price]
+    totals = {}
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        starts = [epoch_seconds(start_date, start_time) for _, start_date, start_time, _, _ in chunk]
+        ends = [start + row[3] for start, row in zip(starts, chunk)]
+        for row, simulated in zip(chunk, tariff.get_prices(starts, ends)):
+            subscriber = totals.get(row[0])
+            if subscriber is None:
+                subscriber = totals[row[0]] = [0, 0, 0]
+            subscriber[0] += 1
+            subscriber[1] += row[4]
+            subscriber[2] += int(simulated)
+    return {source: SubscriberImpact(source, *subscriber) for source, subscriber in totals.items()}
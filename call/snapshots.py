@@ -0,0 +1,130 @@
+import hashlib
+from datetime import date, datetime
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from call.api.fastpath import BILL_ROW, render_bills
+from call.models import Bill, BillSnapshot
+from call.util import in_lookup_chunks
+
+
+def is_closed(year, month, today=None):
+    """ a period is closed once the month has ended
+    """
+    today = today or date.today()
+    return (year, month) < (today.year, today.month)
+
+
+def last_closed_period(today=None):
+    """ (year, month) of the previous month
+    """
+    today = today or date.today()
+    if today.month == 1:
+        return today.year - 1, 12
+    return today.year, today.month - 1
+
+
+def resolve_period(year=None, month=None, closed=True):
+    """ (year, month) of the --year and --month options of a command, the last closed period when both are omitted
+
+        Raise CommandError when only one of them is given, or when the period is not closed yet unless ``closed`` is
+        False.
+    """
+    if not (year or month):
+        return last_closed_period()
+    if not (year and month):
+        raise CommandError('Inform both --year and --month.')
+    if closed and (year, month) > last_closed_period():
+        raise CommandError('The period {}/{:02d} is not closed yet.'.format(year, month))
+    return year, month
+
+
+def period_start(year, month):
+    """ first moment of the period, in UTC
+    """
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def period_end(year, month):
+    """ first moment after the period, in UTC
+    """
+    if month == 12:
+        return datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    return datetime(year, month + 1, 1, tzinfo=timezone.utc)
+
+
+def render_snapshot(source, year, month, rows):
+    """ unsaved BillSnapshot of the given call.api.fastpath.BILL_ROW rows, with the same JSON body as the bill
+        endpoint
+    """
+    content = render_bills(rows)
+    return BillSnapshot(
+        key=BillSnapshot.make_key(source, year, month),
+        source=source,
+        year=year,
+        month=month,
+        content=content.decode('utf-8'),
+        etag='"{}"'.format(hashlib.sha256(content).hexdigest()),
+        call_count=len(rows),
+        total_price=sum(row[-1] for row in rows)
+    )
+
+
+def period_bills(year, month):
+    """ the source followed by the BILL_ROW fields of the bills of a period
+
+        The calls of each subscriber are in the order of the bill listing, see BillKeysetPagination.
+    """
+    return Bill.objects.filter(year=year, month=month).order_by('source', 'start_date', 'start_time', 'id').values_list(
+        'source', *BILL_ROW
+    )
+
+
+def build_snapshot(source, year, month):
+    """ build or rebuild the snapshot of a subscriber for a period
+    """
+    rows = [row[1:] for row in period_bills(year, month).filter(source=source)]
+    snapshot = render_snapshot(source, year, month, rows)
+    snapshot.save()
+    return snapshot
+
+
+def close_period(year, month, batch_size=500):
+    """ build the snapshots of every subscriber billed in a period, streaming the bills ordered by subscriber
+
+        Return the number of snapshots built.
+    """
+    snapshots = []
+    count = 0
+    rows = period_bills(year, month).exclude(source=None).iterator(chunk_size=2000)
+    for source, subscriber_rows in groupby(rows, key=itemgetter(0)):
+        snapshots.append(render_snapshot(source, year, month, [row[1:] for row in subscriber_rows]))
+        if len(snapshots) == batch_size:
+            count += _save_snapshots(snapshots)
+            snapshots = []
+    return count + _save_snapshots(snapshots)
+
+
+def _save_snapshots(snapshots):
+    with transaction.atomic():
+        BillSnapshot.objects.filter(key__in=[snapshot.key for snapshot in snapshots]).delete()
+        BillSnapshot.objects.bulk_create(snapshots)
+    return len(snapshots)
+
+
+def refresh_snapshots(bills):
+    """ rebuild the snapshots already built for the subscribers and closed periods of late bills
+    """
+    keys = {
+        BillSnapshot.make_key(bill.source, bill.year, bill.month): (bill.source, bill.year, bill.month)
+        for bill in bills if is_closed(bill.year, bill.month)
+    }
+    if not keys:
+        return
+    for chunk in in_lookup_chunks(keys):
+        for key in BillSnapshot.objects.filter(key__in=chunk).values_list('key', flat=True):
+            build_snapshot(*keys[key])
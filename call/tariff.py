@@ -0,0 +1,88 @@
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from call.config import Constants
+from call.models import TariffPlan
+from call.pricing import calculate_price, calculate_prices_batch
+
+Band = namedtuple('Band', ('start', 'end', 'charge_minute'))
+
+
+class Tariff(namedtuple('Tariff', ('id', 'effective_from', 'fixed_charge', 'bands'))):
+    """ immutable, in-memory copy of a TariffPlan and its bands
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_plan(cls, plan):
+        bands = tuple(Band(band.start, band.end, band.charge_minute) for band in plan.bands.all())
+        return cls(plan.id, plan.effective_from, plan.fixed_charge, bands)
+
+    def get_price(self, call_start, call_end):
+        """ price of a call in centavos
+        """
+        total = calculate_price(call_start, call_end, self.fixed_charge, self.bands)
+        return int((total * 100).to_integral_value(ROUND_HALF_UP))
+
+    def get_prices(self, starts, ends):
+        """ prices in centavos of many calls given as sequences of start and end epoch seconds, vectorized
+        """
+        return calculate_prices_batch(starts, ends, self.fixed_charge, self.bands)[1]
+
+
+# used when no plan is effective for a call, e.g. before the first plan is created
+DEFAULT_TARIFF = Tariff(
+    id=None,
+    effective_from=datetime.min.replace(tzinfo=timezone.utc),
+    fixed_charge=Decimal(str(Constants.FIXED_CHARGE)),
+    bands=(
+        Band(time(6, 0, 0), time(22, 0, 0), Decimal(str(Constants.CHARGE_MINUTE))),
+        Band(time(22, 0, 0), time(6, 0, 0), Decimal('0.00')),
+    )
+)
+
+
+class TariffCache:
+    """ process-wide cache of every tariff plan, indexed by the moment it becomes effective
+
+        The plans are loaded with two queries the first time a price is calculated and then looked up with a
+        binary search, so pricing a call does not touch the database. Saving or deleting a plan or a band
+        clears the cache of the current process (see call.signals); other processes reload it once it is
+        older than ``settings.TARIFF_CACHE_TIMEOUT`` seconds, so plans should be created at least that long
+        before they become effective.
+    """
+
+    def __init__(self):
+        # (effective_from list, tariff list, loaded at), replaced as a whole so readers never see a partial load
+        self._index = None
+
+    def load(self):
+        plans = TariffPlan.objects.prefetch_related('bands').order_by('effective_from')
+        tariffs = [Tariff.from_plan(plan) for plan in plans]
+        self._index = ([tariff.effective_from for tariff in tariffs], tariffs, timezone.now())
+        return self._index
+
+    def clear(self):
+        self._index = None
+
+    def get(self, when):
+        """ return the tariff in effect at ``when``
+        """
+        index = self._index
+        timeout = getattr(settings, 'TARIFF_CACHE_TIMEOUT', None)
+        if index is None or (timeout is not None and (timezone.now() - index[2]).total_seconds() > timeout):
+            index = self.load()
+        starts, tariffs, loaded_at = index
+        position = bisect_right(starts, when) - 1
+        if position < 0:
+            return DEFAULT_TARIFF
+        return tariffs[position]
+
+
+tariffs = TariffCache()
@@ -1,11 +1,73 @@
+import asyncio
+import gzip
+import json
+import os
+import pstats
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time as time_module
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
 from django.core.exceptions import ValidationError, MultipleObjectsReturned
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete
+from django.core.wsgi import get_wsgi_application
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from call.models import Call, Bill
+from call import columnar, db, partitions, pricing
+from call.api.fastpath import BILL_ROW, CALL_ROW, render_bills, render_calls
+from call.api.pagination import BillKeysetPagination
+from call.api.serializers import BillSerializer, CallSerializer
+from call.asgi import AsgiHandler
+from call.bill_cache import BILL_CACHE, BillCache, bill_cache
+from call.billing import CSV, bill_shard, concatenate, shard_path
+from call.models import ArchivedRecord, Call, Bill, BillSnapshot, BillTotal, PendingCall, QueuedRecord, TariffPlan
 from call.config import Constants
+from call.idempotency import recent_records
+from call.metrics import PAIRING_DURATION, PRICING_DURATION, REQUEST_QUERIES, REQUESTS, Histogram
+from call.pricing import (
+    calculate_prices_batch, count_billable_minutes, count_billable_minutes_batch, count_billable_minutes_stepwise
+)
+from call.ingest import ingest_records
+from call.ingest_queue import process_batch
+from call.tariff import DEFAULT_TARIFF, Band, Tariff, tariffs
+from call.routers import REPLICA_READS, replica_reads
+from call.signals import bulk_call_delete
+from call.totals import reconcile
+from call.util import CalculateBill, calculate_call
+from call.warmup import warm_up
+
+
+class ClearCachesMixin:
+    """ forget the responses cached for the records posted by a test, and the bills it read
+
+        The rollback of the test transaction does not send the signals clearing the caches, and the ids of its
+        rows are given again by the next test, or by the ones of the other classes.
+    """
+
+    def setUp(self):
+        super(ClearCachesMixin, self).setUp()
+        recent_records.clear()
+        bill_cache.clear()
+
+    def tearDown(self):
+        recent_records.clear()
+        bill_cache.clear()
+        super(ClearCachesMixin, self).tearDown()
 
 
 class CallModelTests(TestCase):
@@ -55,7 +117,7 @@ class CallModelTests(TestCase):
             call.full_clean()
 
 
-class CallEndPointTestCase(TestCase):
+class CallEndPointTestCase(ClearCachesMixin, TestCase):
     CALL_URL = '/api/v1/call/'
 
     fixtures = ['initial_data.json']
@@ -166,6 +228,29 @@ class CallEndPointTestCase(TestCase):
             response.json()
         )
 
+    def test_unknown_type_call(self):
+        """Test the API for create a call with a type other than start and end, which must not end the call
+        """
+        self.create_call(Constants.START)
+        response = self.api_client.post(self.CALL_URL, {
+            "call_id": 78, "timestamp": "2018-07-07 15:14:56+00:00", "type": "foo"
+        }, format='json')
+        self.assertEquals(400, response.status_code)
+        self.assertEquals({'type': ['"foo" is not a valid choice.']}, response.json())
+        self.assertFalse(Bill.objects.filter(destination__call_id=78).exists())
+
+    def test_concurrent_pair(self):
+        """Test a start and an end of the same call validated before either is saved, which must be billed
+        """
+        start = CallSerializer(data=self.post_data_start)
+        end = CallSerializer(data=self.post_data_end)
+        self.assertTrue(start.is_valid() and end.is_valid())
+        end.save()
+        start.save()
+        self.assertEqual(sorted(Call.objects.filter(call_id=78).values_list('type', flat=True)), ['end', 'start'])
+        self.assertFalse(PendingCall.objects.filter(call_id=78).exists())
+        self.assertEqual(Bill.objects.get(destination__call_id=78).duration, 463)
+
     def teste_invalid_timestamp_call(self):
         """Test the API for create a new call with an invalid timestamp
         """
@@ -180,15 +265,31 @@ class CallEndPointTestCase(TestCase):
             response.json()
         )
 
-    def test_invalid_call_end_call_id(self):
-        """Test the API for create a new end call with invalid call_id
+    def test_end_call_before_start_call(self):
+        """Test the API for create an end call before its start call
+        The end call should wait for the start call and the bill be created when it arrives
         """
-        self.post_data_end['call_id'] = 999
-        self.create_call(Constants.START)
         response = self.create_call(Constants.END)
+        self.assertEquals(201, response.status_code)
+        self.assertTrue(PendingCall.objects.filter(call_id=78, record__type=Constants.END).exists())
+        self.assertFalse(Bill.objects.filter(destination__call_id=78).exists())
+
+        response = self.create_call(Constants.START)
+        self.assertEquals(201, response.status_code)
+        self.assertFalse(PendingCall.objects.filter(call_id=78).exists())
+        bill = Bill.objects.get(destination__call_id=78)
+        self.assertEqual((bill.year, bill.month), (2018, 7))
+        self.assertEqual(bill.duration, 463)
+
+    def test_invalid_call_start_timestamp(self):
+        """Test the API for create a start call after its end call with invalid timestamp
+        """
+        self.post_data_start['timestamp'] = "2018-07-08 15:07:13+00:00"
+        self.create_call(Constants.END)
+        response = self.create_call(Constants.START)
         self.assertEquals(400, response.status_code)
         self.assertEquals(
-            {'non_field_errors': ['Does not exist a call start entry with this call id: 999']},
+            {'non_field_errors': ["Invalid timestamp. Must be lower then {}".format(self.post_data_end['timestamp'])]},
             response.json()
         )
 
@@ -205,7 +306,7 @@ class CallEndPointTestCase(TestCase):
         )
 
 
-class BillsTests(TestCase):
+class BillsTests(ClearCachesMixin, TestCase):
     CALL_URL = '/api/v1/call/'
     BILL_URL = '/api/v1/bill/'
 
@@ -245,3 +346,1426 @@ class BillsTests(TestCase):
         bills = response.json()
         self.assertEqual(len(bills), 1)
         self.assertEqual(bills[0]['price'], 'R$ 0,54')
+        self.assertEqual(bills[0]['destination'], '9993468278')
+        self.assertEqual(Bill.objects.get().source, '99988526423')
+
+    def test_bill_queries_do_not_grow(self):
+        """ the bill is read with the same number of queries whatever the number of calls in it
+        """
+        records = []
+        for call_id in range(100, 120):
+            records.append({"type": Constants.START, "timestamp": "2016-02-19T21:57:13Z", "call_id": call_id,
+                            "source": "99988526423", "destination": "99934{:05d}".format(call_id)})
+            records.append({"type": Constants.END, "timestamp": "2016-02-19T22:10:56Z", "call_id": call_id})
+
+        # the period is closed: the snapshot is looked up before the version of the cached bill (its total) and
+        # the bills, read once for the page and the totals
+        self.client.post(self.CALL_URL + 'bulk/', json.dumps(records[:2]), content_type='application/json')
+        with self.assertNumQueries(3):
+            response = self.client.get(self.BILL_URL + '99988526423/2016/02/')
+        self.assertEqual(len(response.json()), 1)
+
+        self.client.post(self.CALL_URL + 'bulk/', json.dumps(records[2:]), content_type='application/json')
+        with self.assertNumQueries(3):
+            response = self.client.get(self.BILL_URL + '99988526423/2016/02/')
+        bills = response.json()
+        self.assertEqual(len(bills), 20)
+        self.assertEqual((response['X-Bill-Calls'], response['X-Bill-Total']), ('20', 'R$ 10,80'))
+        self.assertEqual(sorted(bill['destination'] for bill in bills)[-1], '9993400119')
+
+    @skipUnless(connection.vendor == 'sqlite', 'the query plan is checked on SQLite')
+    def test_bill_lookup_uses_index(self):
+        """ the bills of a subscriber and period are found by index, without joining the calls
+        """
+        queryset = Bill.objects.filter(source='99988526423', year=2016, month=2)
+        self.assertNotIn('JOIN', str(queryset.query))
+        self.assertIn('call_bill_source_period_idx', queryset.explain())
+
+
+class PricingTests(SimpleTestCase):
+
+    def test_readme_example(self):
+        """ a call started at 21:57:13 and finished at 22:17:53 has 2 billable minutes
+        """
+        call_start = datetime(2017, 12, 12, 21, 57, 13, tzinfo=timezone.utc)
+        call_end = datetime(2017, 12, 12, 22, 17, 53, tzinfo=timezone.utc)
+        self.assertEqual(count_billable_minutes(call_start, call_end), 2)
+
+    def test_same_result_as_loop(self):
+        """ the closed-form count must match the per-minute loop for short and multi-day calls
+        """
+        call_start = datetime(2017, 12, 12, 4, 57, 13, tzinfo=timezone.utc)
+        for seconds in (0, 59, 60, 61, 3600, 3600 * 17 + 1, 86400, 86400 + 60 * 13 + 43, 86400 * 3 + 7):
+            for start_offset in range(0, 86400, 3547):
+                start = call_start + timedelta(seconds=start_offset)
+                end = start + timedelta(seconds=seconds)
+                self.assertEqual(
+                    count_billable_minutes(start, end),
+                    count_billable_minutes_stepwise(start, end),
+                    (start, end)
+                )
+
+    def test_window_boundaries_excluded(self):
+        """ minutes completing exactly at 6h00 or 22h00 are not charged
+        """
+        call_start = datetime(2017, 12, 12, 5, 58, 0, tzinfo=timezone.utc)
+        call_end = datetime(2017, 12, 12, 6, 2, 30, tzinfo=timezone.utc)
+        self.assertEqual(count_billable_minutes(call_start, call_end), 2)
+
+        call_start = datetime(2017, 12, 12, 21, 58, 0, tzinfo=timezone.utc)
+        call_end = datetime(2017, 12, 12, 22, 2, 30, tzinfo=timezone.utc)
+        self.assertEqual(count_billable_minutes(call_start, call_end), 1)
+
+    def test_window_wrapping_midnight(self):
+        """ a reduced tariff window from 22h00 to 6h00 counts the minutes of the night
+        """
+        call_start = datetime(2017, 12, 12, 21, 0, 0, tzinfo=timezone.utc)
+        call_end = datetime(2017, 12, 13, 7, 0, 30, tzinfo=timezone.utc)
+        self.assertEqual(count_billable_minutes(call_start, call_end, time(22, 0, 0), time(6, 0, 0)), 8 * 60 - 1)
+
+    def batch_calls(self):
+        call_start = datetime(2017, 12, 12, 4, 57, 13, tzinfo=timezone.utc)
+        calls = []
+        for seconds in (-5, 0, 59, 60, 61, 3600, 3600 * 17 + 1, 86400 + 60 * 13 + 43, 86400 * 3 + 7):
+            for start_offset in range(0, 86400, 3547):
+                start = call_start + timedelta(seconds=start_offset, microseconds=start_offset * 7)
+                calls.append((start, start + timedelta(seconds=seconds)))
+        return calls
+
+    def assert_batch_matches(self):
+        calls = self.batch_calls()
+        starts = [start.timestamp() for start, _ in calls]
+        ends = [end.timestamp() for _, end in calls]
+        for window in ((time(6, 0, 0), time(22, 0, 0)), (time(22, 0, 0), time(6, 0, 0))):
+            self.assertEqual(
+                list(count_billable_minutes_batch(starts, ends, *window)),
+                [count_billable_minutes(start, end, *window) for start, end in calls]
+            )
+
+        tariff = Tariff(None, None, Decimal('0.36'), (
+            Band(time(6, 0, 0), time(22, 0, 0), Decimal('0.095')), Band(time(22, 0, 0), time(6, 0, 0), Decimal('0.01'))
+        ))
+        self.assertEqual(
+            [int(price) for price in tariff.get_prices(starts, ends)],
+            [tariff.get_price(start, end) for start, end in calls]
+        )
+        minutes, prices = calculate_prices_batch([], [], Decimal('0.36'), DEFAULT_TARIFF.bands)
+        self.assertEqual((len(minutes[0]), len(prices)), (0, 0))
+
+    @skipUnless(pricing.numpy, 'NumPy is not installed')
+    def test_batch_same_result_as_closed_form(self):
+        """ the vectorized counts and prices match the ones of the calls priced one at a time
+        """
+        self.assert_batch_matches()
+
+    def test_batch_without_numpy(self):
+        with patch.object(pricing, 'numpy', None):
+            self.assert_batch_matches()
+
+
+class TariffPlanTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+    BILL_URL = '/api/v1/bill/'
+
+    def setUp(self):
+        super(TariffPlanTests, self).setUp()
+        self.client = APIClient()
+        self.standard = TariffPlan.objects.get(name='Standard')
+        self.plan = TariffPlan.objects.create(
+            name='2018 prices',
+            effective_from='2018-01-01T00:00:00Z',
+            fixed_charge='0.50'
+        )
+        self.plan.bands.create(start=time(8, 0, 0), end=time(20, 0, 0), charge_minute='0.10')
+        self.plan.bands.create(start=time(20, 0, 0), end=time(8, 0, 0), charge_minute='0.01')
+
+    def tearDown(self):
+        # the rollback of the test transaction does not send the signals clearing the cache
+        tariffs.clear()
+        super(TariffPlanTests, self).tearDown()
+
+    def create_call(self, call_id, start, end):
+        self.client.post(self.CALL_URL, {
+            "type": Constants.START,
+            "timestamp": start,
+            "call_id": call_id,
+            "source": "99988526423",
+            "destination": "9993468278"
+        })
+        self.client.post(self.CALL_URL, {"type": Constants.END, "timestamp": end, "call_id": call_id})
+        return Bill.objects.get(destination__call_id=call_id)
+
+    def test_effective_plan_prices_the_call(self):
+        """ the plan in effect when the call started is used and recorded in the bill
+        """
+        bill = self.create_call(70, '2017-12-12T21:57:13Z', '2017-12-12T22:17:53Z')
+        self.assertEqual(bill.price, 54)
+        self.assertEqual(bill.tariff, self.standard)
+
+        # 2 minutes at 0.10 before 20h00 and 3 minutes at 0.01 after it
+        bill = self.create_call(71, '2018-01-02T19:57:13Z', '2018-01-02T20:03:00Z')
+        self.assertEqual(bill.price, 73)
+        self.assertEqual(bill.tariff, self.plan)
+
+    def test_cache_cleared_when_plan_saved(self):
+        """ saving a plan or its bands is visible to the next priced call
+        """
+        self.assertEqual(str(tariffs.get(timezone.now()).fixed_charge), '0.50')
+        self.plan.fixed_charge = '0.40'
+        self.plan.save()
+        self.assertEqual(str(tariffs.get(timezone.now()).fixed_charge), '0.40')
+
+    def test_tariff_lookup_does_not_query(self):
+        """ once loaded, finding the tariff of a call does not touch the database
+        """
+        tariffs.get(timezone.now())
+        with self.assertNumQueries(0):
+            self.assertEqual(tariffs.get(datetime(2017, 12, 12, tzinfo=timezone.utc)).id, self.standard.id)
+            self.assertEqual(tariffs.get(datetime(2018, 6, 1, tzinfo=timezone.utc)).id, self.plan.id)
+
+
+class SweepPendingCallsTests(TestCase):
+
+    def setUp(self):
+        super(SweepPendingCallsTests, self).setUp()
+        for call_id in (80, 81):
+            call = Call.objects.create(type=Constants.END, timestamp='2018-07-07T15:14:56Z', call_id=call_id)
+            PendingCall.objects.create(record=call, call_id=call_id)
+        PendingCall.objects.filter(call_id=80).update(created=timezone.now() - timedelta(days=2))
+
+    def test_report_stale_calls(self):
+        out = StringIO()
+        call_command('sweep_pending_calls', stdout=out)
+        self.assertIn('end: 1 stale record(s)', out.getvalue())
+        self.assertEqual(PendingCall.objects.count(), 2)
+
+    def test_expire_stale_calls(self):
+        out = StringIO()
+        call_command('sweep_pending_calls', '--expire', stdout=out)
+        self.assertIn('Expired 1 stale record(s).', out.getvalue())
+        self.assertEqual(list(PendingCall.objects.values_list('call_id', flat=True)), [81])
+        self.assertFalse(Call.objects.filter(call_id=80).exists())
+
+
+class BulkCallEndPointTestCase(ClearCachesMixin, TestCase):
+    BULK_URL = '/api/v1/call/bulk/'
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(BulkCallEndPointTestCase, self).setUp()
+        self.client = APIClient()
+        self.records = [
+            {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+             "source": "99988526423", "destination": "9993468278"},
+            {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100},
+            {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 101},
+            {"type": "start", "timestamp": "2017-12-12T15:07:13Z", "call_id": 71,
+             "source": "99988526423", "destination": "9993468278"},
+            {"type": "end", "timestamp": "2017-12-12T22:17:53Z"},
+            {"type": "start", "timestamp": "2017-12-12T23:00:00Z", "call_id": 101,
+             "source": "99988526423", "destination": "9993468278"},
+        ]
+
+    def assert_results(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.json()
+        self.assertEqual((body['accepted'], body['duplicate'], body['rejected']), (3, 1, 2))
+        self.assertEqual(
+            [result['status'] for result in body['results']],
+            ['accepted', 'accepted', 'accepted', 'duplicate', 'rejected', 'rejected']
+        )
+        self.assertEqual(body['results'][4]['errors'], {'call_id': ['This field is required.']})
+        self.assertEqual(body['results'][5]['errors'], {'non_field_errors': [
+            'Invalid timestamp. Must be lower then 2017-12-12 22:17:53+00:00'
+        ]})
+        self.assertEqual(Call.objects.get(type=Constants.END, call_id=100).id, body['results'][1]['id'])
+
+        bill = Bill.objects.get(destination__call_id=100)
+        self.assertEqual((bill.price, bill.duration, bill.year, bill.month), (54, 1240, 2017, 12))
+        self.assertEqual(list(PendingCall.objects.values_list('call_id', flat=True)), [101])
+
+    def test_bulk_json(self):
+        response = self.client.post(self.BULK_URL, self.records, format='json')
+        self.assert_results(response)
+
+    def test_bulk_ndjson(self):
+        body = '\n'.join(json.dumps(record) for record in self.records)
+        response = self.client.post(self.BULK_URL, body, content_type='application/x-ndjson')
+        self.assert_results(response)
+
+    def test_bulk_pairs_with_stored_calls(self):
+        """ records of the batch are paired with the ones already stored using a constant number of queries
+        """
+        self.client.post('/api/v1/call/', self.records[0], format='json')
+        # including the look up of the archived keys, the totals upsert and the look up of the snapshots of the
+        # closed period
+        with self.assertNumQueries(11):
+            response = self.client.post(self.BULK_URL, self.records[1:3], format='json')
+        self.assertEqual(response.json()['accepted'], 2)
+        self.assertTrue(Bill.objects.filter(destination__call_id=100).exists())
+        self.assertFalse(PendingCall.objects.filter(call_id=100).exists())
+
+    def test_bulk_not_a_list(self):
+        response = self.client.post(self.BULK_URL, self.records[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportCDRsTests(TestCase):
+
+    def setUp(self):
+        super(ImportCDRsTests, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'calls.jsonl')
+        records = [
+            {"id": 1, "type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+             "source": "99988526423", "destination": "9993468278"},
+            {"id": 2, "type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100},
+            {"id": 3, "type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 101},
+            {"id": 4, "type": "end", "timestamp": "2017-12-12T22:17:53Z"},
+            {"id": 5, "type": "start", "timestamp": "2017-12-12T15:07:13Z", "call_id": 101,
+             "source": "99988526423", "destination": "9993468278"},
+        ]
+        with open(self.path, 'w') as stream:
+            for record in records:
+                stream.write(json.dumps(record) + '\n')
+            stream.write('not json\n')
+
+    def import_cdrs(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_cdrs', self.path, '--chunk-size', '2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import(self):
+        out, err = self.import_cdrs()
+        self.assertIn('4 accepted, 0 duplicate, 0 conflicting, 2 rejected.', out)
+        self.assertIn('line 4: {"call_id": ["This field is required."]}', err)
+        self.assertIn('line 6: not a JSON object', err)
+        self.assertEqual(Call.objects.count(), 4)
+        self.assertEqual(
+            sorted(Bill.objects.values_list('destination__call_id', 'price')),
+            [(100, 54), (101, 3744)]
+        )
+        self.assertFalse(PendingCall.objects.exists())
+
+    def test_resume_from_checkpoint(self):
+        with open(self.path, 'rb') as stream:
+            offset = len(stream.readline())
+        with open(self.path + '.checkpoint', 'w') as stream:
+            json.dump({'offset': offset, 'line': 1}, stream)
+        out, err = self.import_cdrs()
+        self.assertIn('Resuming {} after line 1.'.format(self.path), out)
+        self.assertIn('3 accepted, 0 duplicate, 0 conflicting, 2 rejected.', out)
+        self.assertFalse(Call.objects.filter(call_id=100, type=Constants.START).exists())
+
+        # a finished import resumes at the end of the file
+        out, err = self.import_cdrs()
+        self.assertIn('0 accepted, 0 duplicate, 0 conflicting, 0 rejected.', out)
+        out, err = self.import_cdrs('--restart')
+        self.assertIn('1 accepted, 3 duplicate, 0 conflicting, 2 rejected.', out)
+
+
+class CalculateBillTests(ClearCachesMixin, TestCase):
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(CalculateBillTests, self).setUp()
+        self.client = APIClient()
+        # the tariff plans are loaded once per process
+        tariffs.get(timezone.now())
+
+    def test_calculate_call(self):
+        """ duration and price are computed from two datetimes without queries
+        """
+        with self.assertNumQueries(0):
+            charge = calculate_call(
+                datetime(2017, 12, 12, 21, 57, 13, tzinfo=timezone.utc),
+                datetime(2017, 12, 13, 22, 10, 56, tzinfo=timezone.utc)
+            )
+        self.assertEqual(charge.duration, 87223)
+        self.assertEqual(charge.price, 8694)
+        self.assertEqual(charge.tariff_id, TariffPlan.objects.get(name='Standard').id)
+
+    def test_single_query(self):
+        """ both records of the call are fetched once
+        """
+        calc_bill = CalculateBill(73)
+        with self.assertNumQueries(1):
+            self.assertEqual(calc_bill.get_call_duration(), '0h13m43s')
+            self.assertEqual(calc_bill.get_call_price(), 'R$ 0,54')
+            calc_bill.get_tariff()
+
+    def test_loaded_records(self):
+        start, end = Call.objects.filter(call_id=74).order_by('-type')
+        calc_bill = CalculateBill(74, start, end.timestamp)
+        with self.assertNumQueries(0):
+            self.assertEqual(calc_bill.get_call_duration(), '1h13m43s')
+            self.assertEqual(calc_bill.get_call_price(), 'R$ 1,35')
+
+    def test_queries_per_ingested_record(self):
+        """ a record waiting for its pair and a record completing a call cost a constant number of queries
+        """
+        start = {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                 "source": "99988526423", "destination": "9993468278"}
+        end = {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100}
+        # pair lookup, archived key lookup, then in a savepoint call insert and pending insert
+        with self.assertNumQueries(6):
+            self.client.post('/api/v1/call/', start, format='json')
+        # pair lookup, then in a savepoint pending lock, call insert, pending delete, bill insert and totals upsert,
+        # and snapshot lookup as the period is closed
+        with self.assertNumQueries(9):
+            self.client.post('/api/v1/call/', end, format='json')
+        self.assertEqual(Bill.objects.get(destination__call_id=100).price, 54)
+
+        response = self.client.post('/api/v1/call/', dict(end, timestamp='2017-12-12T22:18:00Z'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+
+class BillSnapshotTests(ClearCachesMixin, TestCase):
+    BILL_URL = '/api/v1/bill/'
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(BillSnapshotTests, self).setUp()
+        self.client = APIClient()
+
+    def test_close_period(self):
+        """ the snapshot has the same body as the bill built from the bills, and is served with one query
+        """
+        live = self.client.get(self.BILL_URL + '99988526423/2017/12/')
+        out = StringIO()
+        call_command('close_period', '--year', '2017', '--month', '12', stdout=out)
+        self.assertIn('Built 1 bill snapshot(s) for 2017/12', out.getvalue())
+
+        snapshot = BillSnapshot.objects.get()
+        self.assertEqual((snapshot.call_count, snapshot.total_price), (6, 9081))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.BILL_URL + '99988526423/2017/12/')
+        self.assertEqual(response.content, live.content)
+        self.assertEqual(response['ETag'], snapshot.etag)
+        self.assertEqual((response['X-Bill-Calls'], response['X-Bill-Total']), ('6', 'R$ 90,81'))
+        # a late record rebuilds the snapshot, clients revalidate it with its ETag
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60, must-revalidate')
+
+        response = self.client.get(self.BILL_URL + '99988526423/2017/12/', HTTP_IF_NONE_MATCH=snapshot.etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_open_period(self):
+        out = StringIO()
+        today = timezone.now()
+        with self.assertRaises(CommandError):
+            call_command('close_period', '--year', str(today.year), '--month', str(today.month), stdout=out)
+
+    def test_late_call_rebuilds_snapshot(self):
+        """ a call ending in a closed period rebuilds only the snapshot of its subscriber
+        """
+        call_command('close_period', '--year', '2017', '--month', '12', stdout=StringIO())
+        BillSnapshot.objects.create(
+            key=BillSnapshot.make_key('11999999999', 2017, 12), source='11999999999', year=2017, month=12,
+            content='[]', etag='"other"', call_count=0, total_price=0
+        )
+        etag = BillSnapshot.objects.get(source='99988526423').etag
+
+        self.client.post('/api/v1/call/bulk/', [
+            {"type": "start", "timestamp": "2017-12-30T21:57:13Z", "call_id": 100,
+             "source": "99988526423", "destination": "9993468278"},
+            {"type": "end", "timestamp": "2017-12-30T22:17:53Z", "call_id": 100},
+        ], format='json')
+
+        snapshot = BillSnapshot.objects.get(source='99988526423')
+        self.assertNotEqual(snapshot.etag, etag)
+        self.assertEqual(snapshot.call_count, 7)
+        self.assertEqual(len(self.client.get(self.BILL_URL + '99988526423/2017/12/').json()), 7)
+        self.assertEqual(BillSnapshot.objects.get(source='11999999999').etag, '"other"')
+
+
+@override_settings(CALL_INGEST_MODE=Constants.INGEST_ASYNC)
+class AsyncIngestionTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+    BILL_URL = '/api/v1/bill/'
+
+    def setUp(self):
+        super(AsyncIngestionTests, self).setUp()
+        self.client = APIClient()
+        self.start = {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                      "source": "99988526423", "destination": "9993468278"}
+        self.end = {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100}
+
+    def test_records_are_queued(self):
+        response = self.client.post(self.CALL_URL, self.end, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        other = dict(self.start, call_id=101, source='99988526424')
+        response = self.client.post(self.CALL_URL + 'bulk/', [self.start, other, {"type": "start"}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual((response.json()['queued'], response.json()['rejected']), (2, 1))
+        self.assertFalse(Call.objects.exists())
+
+        stats = self.client.get(self.CALL_URL + 'queue/').json()
+        self.assertEqual((stats['mode'], stats['depth']), ('async', 3))
+        # the records of another subscriber do not hold the bill, and the wait is capped
+        with override_settings(CALL_BILL_MAX_WAIT=0):
+            response = self.client.get(self.BILL_URL + '99988526423/2017/12/', {'wait': 60})
+        self.assertEqual((response.json(), response['X-Bill-Pending'], response['Retry-After']), ([], '2', '1'))
+        # nor do the records of a later period
+        response = self.client.get(self.BILL_URL + '99988526423/2017/11/')
+        self.assertEqual(response['X-Bill-Pending'], '0')
+        self.assertFalse(response.has_header('Retry-After'))
+
+        out = StringIO()
+        call_command('process_ingest_queue', '--once', stdout=out)
+        self.assertIn('Queue depth 0', out.getvalue())
+        response = self.client.get(self.BILL_URL + '99988526423/2017/12/')
+        self.assertEqual(response['X-Bill-Pending'], '0')
+        self.assertEqual(response.json()[0]['price'], 'R$ 0,54')
+        self.assertFalse(QueuedRecord.objects.exists())
+
+        # the end record of a start already waiting for its pair holds the bill of the start
+        self.client.post(self.CALL_URL, dict(self.end, call_id=101), format='json')
+        self.assertEqual(self.client.get(self.BILL_URL + '99988526424/2017/12/')['X-Bill-Pending'], '1')
+        self.assertEqual(self.client.get(self.BILL_URL + '99988526423/2017/12/')['X-Bill-Pending'], '0')
+
+    def test_rejected_records_are_kept(self):
+        self.client.post(self.CALL_URL, self.start, format='json')
+        # an identical record is answered from the recent records, a resend with another content is queued
+        response = self.client.post(self.CALL_URL, self.start, format='json')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.client.post(self.CALL_URL, dict(self.start, call_id='100'), format='json')
+        # call 100 belongs to the first of two shards
+        self.assertEqual(process_batch(shard=1, shards=2), 0)
+        self.assertEqual(process_batch(shard=0, shards=2), 2)
+
+        self.assertEqual(Call.objects.count(), 1)
+        self.assertTrue(PendingCall.objects.filter(call_id=100).exists())
+        # a duplicate is not an error, the record is already stored
+        self.assertFalse(QueuedRecord.objects.exists())
+
+        self.client.post(self.CALL_URL, dict(self.end, timestamp='2017-12-12T20:00:00Z'), format='json')
+        call_command('process_ingest_queue', '--once', stdout=StringIO())
+        record = QueuedRecord.objects.get()
+        self.assertIsNotNone(record.processed)
+        self.assertIn('Invalid timestamp', record.errors)
+        self.assertEqual(self.client.get(self.CALL_URL + 'queue/').json()['rejected'], 1)
+
+
+class IdempotencyTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+
+    def setUp(self):
+        super(IdempotencyTests, self).setUp()
+        self.client = APIClient()
+        self.start = {"id": "a-1", "type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                      "source": "99988526423", "destination": "9993468278"}
+
+    def test_replay_from_recent_records(self):
+        created = self.client.post(self.CALL_URL, self.start, format='json')
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(created.json()['record_id'], 'a-1')
+        with self.assertNumQueries(0):
+            response = self.client.post(self.CALL_URL, self.start, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json(), created.json())
+
+    def test_delete_in_another_thread_during_bulk_delete(self):
+        """ only the deletes of the thread in bulk_call_delete wait for its end to clear the recent records
+        """
+        self.client.post(self.CALL_URL, self.start, format='json')
+        call = Call.objects.get()
+        with bulk_call_delete():
+            post_delete.send(sender=Call, instance=call)
+            self.assertIsNotNone(recent_records.get(self.start))
+            other = threading.Thread(target=post_delete.send, kwargs={'sender': Call, 'instance': call})
+            other.start()
+            other.join()
+            self.assertIsNone(recent_records.get(self.start))
+
+    def test_replay_from_database(self):
+        created = self.client.post(self.CALL_URL, self.start, format='json')
+        recent_records.clear()
+        # the same record in another format is compared with the stored call by the pair look up
+        with self.assertNumQueries(1):
+            response = self.client.post(self.CALL_URL, dict(self.start, timestamp='2017-12-12 21:57:13+00:00'),
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json()['id'], created.json()['id'])
+        self.assertEqual(Call.objects.count(), 1)
+
+    def test_conflicting_replay(self):
+        created = self.client.post(self.CALL_URL, self.start, format='json')
+        # same record id for another call
+        response = self.client.post(self.CALL_URL, dict(self.start, call_id=101), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['id'], created.json()['id'])
+        # same type and call_id with another content
+        response = self.client.post(self.CALL_URL, dict(self.start, id='a-2'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Call.objects.count(), 1)
+
+    def test_bulk_conflicts(self):
+        self.client.post(self.CALL_URL, self.start, format='json')
+        end = {"id": "a-2", "type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100}
+        records = [self.start, dict(self.start, call_id=102), end, dict(end, timestamp='2017-12-12T22:17:54Z')]
+        body = self.client.post(self.CALL_URL + 'bulk/', records, format='json').json()
+        self.assertEqual(
+            [result['status'] for result in body['results']], ['duplicate', 'conflict', 'accepted', 'conflict']
+        )
+        self.assertEqual((body['accepted'], body['duplicate'], body['conflict']), (1, 1, 2))
+        self.assertEqual(body['results'][3]['id'], body['results'][2]['id'])
+        self.assertTrue(Bill.objects.filter(destination__call_id=100).exists())
+
+
+class ArchivePeriodsTests(TestCase):
+    BILL_URL = '/api/v1/bill/'
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(ArchivePeriodsTests, self).setUp()
+        self.client = APIClient()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self, name):
+        with gzip.open(os.path.join(self.directory, name), 'rt') as stream:
+            return [json.loads(line) for line in stream]
+
+    def test_archive(self):
+        live = self.client.get(self.BILL_URL + '99988526423/2017/12/')
+        Call.objects.create(type=Constants.START, timestamp='2017-12-30T10:00:00Z', call_id=200)
+        out = StringIO()
+        call_command('archive_periods', '--output', self.directory, '--keep-months', '1', stdout=out)
+        self.assertEqual(out.getvalue().count('Archived'), 3)
+
+        self.assertFalse(Bill.objects.exists())
+        # the record waiting for its pair is not part of an archived bill
+        self.assertEqual(list(Call.objects.values_list('call_id', flat=True)), [200])
+        bills = self.read('bills-2017-12.ndjson.gz')
+        self.assertEqual(len(bills), 6)
+        self.assertEqual(sum(bill['price'] for bill in bills), 9081)
+        calls = self.read('calls-2017-12.ndjson.gz')
+        self.assertEqual(len(calls), 12)
+        self.assertEqual(calls[:2], [
+            {'type': 'start', 'timestamp': '2017-12-12T15:07:13+00:00', 'call_id': 71,
+             'source': '99988526423', 'destination': '9993468278'},
+            {'type': 'end', 'timestamp': '2017-12-12T15:14:56+00:00', 'call_id': 71,
+             'source': None, 'destination': None},
+        ])
+
+        # served from the snapshot built before removing the bills
+        response = self.client.get(self.BILL_URL + '99988526423/2017/12/')
+        self.assertEqual(response.content, live.content)
+
+    def test_columnar(self):
+        call_command('archive_periods', '--output', self.directory, '--keep-months', '1', '--format', 'columnar',
+                     stdout=StringIO())
+        self.assertFalse(Call.objects.exists())
+        path = os.path.join(self.directory, 'calls-2017-12.cdr')
+        self.assertTrue(columnar.is_archive(path))
+        with columnar.CallArchive(path) as archive:
+            self.assertEqual((archive.year, archive.month, len(archive)), (2017, 12, 6))
+            records = list(archive.records())
+            self.assertEqual([record for record in records if record['call_id'] == 71], [
+                {'type': 'start', 'timestamp': '2017-12-12T15:07:13+00:00', 'call_id': 71,
+                 'source': '99988526423', 'destination': '9993468278'},
+                {'type': 'end', 'timestamp': '2017-12-12T15:14:56+00:00', 'call_id': 71,
+                 'source': None, 'destination': None},
+            ])
+            # ready for the batch pricing
+            starts, ends = list(archive.starts()), list(archive.ends())
+            self.assertEqual(sum(end - start for start, end in zip(starts, ends)), 93410)
+            self.assertEqual(starts, sorted(starts))
+        self.assertEqual(len(records), 12)
+
+        # the archived records are duplicates unless restored
+        out = StringIO()
+        call_command('import_cdrs', path, '--restart', stdout=out, stderr=StringIO())
+        self.assertIn('0 accepted, 12 duplicate', out.getvalue())
+        out = StringIO()
+        call_command('import_cdrs', path, '--restart', '--restore', stdout=out, stderr=StringIO())
+        self.assertIn('12 accepted', out.getvalue())
+        self.assertFalse(ArchivedRecord.objects.filter(call_id=71).exists())
+        self.assertEqual(
+            Bill.objects.filter(year=2017, month=12).aggregate(count=Count('id'), duration=Sum('duration')),
+            {'count': 6, 'duration': 93410}
+        )
+
+    def test_archived_records_are_not_billed_again(self):
+        call_command('archive_periods', '--output', self.directory, '--keep-months', '1', stdout=StringIO())
+        self.assertEqual(ArchivedRecord.objects.count(), 16)
+        start = {'type': 'start', 'timestamp': '2017-12-12T15:07:13Z', 'call_id': 71,
+                 'source': '99988526423', 'destination': '9993468278'}
+        end = {'type': 'end', 'timestamp': '2017-12-12T15:14:56Z', 'call_id': 71}
+
+        response = self.client.post('/api/v1/call/', start, format='json')
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (status.HTTP_201_CREATED, 'true'))
+        self.assertIsNone(response.json()['id'])
+        response = self.client.post('/api/v1/call/', dict(start, timestamp='2017-12-12T15:07:14Z'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertNotIn('id', response.json())
+        results = ingest_records([start, end])
+        self.assertEqual([result['status'] for result in results], ['duplicate', 'duplicate'])
+        self.assertFalse(Call.objects.exists())
+        self.assertFalse(Bill.objects.exists())
+
+    def test_columnar_missing_end(self):
+        Call.objects.filter(type=Constants.END, call_id=71).delete()
+        with self.assertRaises(CommandError):
+            call_command('archive_periods', '--output', self.directory, '--keep-months', '1', '--format', 'columnar',
+                         stdout=StringIO())
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('archive_periods', '--output', self.directory, '--keep-months', '1', '--dry-run', stdout=out)
+        self.assertIn('Would archive 2016/02.', out.getvalue())
+        self.assertEqual(Bill.objects.count(), 8)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'the bill table is only partitioned on PostgreSQL')
+    def test_period_lookup_scans_one_partition(self):
+        # the bills of the fixture were loaded into the default partition
+        partitions.clear()
+        self.addCleanup(partitions.clear)
+        periods = Bill.objects.values_list('year', 'month').distinct()
+        with transaction.atomic(), connection.cursor() as cursor:
+            for year, month in periods:
+                partitions.create_partition(cursor, year, month)
+        plan = Bill.objects.filter(source='99988526423', year=2017, month=12).explain()
+        self.assertIn(partitions.partition_name(2017, 12), plan)
+        self.assertNotIn(partitions.partition_name(2018, 3), plan)
+
+
+class RunBillingTests(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(RunBillingTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        Call.objects.create(type=Constants.START, timestamp='2017-12-01T10:00:00Z', call_id=300,
+                            source='11987654321', destination='2199999999')
+        Call.objects.create(type=Constants.END, timestamp='2017-12-01T10:01:00Z', call_id=300)
+        Bill.objects.create(
+            destination=Call.objects.get(type=Constants.START, call_id=300), source='11987654321',
+            start_date=date(2017, 12, 1), start_time=time(10), duration=60, price=45, year=2017, month=12
+        )
+
+    def test_ndjson(self):
+        path = os.path.join(self.directory, 'bills.ndjson.gz')
+        out = StringIO()
+        call_command('run_billing', '--year', '2017', '--month', '12', '--output', path, '--workers', '1', stdout=out)
+        self.assertIn('Billed 2 subscribers, 7 calls, 9126 centavos for 2017/12', out.getvalue())
+
+        with gzip.open(path, 'rt') as stream:
+            bills = [json.loads(line) for line in stream]
+        self.assertEqual([bill['source'] for bill in bills], ['11987654321', '99988526423'])
+        self.assertEqual(
+            (bills[1]['call_count'], bills[1]['total_price'], bills[1]['total_duration']), (6, 9081, 93410)
+        )
+        self.assertEqual(bills[0]['calls'], [{
+            'destination': '2199999999', 'start_date': '2017-12-01', 'start_time': '10:00:00',
+            'duration': 60, 'price': 45,
+        }])
+
+    def test_csv_shards(self):
+        """ the subscribers are split between the shards and the files joined after the header
+        """
+        path = os.path.join(self.directory, 'bills.csv.gz')
+        results = [bill_shard(2017, 12, shard_path(path, shard), CSV, shard, 2) for shard in range(2)]
+        self.assertEqual([result.subscribers for result in results], [0, 2])
+        concatenate(path, results, CSV)
+        with gzip.open(path, 'rt') as stream:
+            self.assertEqual(stream.read().splitlines(), [
+                'source,year,month,call_count,total_duration,total_price',
+                '11987654321,2017,12,1,60,45',
+                '99988526423,2017,12,6,93410,9081',
+            ])
+        self.assertEqual(os.listdir(self.directory), ['bills.csv.gz'])
+
+    def test_open_period(self):
+        with self.assertRaises(CommandError):
+            call_command('run_billing', '--year', '2999', '--month', '1', stdout=StringIO())
+
+
+class PaginationTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+    BILL_URL = '/api/v1/bill/'
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(PaginationTests, self).setUp()
+        self.client = APIClient()
+        # same timestamp as the start of call 70, ordered by id
+        Call.objects.create(type=Constants.START, timestamp='2016-02-29T12:00:00Z', call_id=400)
+
+    def get_pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            url = response['Link'][1:-len('>; rel="next"')] if response.has_header('Link') else None
+        return pages
+
+    def test_call_pages(self):
+        pages = self.get_pages(self.CALL_URL + '?page_size=5')
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 2])
+        ids = [call['id'] for page in pages for call in page]
+        expected = list(Call.objects.order_by('timestamp', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual([call['call_id'] for call in pages[0][:2]], [70, 400])
+
+    def test_page_query(self):
+        """ a page is one query seeking after the cursor, whatever its position
+        """
+        first = self.client.get(self.CALL_URL + '?page_size=5')
+        with self.assertNumQueries(1):
+            self.client.get(first['Link'][1:-len('>; rel="next"')])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.CALL_URL + '?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(self.CALL_URL + '?page_size=x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bill_pages(self):
+        pages = self.get_pages(self.BILL_URL + '99988526423/2017/12/?page_size=4')
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(
+            [(bill['start_date'], bill['start_time']) for bill in pages[0][:2]],
+            [('2017-12-12', '04:57:13'), ('2017-12-12', '15:07:13')]
+        )
+
+    def test_export(self):
+        response = self.client.get(self.CALL_URL + 'export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response.streaming)
+        calls = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        listed = [call for page in self.get_pages(self.CALL_URL + '?page_size=1000') for call in page]
+        self.assertEqual(calls, listed)
+
+
+class FastPathTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+    BILL_URL = '/api/v1/bill/'
+
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(FastPathTests, self).setUp()
+        self.client = APIClient()
+        Call.objects.create(record_id='r é"1', type=Constants.START, timestamp='2018-01-01T00:00:00.5Z',
+                            call_id=500, source='11987654321', destination=None)
+
+    def test_calls_as_serializer(self):
+        calls = Call.objects.order_by('timestamp', 'id')
+        expected = JSONRenderer().render(CallSerializer(calls, many=True).data)
+        self.assertEqual(render_calls(calls.values_list(*CALL_ROW)), expected)
+        self.assertEqual(self.client.get(self.CALL_URL + '?page_size=1000').content, expected)
+
+    def test_bills_as_serializer(self):
+        bills = Bill.objects.filter(source='99988526423', year=2017, month=12).order_by(*BillKeysetPagination.keyset)
+        bills.filter(id=bills[0].id).update(destination=None)
+        expected = JSONRenderer().render(BillSerializer(bills.select_related('destination'), many=True).data)
+        self.assertEqual(render_bills(bills.values_list(*BILL_ROW)), expected)
+        self.assertEqual(self.client.get(self.BILL_URL + '99988526423/2017/12/').content, expected)
+
+    def test_indented_json_uses_the_serializer(self):
+        response = self.client.get(self.CALL_URL, HTTP_ACCEPT='application/json; indent=2')
+        self.assertEqual(response.json(), json.loads(self.client.get(self.CALL_URL).content.decode('utf-8')))
+        self.assertIn(b'\n  ', response.content)
+
+
+class MetricsTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        self.client = APIClient()
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test.', ('mode',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{mode="a\\"b",le="0.1"} 2',
+            'test_seconds_bucket{mode="a\\"b",le="1"} 3',
+            'test_seconds_bucket{mode="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{mode="a\\"b"} 3.65',
+            'test_seconds_count{mode="a\\"b"} 4',
+        ])
+
+    def test_request_metrics(self):
+        created = REQUESTS.get('POST', 'call-list', '201')
+        queries = REQUEST_QUERIES.get_sum('POST', 'call-list')
+        priced = PRICING_DURATION.get_count()
+        paired = PAIRING_DURATION.get_count('single')
+
+        self.client.post(self.CALL_URL, {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                                         "source": "99988526423", "destination": "9993468278"}, format='json')
+        self.client.post(self.CALL_URL, {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100},
+                         format='json')
+        self.assertEqual(REQUESTS.get('POST', 'call-list', '201'), created + 2)
+        # 6 queries for the record waiting for its pair: pair lookup, archived keys lookup, savepoint, call insert,
+        # pending insert and savepoint release; 9 for the one completing the call: pair lookup, savepoint, pending
+        # lock, call insert, pending delete, bill insert, totals upsert, savepoint release and snapshot lookup
+        self.assertEqual(REQUEST_QUERIES.get_sum('POST', 'call-list'), queries + 15)
+        self.assertEqual(PRICING_DURATION.get_count(), priced + 1)
+        self.assertEqual(PAIRING_DURATION.get_count('single'), paired + 2)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn(
+            'http_requests_total{{method="POST",endpoint="call-list",status="201"}} {}'.format(created + 2),
+            response.content.decode('utf-8')
+        )
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(CALL_PROFILE_DIR=directory, CALL_PROFILE_SAMPLE_RATE=0):
+            response = self.client.get(self.CALL_URL)
+            self.assertFalse(response.has_header('X-Profile-Dump'))
+            response = self.client.get(self.CALL_URL, HTTP_X_PROFILE='1')
+        self.assertEqual(os.listdir(directory), [response['X-Profile-Dump']])
+        self.assertIn('GET-api_v1_call', response['X-Profile-Dump'])
+        stats = pstats.Stats(os.path.join(directory, response['X-Profile-Dump']))
+        self.assertTrue(stats.total_calls)
+
+
+class BillCacheTests(ClearCachesMixin, TestCase):
+    CALL_URL = '/api/v1/call/'
+    BILL_URL = '/api/v1/bill/99988526423/2016/02/'
+
+    def setUp(self):
+        super(BillCacheTests, self).setUp()
+        self.client = APIClient()
+
+    def post_call(self, call_id, source='99988526423'):
+        records = [
+            {"type": "start", "timestamp": "2016-02-19T21:57:13Z", "call_id": call_id, "source": source,
+             "destination": "9993468278"},
+            {"type": "end", "timestamp": "2016-02-19T22:10:56Z", "call_id": call_id},
+        ]
+        for record in records:
+            self.client.post(self.CALL_URL, record, format='json')
+
+    def test_bill_is_cached_until_a_call_is_billed(self):
+        self.post_call(100)
+        with self.assertNumQueries(3):
+            first = self.client.get(self.BILL_URL)
+        # only the snapshot of the closed period and the version of the entry, its bill total, are looked up
+        with self.assertNumQueries(2):
+            second = self.client.get(self.BILL_URL)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual((second['X-Bill-Calls'], second['X-Bill-Total']), ('1', 'R$ 0,54'))
+
+        # another subscriber keeps the entry
+        self.post_call(101, source='99988526424')
+        with self.assertNumQueries(2):
+            self.client.get(self.BILL_URL)
+
+        self.post_call(102)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.BILL_URL)
+        self.assertEqual(len(response.json()), 2)
+
+        # the bulk endpoint invalidates it too
+        self.client.post(self.CALL_URL + 'bulk/', [
+            {"type": "start", "timestamp": "2016-02-20T10:00:00Z", "call_id": 103, "source": "99988526423",
+             "destination": "9993468278"},
+            {"type": "end", "timestamp": "2016-02-20T10:01:00Z", "call_id": 103},
+        ], format='json')
+        response = self.client.get(self.BILL_URL)
+        self.assertEqual((len(response.json()), response['X-Bill-Calls']), (3, '3'))
+
+    def test_cached_pages(self):
+        for call_id in range(100, 103):
+            self.post_call(call_id)
+        expected = self.client.get(self.BILL_URL).json()
+        pages, url = [], self.BILL_URL + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            pages.append(response.json())
+            url = response.get('Link', '')[1:-len('>; rel="next"')] or None
+        self.assertEqual(pages, [expected[:2], expected[2:]])
+
+    def test_invalidated_by_another_process(self):
+        """ the bills inserted by another process, with a cache of its own, are seen once committed
+        """
+        self.post_call(100)
+        self.assertEqual(len(bill_cache.get('99988526423', 2016, 2)), 1)
+        other = BillCache('other')
+        with override_settings(CACHES=dict(settings.CACHES, other={
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other',
+        })):
+            with patch('call.ingest.bill_cache', other):
+                ingest_records([
+                    {"type": "start", "timestamp": "2016-02-20T10:00:00Z", "call_id": 101, "source": "99988526423",
+                     "destination": "9993468278"},
+                    {"type": "end", "timestamp": "2016-02-20T10:01:00Z", "call_id": 101},
+                ])
+            self.assertEqual(len(bill_cache.get('99988526423', 2016, 2)), 2)
+
+            # with a shared cache, the versions are kept in it and bumped by the other process
+            with override_settings(CALL_BILL_CACHE_SHARED=True):
+                self.assertEqual(len(bill_cache.get('99988526423', 2016, 2)), 2)
+                Bill.objects.filter(source='99988526423', year=2016, month=2).delete()
+                shared = BillCache(BILL_CACHE)
+                shared.invalidate([Bill(source='99988526423', year=2016, month=2)])
+                self.assertEqual(bill_cache.get('99988526423', 2016, 2), [])
+
+    def test_stampede(self):
+        self.post_call(100)
+        version = bill_cache.get_version('99988526423', 2016, 2)
+        key = bill_cache.entry_key('99988526423', 2016, 2, version)
+        # a request is loading the bill: the next one waits for its rows instead of querying the database
+        self.assertTrue(bill_cache.cache.add(key + ':lock', 1))
+        loaded = threading.Timer(0.05, bill_cache.cache.set, (key, ['loaded']))
+        loaded.start()
+        # the version only
+        with self.assertNumQueries(1):
+            self.assertEqual(bill_cache.get('99988526423', 2016, 2), ['loaded'])
+        loaded.join()
+
+        # after waiting for the lock timeout, it queries the database itself
+        bill_cache.cache.delete(key)
+        with override_settings(CALL_BILL_CACHE_LOCK_TIMEOUT=0.02), self.assertNumQueries(2):
+            self.assertEqual(len(bill_cache.get('99988526423', 2016, 2)), 1)
+
+
+class SimulateTariffTests(TestCase):
+    CALLS = (
+        (71, '2017-12-11T15:07:13Z', '2017-12-11T15:14:56Z'),
+        (72, '2017-12-12T22:47:56Z', '2017-12-12T22:50:56Z'),
+        (73, '2017-12-12T21:57:13Z', '2017-12-12T22:10:56Z'),
+        (74, '2017-12-12T04:57:13Z', '2017-12-12T06:10:56Z'),
+        (75, '2017-12-13T21:57:13Z', '2017-12-14T22:10:56Z'),
+        (76, '2017-12-12T15:07:58Z', '2017-12-12T15:12:56Z'),
+    )
+
+    def setUp(self):
+        super(SimulateTariffTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        records = []
+        for call_id, start, end in self.CALLS:
+            records.append({"type": "start", "timestamp": start, "call_id": call_id, "source": "99988526423",
+                            "destination": "9993468278"})
+            records.append({"type": "end", "timestamp": end, "call_id": call_id})
+        ingest_records(records)
+
+    def simulate(self, *args):
+        out = StringIO()
+        call_command('simulate_tariff', '--year', '2017', '--month', '12', *args, stdout=out)
+        return out.getvalue()
+
+    def test_current_tariff_keeps_the_prices(self):
+        prices = list(Bill.objects.order_by('id').values_list('price', flat=True))
+        path = os.path.join(self.directory, 'impact.csv')
+        out = self.simulate(
+            '--fixed-charge', '0.36', '--band', '06:00-22:00=0.09', '--band', '22:00-06:00=0.00', '--output', path
+        )
+        self.assertIn('2017/12: 6 calls of 1 subscribers, R$ 90,90 now, R$ 90,90 simulated (+R$ 0,00)', out)
+        with open(path) as impact:
+            self.assertEqual(impact.read().splitlines(), [
+                'source,year,month,calls,current_price,simulated_price', '99988526423,2017,12,6,9090,9090',
+            ])
+        self.assertEqual(list(Bill.objects.order_by('id').values_list('price', flat=True)), prices)
+
+    def test_candidate_tariff(self):
+        # a cheaper standing charge (6 * -R$ 0,06) and the 566 minutes of the nights charged (+R$ 5,66)
+        out = self.simulate(
+            '--fixed-charge', '0.30', '--band', '06:00-22:00=0.09', '--band', '22:00-06:00=0.01', '--months', '2'
+        )
+        self.assertIn('2017/11: 0 calls of 0 subscribers', out)
+        self.assertIn('R$ 90,90 now, R$ 96,20 simulated (+R$ 5,30)', out)
+
+        plan = TariffPlan.objects.create(name='Flat', effective_from='2030-01-01T00:00:00Z', fixed_charge='1.00')
+        self.assertIn('R$ 6,00 simulated (-R$ 84,90)', self.simulate('--plan', str(plan.pk)))
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesMessage(CommandError, 'Inform --plan'):
+            self.simulate()
+        with self.assertRaisesMessage(CommandError, 'Invalid band'):
+            self.simulate('--fixed-charge', '0.36', '--band', '06:00=0.09')
+        with self.assertRaisesMessage(CommandError, 'not both'):
+            self.simulate('--plan', '1', '--fixed-charge', '0.36')
+
+
+class AsgiTests(ClearCachesMixin, TransactionTestCase):
+    """ the threads of the pool use their own connections, they see the rows committed by the test only
+    """
+    CALL_URL = '/api/v1/call/'
+
+    def setUp(self):
+        super(AsgiTests, self).setUp()
+        self.application = AsgiHandler(get_wsgi_application(), pool_size=2)
+        self.addCleanup(self.application.executor.shutdown)
+
+    def request(self, method, path, body=b'', query_string=b'', chunk_size=None, disconnect_after=None):
+        """ (status, headers, body messages) of a request, its body received in chunks of ``chunk_size`` bytes
+
+            The client stays until the response is sent, or disconnects once it got ``disconnect_after`` messages.
+        """
+        chunk_size = chunk_size or max(1, len(body))
+        messages = [
+            {'type': 'http.request', 'body': body[offset:offset + chunk_size],
+             'more_body': offset + chunk_size < len(body)}
+            for offset in range(0, max(1, len(body)), chunk_size)
+        ]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            while disconnect_after is None or len(sent) < disconnect_after:
+                await asyncio.sleep(0.001)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if disconnect_after is not None:
+                # a slow client
+                await asyncio.sleep(0.005)
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'http_version': '1.1',
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+        }
+        asyncio.run(self.application(scope, receive, send))
+        if not sent:
+            return None, None, []
+        return sent[0]['status'], dict(sent[0]['headers']), [message['body'] for message in sent[1:]]
+
+    def test_call_and_bill(self):
+        records = [
+            {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100, "source": "99988526423",
+             "destination": "9993468278"},
+            {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100},
+        ]
+        for record in records:
+            status_code, headers, body = self.request('POST', self.CALL_URL, json.dumps(record).encode(), chunk_size=7)
+            self.assertEqual(status_code, status.HTTP_201_CREATED)
+            self.assertEqual(json.loads(b''.join(body))['call_id'], 100)
+
+        status_code, headers, body = self.request('GET', '/api/v1/bill/99988526423/2017/12/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual((headers[b'content-type'], headers[b'x-bill-total']), (b'application/json', b'R$ 0,54'))
+        self.assertEqual(b''.join(body), self.client.get('/api/v1/bill/99988526423/2017/12/').content)
+
+    @override_settings(CALL_EXPORT_CHUNK_SIZE=1)
+    def test_streamed_export(self):
+        for call_id in range(100, 103):
+            Call.objects.create(type='start', timestamp='2017-12-12T21:57:13Z', call_id=call_id,
+                                source='99988526423', destination='9993468278')
+        status_code, headers, body = self.request('GET', self.CALL_URL + 'export/')
+        self.assertEqual((status_code, headers[b'content-type']), (200, b'application/x-ndjson'))
+        # a message per chunk of the export, and the last one ending the body
+        self.assertEqual(len(body), 4)
+        self.assertEqual(b''.join(body), b''.join(self.client.get(self.CALL_URL + 'export/').streaming_content))
+
+    @override_settings(CALL_EXPORT_CHUNK_SIZE=1)
+    def test_streamed_export_stops(self):
+        for call_id in range(100, 110):
+            Call.objects.create(type='start', timestamp='2017-12-12T21:57:13Z', call_id=call_id,
+                                source='99988526423', destination='9993468278')
+
+        # the client leaves after the first chunks
+        _, _, body = self.request('GET', self.CALL_URL + 'export/', disconnect_after=3)
+        self.assertLess(len(body), 8)
+
+        # the server shuts down while the export is streamed: the loop keeps sending the chunks of the thread
+        # until it stops, then the pool is shut down
+        sent = []
+        requests = [{'type': 'http.request', 'body': b''}]
+        lifespan = [{'type': 'lifespan.shutdown'}]
+
+        async def receive_request():
+            if requests:
+                return requests.pop(0)
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+            await asyncio.sleep(0.005)
+
+        async def receive_lifespan():
+            while len(sent) < 3:
+                await asyncio.sleep(0.001)
+            return lifespan.pop(0)
+
+        async def serve():
+            scope = {'type': 'http', 'method': 'GET', 'path': self.CALL_URL + 'export/',
+                     'headers': [(b'host', b'testserver')]}
+            lifespan_sent = []
+
+            async def send_lifespan(message):
+                lifespan_sent.append(message)
+
+            await asyncio.wait_for(asyncio.gather(
+                self.application(scope, receive_request, send),
+                self.application({'type': 'lifespan'}, receive_lifespan, send_lifespan),
+            ), timeout=10)
+            return lifespan_sent
+
+        with override_settings(CALL_WARM_UP=False):
+            self.assertEqual(asyncio.run(serve()), [{'type': 'lifespan.shutdown.complete'}])
+        self.assertLess(len(sent), 8)
+
+    def test_body_limits(self):
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            status_code, _, body = self.request('POST', self.CALL_URL, b'{"type": "start"}', chunk_size=5)
+        self.assertEqual((status_code, body), (413, [b'Request body too large.']))
+
+        # a client leaving before sending its body is not answered
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application({'type': 'http', 'method': 'POST', 'path': self.CALL_URL}, receive, send))
+        self.assertEqual(sent, [])
+        self.assertFalse(Call.objects.exists())
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        tariffs.clear()
+        with patch('call.asgi.warm_database') as warm_database:
+            asyncio.run(self.application({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, [{'type': 'lifespan.startup.complete'}, {'type': 'lifespan.shutdown.complete'}])
+        # the tariffs are loaded and every thread of the pool connects
+        self.assertIsNotNone(tariffs._index)
+        self.assertEqual(warm_database.call_count, 2)
+
+
+class DatabaseConnectionTests(TransactionTestCase):
+    """ health checks of the connections kept open between requests, outside of the atomic block of a TestCase
+    """
+
+    def setUp(self):
+        connection.ensure_connection()
+        self.addCleanup(setattr, db._last_used, 'aliases', {})
+
+    def idle_for(self, seconds):
+        db._last_used.aliases = {connection.alias: time_module.monotonic() - seconds}
+
+    @override_settings(CALL_DB_HEALTH_CHECK_INTERVAL=30)
+    def test_health_check(self):
+        closed = db.DB_HEALTH_CHECKS.get('closed')
+        self.idle_for(60)
+        with patch.object(connection, 'is_usable', return_value=False), patch.object(connection, 'close') as close:
+            db.check_connections()
+        close.assert_called_once_with()
+        self.assertEqual(db.DB_HEALTH_CHECKS.get('closed'), closed + 1)
+
+        usable = db.DB_HEALTH_CHECKS.get('usable')
+        with patch.object(connection, 'close') as close:
+            db.check_connections()
+        close.assert_not_called()
+        self.assertEqual(db.DB_HEALTH_CHECKS.get('usable'), usable + 1)
+
+        # a connection used recently, or in a transaction, is not pinged
+        with patch.object(connection, 'is_usable') as is_usable:
+            self.idle_for(10)
+            db.check_connections()
+            self.idle_for(60)
+            with transaction.atomic():
+                db.check_connections()
+            with override_settings(CALL_DB_HEALTH_CHECK_INTERVAL=0):
+                db.check_connections()
+        is_usable.assert_not_called()
+
+    def test_release(self):
+        self.assertEqual(self.client.get('/api/v1/bill/99988526423/').status_code, status.HTTP_200_OK)
+        self.assertLess(time_module.monotonic() - db._last_used.aliases[connection.alias], 5)
+
+
+class WarmUpTests(TestCase):
+
+    def test_warm_up(self):
+        tariffs.clear()
+        self.assertEqual(list(warm_up(connect=False)), ['urls', 'serializers'])
+        self.assertFalse(tariffs._index)
+
+        with self.assertNumQueries(2):
+            timings = warm_up()
+        self.assertEqual(list(timings), ['urls', 'serializers', 'database', 'tariffs'])
+        self.assertIsNotNone(tariffs._index)
+        tariffs.clear()
+
+
+class BillTotalTests(ClearCachesMixin, TestCase):
+    SUMMARY_URL = '/api/v1/bill/99988526423/2017/12/summary/'
+
+    def setUp(self):
+        super(BillTotalTests, self).setUp()
+        self.client = APIClient()
+
+    def ingest(self, calls):
+        records = []
+        for call_id, start, end in calls:
+            records.append({"type": "start", "timestamp": start, "call_id": call_id, "source": "99988526423",
+                            "destination": "9993468278"})
+            records.append({"type": "end", "timestamp": end, "call_id": call_id})
+        ingest_records(records)
+
+    def assertTotals(self, call_count, total_duration, total_price):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.SUMMARY_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(
+            (data['source'], data['year'], data['month'], data['call_count'], data['total_duration'],
+             data['total_price']),
+            ('99988526423', 2017, 12, call_count, total_duration, total_price)
+        )
+
+    def test_created_bills(self):
+        self.client.post('/api/v1/call/', {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                                           "source": "99988526423", "destination": "9993468278"}, format='json')
+        self.assertTotals(0, '0h0m0s', 'R$ 0,00')
+        self.client.post('/api/v1/call/', {"type": "end", "timestamp": "2017-12-12T22:17:53Z", "call_id": 100},
+                         format='json')
+        self.assertTotals(1, '0h20m40s', 'R$ 0,54')
+
+        self.ingest(SimulateTariffTests.CALLS)
+        self.assertTotals(7, '26h17m30s', 'R$ 91,44')
+        self.ingest([(101, '2017-12-20T10:00:00Z', '2017-12-20T10:01:30Z')])
+        self.assertTotals(8, '26h19m0s', 'R$ 91,89')
+
+    def test_without_upsert(self):
+        with patch('call.totals.supports_upsert', return_value=False):
+            self.ingest(SimulateTariffTests.CALLS[:3])
+            self.ingest(SimulateTariffTests.CALLS[3:])
+        self.assertTotals(6, '25h56m50s', 'R$ 90,90')
+
+    def test_current_period(self):
+        response = self.client.get('/api/v1/bill/99988526423/summary/')
+        today = date.today()
+        self.assertEqual(response.json(), {
+            'source': '99988526423', 'year': today.year, 'month': today.month, 'call_count': 0,
+            'total_duration': '0h0m0s', 'total_price': 'R$ 0,00', 'updated': None,
+        })
+
+    def test_reconcile(self):
+        self.ingest(SimulateTariffTests.CALLS)
+        self.ingest([(102, '2017-11-20T10:00:00Z', '2017-11-20T10:01:30Z')])
+        BillTotal.objects.filter(month=12).update(call_count=F('call_count') - 1, total_price=1)
+        BillTotal.objects.filter(month=11).delete()
+        BillTotal.objects.create(source='11999999999', year=2017, month=12, call_count=1, updated=timezone.now())
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Reconciled 1 period(s)'):
+            call_command('reconcile_bill_totals', '--year', '2017', '--month', '11', stdout=out)
+        self.assertIn('99988526423 2017/11: 1 call(s), 0h1m30s, R$ 0,45 in the bills, 0 call(s), 0h0m0s, '
+                      'R$ 0,00 in the totals.', out.getvalue())
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Reconciled 2 period(s)'):
+            call_command('reconcile_bill_totals', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+        self.assertIn('11999999999 2017/12: 0 call(s), 0h0m0s, R$ 0,00 in the bills', out.getvalue())
+
+        out = StringIO()
+        call_command('reconcile_bill_totals', '--fix', stdout=out)
+        self.assertIn('3 total(s) drifted, fixed.', out.getvalue())
+        self.assertTotals(6, '25h56m50s', 'R$ 90,90')
+        self.assertEqual(BillTotal.objects.get(source='11999999999').call_count, 0)
+        self.assertEqual(reconcile(2017, 11), [])
+        self.assertEqual(reconcile(2017, 12), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'copies the SQLite test database')
+@override_settings(CALL_DB_REPLICAS=['replica'])
+class ReplicaRouterTests(ClearCachesMixin, TestCase):
+    """ a second SQLite database as the replica, migrated but never written: the calls posted to the primary are
+        missing from it, like from a replica lagging behind
+    """
+    databases = {'default', 'replica'}
+    BILL_URL = '/api/v1/bill/99988526423/2017/12/'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        path = os.path.join(cls.directory, 'replica.sqlite3')
+        # a copy of the migrated test database, the data migrations would write to the primary
+        connection.ensure_connection()
+        replica = sqlite3.connect(path)
+        connection.connection.backup(replica)
+        replica.close()
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+        super(ReplicaRouterTests, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaRouterTests, cls).tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        super(ReplicaRouterTests, self).setUp()
+        self.client = APIClient()
+        self.client.post('/api/v1/call/', {"type": "start", "timestamp": "2017-12-12T21:57:13Z", "call_id": 100,
+                                           "source": "99988526423", "destination": "9993468278"}, format='json')
+        response = self.client.post('/api/v1/call/', {"type": "end", "timestamp": "2017-12-12T22:17:53Z",
+                                                      "call_id": 100}, format='json')
+        self.call_url = '/api/v1/call/{}/'.format(response.json()['id'])
+
+    def test_listings_read_the_replica(self):
+        # the replica has not received the bill yet once the subscriber is no longer pinned to the primary
+        bill_cache.clear()
+        reads = REPLICA_READS.get('replica')
+        self.assertEqual(self.client.get(self.BILL_URL).json(), [])
+        self.assertEqual(self.client.get(self.BILL_URL + 'summary/').json()['call_count'], 0)
+        self.assertEqual(self.client.get('/api/v1/call/').json(), [])
+        self.assertEqual(self.client.get('/api/v1/call/export/').getvalue(), b'')
+        self.assertEqual(REPLICA_READS.get('replica'), reads + 4)
+
+        # the call just posted is retrieved from the primary
+        self.assertEqual(self.client.get(self.call_url).json()['call_id'], 100)
+
+    def test_sticky_subscriber(self):
+        response = self.client.get(self.BILL_URL)
+        self.assertEqual(response['X-Bill-Calls'], '1')
+        self.assertEqual(self.client.get(self.BILL_URL + 'summary/').json()['total_price'], 'R$ 0,54')
+        # other subscribers read the replica
+        with replica_reads('99988526424') as alias:
+            self.assertEqual(alias, 'replica')
+        with override_settings(CALL_DB_STICKY_SECONDS=0):
+            self.client.post('/api/v1/call/bulk/', [
+                {"type": "start", "timestamp": "2017-12-13T21:57:13Z", "call_id": 101, "source": "99988526424",
+                 "destination": "9993468278"},
+                {"type": "end", "timestamp": "2017-12-13T22:17:53Z", "call_id": 101},
+            ], format='json')
+            with replica_reads('99988526424') as alias:
+                self.assertEqual(alias, 'replica')
+
+    def test_router(self):
+        with replica_reads() as alias:
+            self.assertEqual(
+                (alias, router.db_for_read(Bill), router.db_for_write(Bill)), ('replica', 'replica', 'default')
+            )
+        self.assertEqual(router.db_for_read(Bill), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'call'))
+        self.assertTrue(router.allow_migrate('default', 'call'))
+        with override_settings(CALL_DB_REPLICAS=[]), replica_reads() as alias:
+            self.assertEqual((alias, router.db_for_read(Bill)), ('default', 'default'))
@@ -0,0 +1,155 @@
+""" Running totals of the bill of each subscriber for each period, see call.models.BillTotal.
+
+Both paths writing bills (CallSerializer.create and call.ingest.ingest_records) call ``add_bills`` in the
+transaction inserting them. The totals of a batch are added with one ``INSERT ... ON CONFLICT DO UPDATE``
+incrementing the stored counters, so concurrent requests billing calls of the same subscriber never overwrite
+each other's increments. Backends without the upsert (SQLite before 3.24) update, then create, row by row.
+
+``reconcile`` compares the totals of a period with the ones recomputed from its bills, in one statement so both
+sides are read from the same snapshot, and ``fix`` adds the differences to the stored counters, so calls billed
+while reconciling are counted once.
+"""
+from collections import namedtuple
+from datetime import date
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from call.models import Bill, BillTotal
+
+# the counters of a total, in the order of the upsert
+COUNTERS = ('call_count', 'total_duration', 'total_price')
+
+Drift = namedtuple('Drift', ('source', 'year', 'month', 'expected', 'stored'))
+
+
+def current_period(today=None):
+    today = today or date.today()
+    return today.year, today.month
+
+
+def get_total(source, year, month):
+    """ the totals of a subscriber for a period, an unsaved BillTotal of zeros when it has no bill
+    """
+    total = BillTotal.objects.filter(source=source, year=year, month=month).first()
+    if total is None:
+        total = BillTotal(source=source, year=year, month=month)
+    return total
+
+
+def bill_deltas(bills):
+    """ {(source, year, month): [call_count, total_duration, total_price]} of new bills
+    """
+    deltas = {}
+    for bill in bills:
+        if not bill.source:
+            continue
+        delta = deltas.setdefault((bill.source, bill.year, bill.month), [0, 0, 0])
+        delta[0] += 1
+        delta[1] += bill.duration
+        delta[2] += bill.price
+    return deltas
+
+
+def supports_upsert(connection=connection):
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 24)
+
+
+def add(deltas):
+    """ add {(source, year, month): (call_count, total_duration, total_price)} to the stored totals
+    """
+    now = timezone.now()
+    # always in the same order, so two transactions adding to the same totals do not deadlock
+    rows = [key + tuple(deltas[key]) + (now,) for key in sorted(deltas)]
+    if not rows:
+        return
+    if not supports_upsert():
+        for row in rows:
+            _add_row(*row)
+        return
+
+    table = connection.ops.quote_name(BillTotal._meta.db_table)
+    columns = ('source', 'year', 'month') + COUNTERS + ('updated',)
+    increments = ', '.join(
+        '{column} = {table}.{column} + excluded.{column}'.format(table=table, column=connection.ops.quote_name(name))
+        for name in COUNTERS
+    )
+    sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT (source, year, month) DO UPDATE SET {}, updated = excluded.updated'
+    size = min(500, (connection.features.max_query_params or len(rows) * len(columns)) // len(columns))
+    with connection.cursor() as cursor:
+        for index in range(0, len(rows), size):
+            chunk = rows[index:index + size]
+            cursor.execute(
+                sql.format(
+                    table, ', '.join(connection.ops.quote_name(name) for name in columns),
+                    ', '.join(['({})'.format(', '.join(['%s'] * len(columns)))] * len(chunk)), increments
+                ),
+                [value for row in chunk for value in row]
+            )
+
+
+def _add_row(source, year, month, call_count, total_duration, total_price, updated):
+    increments = dict(
+        call_count=F('call_count') + call_count, total_duration=F('total_duration') + total_duration,
+        total_price=F('total_price') + total_price, updated=updated,
+    )
+    totals = BillTotal.objects.filter(source=source, year=year, month=month)
+    if totals.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            BillTotal.objects.create(
+                source=source, year=year, month=month, call_count=call_count, total_duration=total_duration,
+                total_price=total_price, updated=updated
+            )
+    except IntegrityError:
+        # created meanwhile by a concurrent transaction
+        totals.update(**increments)
+
+
+def add_bills(bills):
+    """ add new bills to the totals of their subscribers and periods
+    """
+    add(bill_deltas(bills))
+
+
+def reconcile(year, month):
+    """ the Drift of every total of a period differing from the sum of its bills, missing or without bills
+    """
+    bill_table = connection.ops.quote_name(Bill._meta.db_table)
+    total_table = connection.ops.quote_name(BillTotal._meta.db_table)
+    sql = (
+        'SELECT b.source, b.call_count, b.total_duration, b.total_price, t.call_count, t.total_duration, '
+        't.total_price FROM ('
+        '  SELECT source, COUNT(*) AS call_count, SUM(duration) AS total_duration, SUM(price) AS total_price'
+        '  FROM {bills} WHERE year = %s AND month = %s AND source IS NOT NULL GROUP BY source'
+        ') b LEFT JOIN {totals} t ON t.source = b.source AND t.year = %s AND t.month = %s '
+        'UNION ALL '
+        'SELECT t.source, 0, 0, 0, t.call_count, t.total_duration, t.total_price FROM {totals} t '
+        'WHERE t.year = %s AND t.month = %s AND NOT EXISTS ('
+        '  SELECT 1 FROM {bills} b WHERE b.source = t.source AND b.year = t.year AND b.month = t.month'
+        ')'
+    ).format(bills=bill_table, totals=total_table)
+    drifts = []
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [year, month] * 3)
+        for row in cursor:
+            expected = tuple(row[1:4])
+            stored = tuple(value or 0 for value in row[4:7])
+            if expected != stored:
+                drifts.append(Drift(row[0], year, month, expected, stored))
+    return drifts
+
+
+def fix(drifts):
+    """ add the differences of reconciled totals, so they match their bills
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # row by row, the proposed row of an upsert would hold the negative differences and fail the checks
+        for drift in sorted(drifts):
+            differences = [expected - stored for expected, stored in zip(drift.expected, drift.stored)]
+            _add_row(drift.source, drift.year, drift.month, *differences, now)
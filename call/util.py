@@ -1,47 +1,105 @@
-from datetime import timedelta, time
-from string import Template
+from collections import namedtuple
+
+from django.db import connection
 
 from call.config import Constants
-from call.models import Call
+from call.metrics import PRICING_DURATION
+from call.models import Bill, Call
+from call.tariff import tariffs
 
+CallCharge = namedtuple('CallCharge', ('duration', 'price', 'tariff_id'))
 
-class CalculateBill:
-    """ class to calculate telephone bills
+
+def in_lookup_chunks(values):
+    """ split the values of an ``IN`` lookup to respect the backend limit of query parameters (999 on SQLite)
     """
+    values = list(values)
+    size = connection.features.max_query_params or len(values) or 1
+    for index in range(0, len(values), size):
+        yield values[index:index + size]
 
-    def __init__(self, call_id):
-        self.call_id = call_id
 
-    def get_call_duration(self):
+def format_duration(seconds):
+    """ format a duration in seconds like 0h35m42s
+    """
+    minutes, seconds = divmod(seconds, 60)
+    return '{}h{}m{}s'.format(*divmod(minutes, 60), seconds)
 
-        call_start = Call.objects.get(type=Constants.START, call_id=self.call_id).timestamp
-        call_end = Call.objects.get(type=Constants.END, call_id=self.call_id).timestamp
 
-        delta = call_end - call_start
-        result_dict = {}
-        time_dict = {'H': 3600, 'M': 60, 'S': 1}
-        rem = int(delta.total_seconds())
+def format_price(cents):
+    """ format a price in centavos like R$ 3,96
+    """
+    return 'R$ {},{:02d}'.format(*divmod(cents, 100))
 
-        for k in ('H', 'M', 'S'):
-            result_dict[k], rem = divmod(rem, time_dict[k])
 
-        t = Template("${H}h${M}m${S}s")
-        return t.substitute(**result_dict)
+def calculate_call(call_start, call_end, tariff=None):
+    """ duration in seconds and price in centavos of a call from the datetimes of its start and end, without
+        touching the ORM
+
+        The tariff defaults to the one in effect when the call started, taken from the in-memory tariff cache.
+    """
+    with PRICING_DURATION.time():
+        if tariff is None:
+            tariff = tariffs.get(call_start)
+        return CallCharge(
+            duration=int((call_end - call_start).total_seconds()),
+            price=tariff.get_price(call_start, call_end),
+            tariff_id=tariff.id
+        )
 
-    def get_call_price(self):
 
-        call_start = Call.objects.get(type=Constants.START, call_id=self.call_id).timestamp
-        call_end = Call.objects.get(type=Constants.END, call_id=self.call_id).timestamp
+def make_bill(call_start, call_end):
+    """ unsaved Bill of a call from its start and end records
+    """
+    charge = calculate_call(call_start.timestamp, call_end.timestamp)
+    return Bill(
+        destination=call_start,
+        source=call_start.source,
+        start_date=call_start.timestamp.date(),
+        start_time=call_start.timestamp.time(),
+        duration=charge.duration,
+        # a call belongs to the period in which it has ended
+        month=call_end.timestamp.month,
+        year=call_end.timestamp.year,
+        price=charge.price,
+        tariff_id=charge.tariff_id
+    )
+
 
-        minutes = 0
+class CalculateBill:
+    """ class to calculate telephone bills
 
-        while call_start < call_end:
-            call_start = call_start + timedelta(minutes=1)
-            if call_start < call_end and time(6, 0, 0) < call_start.time() < time(22, 0, 0):
-                minutes += 1
+        The start and end of the call can be given as already loaded Call records or datetimes, otherwise both
+        records are fetched with a single query the first time they are needed.
+    """
 
-        subtotal = minutes * Constants.CHARGE_MINUTE
+    def __init__(self, call_id, call_start=None, call_end=None):
+        self.call_id = call_id
+        self.call_start = call_start.timestamp if isinstance(call_start, Call) else call_start
+        self.call_end = call_end.timestamp if isinstance(call_end, Call) else call_end
 
-        total = round(Constants.FIXED_CHARGE + subtotal, 2)
-        total_str = str(total).replace('.', ',')
-        return 'R$ {}'.format(total_str)
+    def _load(self):
+        if self.call_start is None or self.call_end is None:
+            timestamps = dict(
+                Call.objects.filter(call_id=self.call_id, type__in=(Constants.START, Constants.END))
+                .values_list('type', 'timestamp')
+            )
+            if Constants.START not in timestamps or Constants.END not in timestamps:
+                raise Call.DoesNotExist('The call {} does not have start and end records.'.format(self.call_id))
+            self.call_start = timestamps[Constants.START]
+            self.call_end = timestamps[Constants.END]
+        return self.call_start, self.call_end
+
+    def get_call_duration(self):
+        call_start, call_end = self._load()
+        return format_duration(int((call_end - call_start).total_seconds()))
+
+    def get_tariff(self):
+        """ the tariff plan in effect when the call started
+        """
+        call_start, call_end = self._load()
+        return tariffs.get(call_start)
+
+    def get_call_price(self):
+        call_start, call_end = self._load()
+        return format_price(calculate_call(call_start, call_end).price)
@@ -1,3 +1,9 @@
-from django.shortcuts import render
+from django.http import HttpResponse
 
-# Create your views here.
+from call.metrics import CONTENT_TYPE, registry
+
+
+def metrics(request):
+    """ the metrics of this process in the Prometheus text format
+    """
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
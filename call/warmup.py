@@ -0,0 +1,66 @@
+""" Work a worker does once, before accepting traffic, instead of on its first requests.
+
+The first request of a fresh process imports the views, serializers and parsers behind the URLs, compiles the
+URL patterns, builds the fields of the serializers, loads the tariff plans and opens a database connection.
+``warm_up`` does all of it up front: gunicorn calls it in every worker it forks (see gunicorn.conf.py) and
+call.asgi.AsgiHandler at the startup of its lifespan.
+"""
+import time
+
+from django.db import connections
+
+# requests resolved so the patterns of every included urlconf are compiled
+WARM_PATHS = ('/api/v1/call/', '/api/v1/call/1/', '/api/v1/bill/99988526423/', '/api/v1/bill/99988526423/2017/12/')
+
+
+def warm_urls():
+    from django.urls import Resolver404, get_resolver
+
+    resolver = get_resolver()
+    # imports the urlconfs and the views, compiles every pattern
+    resolver.reverse_dict
+    for path in WARM_PATHS:
+        try:
+            resolver.resolve(path)
+        except Resolver404:
+            pass
+
+
+def warm_serializers():
+    from rest_framework.settings import api_settings
+
+    from call.api.serializers import BillSerializer, CallRecordSerializer, CallSerializer
+
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_PAGINATION_CLASS'):
+        getattr(api_settings, setting)
+    for serializer_class in (CallSerializer, CallRecordSerializer, BillSerializer):
+        serializer_class().fields
+
+
+def warm_tariffs():
+    from call.tariff import tariffs
+
+    tariffs.load()
+
+
+def warm_database():
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def warm_up(connect=True):
+    """ run every warm-up step, {step: seconds} of each
+
+        With ``connect`` false the steps needing the database (loading the tariffs) are skipped, e.g. in a
+        master process forking its workers, which must not share its connections with them.
+    """
+    steps = [('urls', warm_urls), ('serializers', warm_serializers)]
+    if connect:
+        steps.extend((('database', warm_database), ('tariffs', warm_tariffs)))
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    return timings
@@ -0,0 +1,33 @@
+""" gunicorn settings of the web dyno, see Procfile
+
+The master imports the application (``preload_app``) and warms up what does not need the database before forking,
+so the workers share it; each worker then opens its database connection and loads the tariffs before accepting
+requests (``settings.CALL_WARM_UP``, see call.warmup).
+"""
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    # in the master, before the workers are forked: no database connection, they would share it
+    if preload_app:
+        from django.conf import settings
+        from call.warmup import warm_up
+
+        if settings.CALL_WARM_UP:
+            server.log.info('Warmed up in %s', format_timings(warm_up(connect=False)))
+
+
+def post_worker_init(worker):
+    # in each worker, once the application is loaded and before it accepts requests
+    from django.conf import settings
+    from call.warmup import warm_up
+
+    if settings.CALL_WARM_UP:
+        worker.log.info('Worker warmed up in %s', format_timings(warm_up()))
+
+
+def format_timings(timings):
+    return ', '.join('{} {:.1f} ms'.format(name, seconds * 1000) for name, seconds in timings.items())
@@ -0,0 +1,21 @@
+"""
+ASGI config for workatolist project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, the Django application of
+``wsgi.py`` served by ``call.asgi.AsgiHandler``.
+
+Run it with an ASGI server, e.g.
+    gunicorn workatolist.asgi:application -c gunicorn.conf.py -k uvicorn.workers.UvicornH11Worker
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'workatolist.settings')
+
+django_application = get_wsgi_application()
+
+from call.asgi import AsgiHandler  # noqa: E402 (needs the settings)
+
+application = AsgiHandler(django_application)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+from django.core.exceptions import ImproperlyConfigured
 import django_heroku
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'call.middleware.MetricsMiddleware',
+    'call.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,8 +125,134 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+
+# Pricing
+# Seconds a process keeps the tariff plans in memory before reloading them from the database
+
+TARIFF_CACHE_TIMEOUT = int(os.environ.get('TARIFF_CACHE_TIMEOUT', 300))
+
+
+# Ingestion
+# Maximum number of call records accepted by a single request to /api/v1/call/bulk/
+
+CALL_BULK_MAX_RECORDS = int(os.environ.get('CALL_BULK_MAX_RECORDS', 10000))
+
+# 'sync' pairs and prices the records inside the request, 'async' queues them for the process_ingest_queue workers
+CALL_INGEST_MODE = os.environ.get('CALL_INGEST_MODE', 'sync')
+
+# Maximum seconds a bill request can wait (?wait=) for the queued records of its period in async mode. The wait
+# holds a worker, keep it short: bills still waiting for records answer with Retry-After for the client to poll
+CALL_BILL_MAX_WAIT = float(os.environ.get('CALL_BILL_MAX_WAIT', 1))
+
+# Seconds clients and proxies may reuse the bill of a closed period before revalidating it with its ETag: a late
+# record rebuilds the bill snapshot with a new ETag
+CALL_SNAPSHOT_MAX_AGE = int(os.environ.get('CALL_SNAPSHOT_MAX_AGE', 60))
+
+# Rows per page of the call and bill listings, and the largest page a client can ask for with ?page_size=
+CALL_PAGE_SIZE = int(os.environ.get('CALL_PAGE_SIZE', 100))
+CALL_MAX_PAGE_SIZE = int(os.environ.get('CALL_MAX_PAGE_SIZE', 1000))
+
+# Calls fetched from the database cursor at a time by the NDJSON export of /api/v1/call/export/
+CALL_EXPORT_CHUNK_SIZE = int(os.environ.get('CALL_EXPORT_CHUNK_SIZE', 2000))
+
+# Responses to recently created call records kept by each process to answer the records resent by the platforms
+CALL_IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('CALL_IDEMPOTENCY_CACHE_SIZE', 10000))
+
+
+# Instrumentation
+# Directory receiving cProfile dumps of the sampled slow requests and of the ones with a X-Profile: 1 header,
+# profiling is off when empty
+
+CALL_PROFILE_DIR = os.environ.get('CALL_PROFILE_DIR', '')
+
+# Share of the requests profiled, and time from which the profile of a sampled request is dumped
+CALL_PROFILE_SAMPLE_RATE = float(os.environ.get('CALL_PROFILE_SAMPLE_RATE', 0.01))
+CALL_PROFILE_SLOW_SECONDS = float(os.environ.get('CALL_PROFILE_SLOW_SECONDS', 0.5))
+
+
+# Database connections
+# 'persistent' keeps the connection of each thread open for CALL_DB_CONN_MAX_AGE seconds, 'pgbouncer' too but to a
+# transaction pooler, without server-side cursors, and 'off' opens a connection per request
+
+CALL_DB_POOLING = os.environ.get('CALL_DB_POOLING', 'persistent')
+CALL_DB_CONN_MAX_AGE = int(os.environ.get('CALL_DB_CONN_MAX_AGE', 600))
+if CALL_DB_POOLING not in ('persistent', 'pgbouncer', 'off'):
+    raise ImproperlyConfigured('CALL_DB_POOLING must be persistent, pgbouncer or off.')
+
+# Seconds a connection stays idle before it is pinged at the start of a request (0 disables the health checks)
+CALL_DB_HEALTH_CHECK_INTERVAL = float(os.environ.get('CALL_DB_HEALTH_CHECK_INTERVAL', 30))
+
+# Connections the database accepts, shared by the WEB_CONCURRENCY workers (gunicorn processes) with 2 kept for
+# the commands. Each worker runs the views under workatolist.asgi in a pool of CALL_DB_POOL_SIZE threads, each
+# thread keeping its own connection
+CALL_DB_MAX_CONNECTIONS = int(os.environ.get('CALL_DB_MAX_CONNECTIONS', 20))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+CALL_DB_POOL_SIZE = int(os.environ.get('CALL_DB_POOL_SIZE', 0)) or max(
+    1, (CALL_DB_MAX_CONNECTIONS - 2) // max(1, WEB_CONCURRENCY)
+)
+
+# Warm each gunicorn worker up (see call.warmup) before it accepts requests
+CALL_WARM_UP = os.environ.get('CALL_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+
+# Bill cache
+# Seconds the rows of a bill stay in the 'bills' cache (0 disables it), and the largest bill cached, in calls
+
+CALL_BILL_CACHE_TIMEOUT = int(os.environ.get('CALL_BILL_CACHE_TIMEOUT', 300))
+CALL_BILL_CACHE_MAX_ROWS = int(os.environ.get('CALL_BILL_CACHE_MAX_ROWS', 10000))
+
+# Maximum seconds a request waits for the bill another request is loading into the cache before loading it too
+CALL_BILL_CACHE_LOCK_TIMEOUT = float(os.environ.get('CALL_BILL_CACHE_LOCK_TIMEOUT', 5))
+
+# Local memory of each process by default, shared by the processes with a Redis URL (needs django-redis)
+CALL_BILL_CACHE_URL = os.environ.get('CALL_BILL_CACHE_URL', '')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'bills': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bills',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+# The versions of the cached bills are kept in the cache when it is shared by the processes inserting bills (the
+# web workers and process_ingest_queue), otherwise read from the database, see call.bill_cache
+CALL_BILL_CACHE_SHARED = bool(CALL_BILL_CACHE_URL)
+if CALL_BILL_CACHE_URL:
+    CACHES['bills'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': CALL_BILL_CACHE_URL,
+    }
+
+
+# Read replicas
+# Database URLs of the read replicas, separated by commas (on Heroku, the URLs of the followers). The bill and call
+# listings read from one of them, see call.routers. Locally another SQLite file will do, for example
+# CALL_DB_REPLICA_URLS=sqlite:////tmp/replica.sqlite3
+
+CALL_DB_REPLICA_URLS = [url.strip() for url in os.environ.get('CALL_DB_REPLICA_URLS', '').split(',') if url.strip()]
+CALL_DB_REPLICAS = ['replica{}'.format(number) for number in range(1, len(CALL_DB_REPLICA_URLS) + 1)]
+DATABASE_ROUTERS = ['call.routers.ReplicaRouter']
+
+# Seconds the bills of a subscriber are read from the primary after new ones were written, longer than the
+# replication lag. Noted in the 'bills' cache, so shared by the processes with CALL_BILL_CACHE_URL only
+CALL_DB_STICKY_SECONDS = float(os.environ.get('CALL_DB_STICKY_SECONDS', 5))
+
 django_heroku.settings(locals())
 
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
-DATABASES['default'].update(db_from_env)
\ No newline at end of file
+DATABASES['default'].update(db_from_env)
+DATABASES['default']['CONN_MAX_AGE'] = 0 if CALL_DB_POOLING == 'off' else CALL_DB_CONN_MAX_AGE
+if CALL_DB_POOLING == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+for alias, url in zip(CALL_DB_REPLICAS, CALL_DB_REPLICA_URLS):
+    DATABASES[alias] = dict(
+        dj_database_url.parse(url, ssl_require=not url.startswith('sqlite')),
+        CONN_MAX_AGE=DATABASES['default']['CONN_MAX_AGE'],
+        DISABLE_SERVER_SIDE_CURSORS=DATABASES['default'].get('DISABLE_SERVER_SIDE_CURSORS', False),
+        # the tests read the test database of the primary
+        TEST={'MIRROR': 'default'},
+    )
\ No newline at end of file
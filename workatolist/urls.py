@@ -1,7 +1,12 @@
 from django.conf.urls import url, include
+from django.contrib import admin
 from django.views.generic.base import RedirectView
 
+from call.views import metrics
+
 urlpatterns = [
     url(r'^$', RedirectView.as_view(url='/api/v1/call/')),
     url(r'^api/', include('call.api.urls')),
+    url(r'^admin/', admin.site.urls),
+    url(r'^metrics$', metrics, name='metrics'),
 ]